@@ -2,10 +2,31 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import datetime
+import importlib.util
 import io
 import os
+import zipfile
 import altair as alt
 
+from battery import shave_peaks
+from batch_generate import (
+    EXCEL_SUFFIXES, SITE_COLUMNS, feasibility_issues, fit_report_frame, generate_chunk,
+    month_hours, read_sites, split_sites, write_portfolio_csv,
+)
+from demand_engine import (
+    FEASIBILITY_STATUS, INVALID, RESOLUTIONS, TOO_HIGH, TOO_LOW, MonthResultCache, build_calendar,
+    build_timeline, check_feasibility, generate_timeline, generate_year,
+)
+from exporters import (
+    long_frame, parquet_bytes, wide_csv_bytes, wide_frame, wide_xlsx_bytes, write_portfolio_parquet,
+)
+from holiday_calendar import MAX_YEAR, MIN_YEAR
+from jobs import CANCELLED, DONE, JobRunner
+from meter_patterns import daily_profiles, derive_patterns
+from presets import PRESET_PATTERNS, normalize_pattern_to_coefficient, normalize_to_percentage
+from profiling import profile, span
+from tariff import TARIFF_PRESETS, calculate_bills
+
 # ==========================================
 # ページ設定（最初に呼ぶ必要あり）
 # ==========================================
@@ -131,140 +152,427 @@ st.markdown("""
 # ==========================================
 # 定数・初期設定
 # ==========================================
-HOLIDAYS_2024 = [
-    "2024-01-01", "2024-01-08", "2024-02-11", "2024-02-12", "2024-02-23",
-    "2024-03-20", "2024-04-29", "2024-05-03", "2024-05-04", "2024-05-05", "2024-05-06",
-    "2024-07-15", "2024-08-11", "2024-08-12", "2024-09-16", "2024-09-22", "2024-09-23",
-    "2024-10-14", "2024-11-03", "2024-11-04", "2024-11-23", 
-    "2024-12-30", "2024-12-31", "2024-01-02", "2024-01-03" 
-]
-
-# プリセットパターンの定義
-PRESET_PATTERNS = {
-    "🏢 標準（オフィス/日中型）": {
-        "weekday": [2, 2, 2, 2, 2, 3, 5, 7, 8, 9, 9, 8, 7, 9, 10, 9, 8, 7, 6, 5, 4, 3, 2, 2],
-        "holiday": [3]*24,
-        "holiday_ratio": 30
-    },
-    "🏭 工場（土日休み）": {
-        "weekday": [2, 2, 2, 2, 2, 3, 5, 8, 9, 10, 9, 9, 5, 9, 10, 9, 8, 6, 3, 2, 2, 2, 2, 2],
-        "holiday": [2]*24,
-        "holiday_ratio": 15
-    },
-    "🏭 工場（土日稼働）": {
-        "weekday": [3, 3, 3, 3, 3, 4, 6, 8, 9, 10, 9, 9, 6, 9, 10, 9, 8, 7, 5, 4, 3, 3, 3, 3],
-        "holiday": [3, 3, 3, 3, 3, 4, 6, 8, 9, 10, 9, 9, 6, 9, 10, 9, 8, 7, 5, 4, 3, 3, 3, 3],
-        "holiday_ratio": 100
-    },
-    "🛒 スーパーマーケット": {
-        "weekday": [4, 4, 4, 4, 4, 5, 6, 7, 8, 8, 9, 9, 9, 9, 9, 9.5, 10, 9.5, 8, 7, 6, 5, 4, 4],
-        "holiday": [4, 4, 4, 4, 4, 5, 7, 8, 9, 9, 9.5, 10, 9.5, 9, 9, 9.5, 10, 9, 8, 7, 6, 5, 4, 4],
-        "holiday_ratio": 100
-    },
-    "📦 倉庫（日中のみ）": {
-        "weekday": [1, 1, 1, 1, 1, 1, 2, 4, 8, 8, 8, 8, 6, 8, 8, 8, 8, 4, 2, 1, 1, 1, 1, 1],
-        "holiday": [1]*24,
-        "holiday_ratio": 20
-    },
-    "🏪 コンビニ（24時間）": {
-        "weekday": [4, 4, 4, 4, 5, 6, 7, 8, 9, 9, 9, 10, 10, 9, 9, 8, 8, 7, 6, 5, 5, 5, 4, 4],
-        "holiday": [4, 4, 4, 4, 5, 6, 7, 8, 9, 9, 9, 10, 10, 9, 9, 8, 8, 7, 6, 5, 5, 5, 4, 4],
-        "holiday_ratio": 90
-    },
-    "🌡️ ほぼフラット（気温連動風）": {
-        "weekday": [6, 6, 6, 6, 6, 6, 7, 8, 9, 10, 10, 10, 10, 10, 9, 8, 7, 6, 6, 6, 6, 6, 6, 6],
-        "holiday": [6, 6, 6, 6, 6, 6, 7, 8, 9, 10, 10, 10, 10, 10, 9, 8, 7, 6, 6, 6, 6, 6, 6, 6],
-        "holiday_ratio": 100
-    }
-}
+YEAR = 2024
+
+# 複数年シミュレーションの最大年数
+MAX_TIMELINE_YEARS = 30
+
+# 入力内容ごとに保持する計算結果の上限（古いものから破棄）
+CACHE_MAX_ENTRIES = 32
+
+# 実行中ジョブの進捗を確認する間隔（秒）
+JOB_POLL_SECONDS = 0.5
+
+# ジョブの種類（Job.label）
+GENERATION_JOB = "デマンド生成"
+BULK_JOB = "一括生成"
+TIMELINE_JOB = "複数年生成"
+
+# 一括計算で1回に生成する拠点数
+BULK_CHUNKSIZE = 256
 
 # ==========================================
-# ユーティリティ関数
+# 計算処理（入力内容のハッシュでキャッシュ）
 # ==========================================
-def is_holiday(date_obj):
-    """日付が休日（土日または祝日）か判定する"""
-    if date_obj.weekday() >= 5:
-        return True
-    date_str = date_obj.strftime("%Y-%m-%d")
-    if date_str in HOLIDAYS_2024:
-        return True
-    return False
-
-def calculate_monthly_params(target_peak, target_total, patterns_in_month):
-    """その月のPeakとTotalを満たす Base_Load(B) と Variable_Width(V) を計算する"""
-    n_hours = len(patterns_in_month)
-    sum_p = sum(patterns_in_month)
-    max_p = max(patterns_in_month)
-    
-    denominator = sum_p - (n_hours * max_p)
-    
-    if denominator == 0:
-        return target_total / n_hours, 0.0
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def build_pattern_preview(pattern_df, holiday_ratio):
+    """パターンプレビュー用の縦持ちデータを作成する"""
+    df_preview = pattern_df.copy()
+    df_preview['Holiday'] = df_preview['Holiday'] * (holiday_ratio / 100.0)
 
-    numerator = target_total - (n_hours * target_peak)
-    
-    v = numerator / denominator
-    b = target_peak - (v * max_p)
-    
-    return b, v
-
-def normalize_to_percentage(raw_list):
-    """リストの合計が100になるように正規化する"""
-    total = sum(raw_list)
-    if total == 0:
-        return [0]*len(raw_list)
-    return [x / total * 100 for x in raw_list]
-
-def optimize_pattern_shape(target_peak, target_total, patterns_in_month, max_iter=20):
-    """パターンの「鋭さ（ガンマ値）」を自動調整する"""
-    current_patterns = np.array(patterns_in_month)
-    
-    low = 0.1
-    high = 10.0
-    best_patterns = current_patterns
-    best_b = 0
-    best_v = 0
-    min_error = float('inf')
-
-    b, v = calculate_monthly_params(target_peak, target_total, current_patterns)
-    
-    if b >= -0.001 and v >= -0.001:
-        return current_patterns, b, v
-
-    for _ in range(max_iter):
-        mid = (low + high) / 2
-        
-        p_max = current_patterns.max()
-        if p_max == 0: break
-        
-        temp_patterns = np.power(current_patterns / p_max, mid) * p_max
-        
-        b, v = calculate_monthly_params(target_peak, target_total, temp_patterns)
-        
-        if b < 0:
-            low = mid
-        elif v < 0:
-            high = mid
-        else:
-            return temp_patterns, b, v
-            
-    p_max = current_patterns.max()
-    if p_max > 0:
-        final_patterns = np.power(current_patterns / p_max, mid) * p_max
-        b, v = calculate_monthly_params(target_peak, target_total, final_patterns)
-        return final_patterns, b, v
+    pattern_long = df_preview.melt('Hour', var_name='Type', value_name='Value')
+    pattern_long['Type'] = pattern_long['Type'].replace({'Weekday': '平日', 'Holiday': '休日'})
+    return pattern_long
+
+def site_coefficients(pattern_df, holiday_ratio):
+    """パターン表から (平日係数, 休日係数) を作る（休日は休日比率を掛ける）"""
+    p_weekday_coef = normalize_pattern_to_coefficient(pattern_df['Weekday'].tolist())
+    p_holiday_coef = normalize_pattern_to_coefficient(pattern_df['Holiday'].tolist())
+
+    h_ratio = holiday_ratio / 100.0
+    p_holiday_coef = [x * h_ratio for x in p_holiday_coef]
+    return p_weekday_coef, p_holiday_coef
+
+def monthly_targets(edited_df):
+    """入力表から {月: {'peak_kw', 'total_kwh'}} を作る"""
+    targets = {}
+    for index, row in edited_df.iterrows():
+        targets[row['月']] = {
+            'peak_kw': row['契約電力(kW)'], 
+            'total_kwh': row['使用電力量(kWh)']
+        }
+    return targets
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def precheck_targets(pattern_df, holiday_ratio, edited_df, year, resolution=60):
+    """
+    生成する前に、各月の目標の負荷率がパターンで作れる範囲にあるかを判定する
+
+    戻り値: 月, 負荷率(%), 下限(%), 判定 の DataFrame（判定は FEASIBILITY_STATUS の文字列）
+    """
+    p_weekday_coef, p_holiday_coef = site_coefficients(pattern_df, holiday_ratio)
+    targets = monthly_targets(edited_df)
+    peaks = [targets.get(m, {}).get('peak_kw', np.nan) for m in range(1, 13)]
+    totals = [targets.get(m, {}).get('total_kwh', np.nan) for m in range(1, 13)]
+    result = check_feasibility(year, p_weekday_coef, p_holiday_coef, peaks, totals,
+                               drop_leap_day=True, resolution=resolution, optimize_shape=True)
+    return pd.DataFrame({
+        '月': list(range(1, 13)),
+        '負荷率(%)': result['load_factor'][0] * 100,
+        '下限(%)': result['lf_min'][0] * 100,
+        '判定': np.array(FEASIBILITY_STATUS)[result['status'][0]],
+    })
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def run_generation(pattern_df, holiday_ratio, edited_df, year, shape_method='bisect', resolution=60,
+                   _month_cache=None, _progress=None):
+    """
+    入力からデマンドを生成し、(結果, フィット情報) を返す
+
+    結果はコマの DatetimeIndex を持ち、day_type (uint8, 0: 平日 / 1: 休日) と
+    Demand_kW (float) の2列だけの DataFrame。日付・時刻・曜日区分の文字列は
+    表示・出力のときに作る。
+    _month_cache (MonthResultCache) を渡すと、前回から目標が変わった月だけを再計算する
+    （パターン・年・分解能などを変えた場合は全月）。
+    _progress を渡すと、1か月生成するごとに _progress(完了した月数, 月数) を呼ぶ。
+    （先頭の _ により st.cache_data のキーには含まれない）。
+    """
+    targets = monthly_targets(edited_df)
+    p_weekday_coef, p_holiday_coef = site_coefficients(pattern_df, holiday_ratio)
+
+    calendar = build_calendar(year, drop_leap_day=True, resolution=resolution)
+    settings = dict(
+        drop_leap_day=True, resolution=resolution, optimize_shape=True, adjust_targets=True,
+        round_decimals=2, shape_method=shape_method, progress=_progress
+    )
+    if _month_cache is not None:
+        demand, fit_info = _month_cache.generate(
+            year, p_weekday_coef, p_holiday_coef, targets, **settings)
+    else:
+        demand, fit_info = generate_year(
+            year, p_weekday_coef, p_holiday_coef, targets, return_info=True, **settings)
+
+    df_result = pd.DataFrame({
+        'day_type': calendar['holiday'].astype(np.uint8),
+        'Demand_kW': demand,
+    }, index=calendar['index'].rename('datetime'))
+    df_fit = pd.DataFrame({
+        '月': list(range(1, 13)),
+        'ガンマ値': fit_info['gamma'],
+        '反復回数': fit_info['iterations'],
+        '残差(kWh)': fit_info['residual']
+    })
+    return df_result, df_fit
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def build_summary(pattern_df, holiday_ratio, edited_df, year, shape_method='bisect', resolution=60):
+    """月別グラフ用の集計と検証テーブルを作成する"""
+    df_result, df_fit = run_generation(pattern_df, holiday_ratio, edited_df, year, shape_method, resolution)
+
+    df_monthly = df_result.groupby(df_result.index.month.rename('month')).agg({
+        'Demand_kW': ['max', 'mean', 'sum']
+    }).reset_index()
+    df_monthly.columns = ['月', 'ピーク (kW)', '平均 (kW)', '合計 (kWh)']
+    # kW の合計 × 1コマの時間数 = kWh
+    df_monthly['合計 (kWh)'] = df_monthly['合計 (kWh)'] * (resolution / 60.0)
+    df_monthly['月表示'] = df_monthly['月'].astype(str) + '月'
+
+    monthly_stats = df_monthly[['月', 'ピーク (kW)', '合計 (kWh)']].copy()
+    monthly_stats.columns = ['月', '計算ピーク(kW)', '計算合計(kWh)']
+
+    validation_df = pd.merge(edited_df, monthly_stats, left_on='月', right_on='月')
+    validation_df = pd.merge(validation_df, df_fit, on='月', how='left')
+    validation_df = pd.merge(
+        validation_df, precheck_targets(pattern_df, holiday_ratio, edited_df, year, resolution),
+        on='月', how='left'
+    )
     
-    return current_patterns, b, v
+    # 月を日本語表記に
+    validation_df['月'] = validation_df['月'].astype(str) + '月'
+    return df_monthly, validation_df
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def build_export(pattern_df, holiday_ratio, edited_df, year, shape_method='bisect', resolution=60):
+    """ダウンロード用の日 × 時刻（コマ）の表と CSV（バイト列）を作成する"""
+    df_result, _ = run_generation(pattern_df, holiday_ratio, edited_df, year, shape_method, resolution)
+    calendar = build_calendar(year, drop_leap_day=True, resolution=resolution)
+    demand = df_result['Demand_kW'].to_numpy()
+
+    # デマンド配列を (日数, コマ数) に reshape するだけで横持ちにする
+    with span('pivot'):
+        df_pivot = wide_frame(calendar, demand)
+    csv = wide_csv_bytes(calendar, demand)
+    return df_pivot, csv
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def build_xlsx_export(pattern_df, holiday_ratio, edited_df, year, shape_method='bisect', resolution=60):
+    """月ごとのシートに分けた Excel のバイト列を作成する"""
+    df_result, _ = run_generation(pattern_df, holiday_ratio, edited_df, year, shape_method, resolution)
+    calendar = build_calendar(year, drop_leap_day=True, resolution=resolution)
+    return wide_xlsx_bytes(calendar, df_result['Demand_kW'].to_numpy())
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def build_binary_exports(pattern_df, holiday_ratio, edited_df, year, shape_method='bisect', resolution=60):
+    """
+    下流の解析ツール向けの Parquet（縦持ち・辞書エンコード）と
+    .npy（float32 の1行行列）のバイト列を作成する。pyarrow が無ければ Parquet は None
+    """
+    df_result, _ = run_generation(pattern_df, holiday_ratio, edited_df, year, shape_method, resolution)
+
+    calendar = build_calendar(year, drop_leap_day=True, resolution=resolution)
+    frame = long_frame(calendar, df_result['Demand_kW'].to_numpy())
+    try:
+        with span('parquet_export'):
+            parquet = parquet_bytes(frame)
+    except ImportError:
+        parquet = None
+
+    with span('npy_export'):
+        buffer = io.BytesIO()
+        np.save(buffer, frame['Demand_kW'].to_numpy()[None, :])
+    return parquet, buffer.getvalue()
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def build_bills(pattern_df, holiday_ratio, edited_df, year, shape_method='bisect', resolution=60,
+                tariff_name=None):
+    """料金プラン tariff_name での月別の請求額の表を作成する"""
+    df_result, _ = run_generation(pattern_df, holiday_ratio, edited_df, year, shape_method, resolution)
+    calendar = build_calendar(year, drop_leap_day=True, resolution=resolution)
+    bills = calculate_bills(calendar, df_result['Demand_kW'].to_numpy(), TARIFF_PRESETS[tariff_name])
+    df_bills = pd.DataFrame({
+        '月': [f"{m}月" for m in range(1, 13)],
+        '使用電力量(kWh)': bills['kwh'][0],
+        '最大需要電力(kW)': bills['max_demand_kw'][0],
+        '契約電力(kW)': bills['contract_kw'][0],
+        '基本料金(円)': bills['basic_charge'][0],
+        '電力量料金(円)': bills['energy_charge'][0],
+        '賦課金等(円)': bills['adder_charge'][0],
+        '合計(円)': bills['total'][0],
+    })
+    return df_bills
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def build_battery(pattern_df, holiday_ratio, edited_df, year, shape_method='bisect', resolution=60,
+                  energy_kwh=0.0, power_kw=0.0, efficiency=0.9, tariff_name=None):
+    """蓄電池でピークカットしたときの月別ピークの表と、料金プランでの年間請求額（前, 後）を作成する"""
+    df_result, _ = run_generation(pattern_df, holiday_ratio, edited_df, year, shape_method, resolution)
+    calendar = build_calendar(year, drop_leap_day=True, resolution=resolution)
+    demand = df_result['Demand_kW'].to_numpy()
+    result = shave_peaks(calendar, demand, energy_kwh, power_kw, efficiency=efficiency,
+                         return_series=True)
+    df_battery = pd.DataFrame({
+        '月': [f"{m}月" for m in range(1, 13)],
+        '元のピーク(kW)': result['original_peak_kw'],
+        '蓄電池ありピーク(kW)': result['peak_kw'],
+        '低減(kW)': result['reduction_kw'],
+        '放電量(kWh)': result['discharged_kwh'],
+    })
+    tariff = TARIFF_PRESETS[tariff_name]
+    before = np.nansum(calculate_bills(calendar, demand, tariff)['total'])
+    after = np.nansum(calculate_bills(calendar, result['net_demand'], tariff)['total'])
+    return df_battery, before, after
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def meter_patterns_from_upload(data, n_clusters):
+    """アップロードされた計測データ CSV から典型パターンを作る（(パターン dict, 日負荷曲線の概要)）"""
+    profiles = daily_profiles(io.BytesIO(data))
+    patterns = derive_patterns(profiles, n_clusters)
+    summary = {
+        'n_rows': profiles['n_rows'],
+        'n_sites': len(np.unique(profiles['site_id'])),
+        'n_days': len(profiles['date']),
+        'n_holidays': int(profiles['holiday'].sum()),
+    }
+    return patterns, summary
+
+# ==========================================
+# バックグラウンド実行
+# ==========================================
+@st.cache_resource
+def get_job_runner():
+    """全セッションで共有するジョブ実行器（再実行・再接続してもジョブ ID で参照できる）"""
+    return JobRunner(max_workers=2)
+
+def generation_job(job, inputs, month_cache):
+    """
+    生成と集計・出力用データの作成をまとめて行うジョブ
+
+    結果は各関数の st.cache_data に入るので、ジョブ終了後の画面は同じ入力で
+    呼び出すだけで取り出せる。工程の区切りと、生成中は1か月ごとに進捗を報告し、
+    キャンセルを確認する（job.update が JobCancelled を送出して生成の途中で止まる）。
+    """
+    def month_progress(done, total):
+        job.update(done / total / len(stages), f"デマンドを生成中... {done} / {total} か月")
+
+    stages = [
+        ("デマンドを生成中...",
+         lambda: run_generation(*inputs, _month_cache=month_cache, _progress=month_progress)),
+        ("月別集計を作成中...", lambda: build_summary(*inputs)),
+        ("CSV を作成中...", lambda: build_export(*inputs)),
+        ("Parquet / NPY を作成中...", lambda: build_binary_exports(*inputs)),
+    ]
+    month_cache.last_recomputed = []
+    with profile() as profiler:
+        for i, (message, stage) in enumerate(stages):
+            job.update(i / len(stages), message)
+            stage()
+    return {
+        'inputs': inputs,
+        'recomputed': list(month_cache.last_recomputed),
+        'profile_df': profiler.frame(),
+    }
+
+def completion_message(recomputed):
+    if len(recomputed) == 12:
+        return "計算が完了しました。"
+    if recomputed:
+        return f"計算が完了しました。（再計算した月: {', '.join(f'{m}月' for m in recomputed)}）"
+    return "計算が完了しました。（入力に変更がないため前回の結果を表示しています）"
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def validate_upload(data, file_name, year, resolution=60):
+    """
+    アップロードされた拠点ターゲット表を読み込んで検査し、(sites, issues) を返す
+
+    単拠点の計算と同じく 2/29 を除いた月の時間数で負荷率を判定する。
+    issues の severity が 'error' の拠点は sites から除かれ、'warning'（負荷率が
+    パターンの下限を下回る月）の拠点はそのまま計算する。
+    """
+    sites, issues = read_sites(io.BytesIO(data), month_hours(year, drop_leap_day=True),
+                               excel=file_name.lower().endswith(EXCEL_SUFFIXES))
+    warnings = feasibility_issues(sites, year, drop_leap_day=True, resolution=resolution)
+    return sites, pd.concat([issues, warnings], ignore_index=True)
+
+def bulk_generation_job(job, sites, issues, year, shape_method, resolution, output_format):
+    """
+    全拠点を BULK_CHUNKSIZE 拠点ずつ生成し、1つのファイルにまとめるジョブ
+
+    output_format='zip'     : 縦持ち CSV（batch_generate.py と同じ形式）とフィットレポート・
+                              入力の問題一覧を ZIP にまとめる
+    output_format='parquet' : 縦持ち Parquet（site_id, datetime, Demand_kW）
+    チャンクを書き出したら破棄するので、保持するのはチャンク1つ分と出力ファイルだけ。
+    """
+    calendar = build_calendar(year, drop_leap_day=True, resolution=resolution)
+    n_sites = len(sites['site_id'])
+    reports = []
+
+    def blocks():
+        done = 0
+        for chunk in split_sites(sites, BULK_CHUNKSIZE):
+            job.update(done / n_sites, f"生成中... {done:,} / {n_sites:,} 拠点")
+            site_ids, demand, info = generate_chunk(
+                chunk, year, drop_leap_day=True, shape_method=shape_method, resolution=resolution)
+            reports.append(fit_report_frame(site_ids, info, year))
+            done += len(site_ids)
+            yield calendar, site_ids, demand, info
+        job.update(1.0, "ファイルをまとめています...")
+
+    buffer = io.BytesIO()
+    if output_format == 'parquet':
+        write_portfolio_parquet(blocks(), buffer)
+        file_name, mime = f"demand_portfolio_{year}.parquet", "application/octet-stream"
+    else:
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(f"demand_portfolio_{year}.csv", 'w') as raw:
+                with io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as f:
+                    write_portfolio_csv(blocks(), f)
+            archive.writestr("fit_report.csv",
+                             pd.concat(reports, ignore_index=True).to_csv(index=False).encode('utf-8-sig'))
+            if len(issues):
+                archive.writestr("input_issues.csv", issues.to_csv(index=False).encode('utf-8-sig'))
+        file_name, mime = f"demand_portfolio_{year}.zip", "application/zip"
+    return {'data': buffer.getvalue(), 'file_name': file_name, 'mime': mime, 'n_sites': n_sites}
+
+def timeline_job(job, pattern_df, holiday_ratio, edited_df, start_year, n_years,
+                 peak_growth, energy_growth, shape_method, resolution):
+    """
+    STEP 1・2 の入力を初年度の目標とし、年率を掛けた n_years 年分を通しで生成するジョブ
+
+    閏年は 2/29 を含む実際の日数で作る。年ごとの集計と、縦持ちの CSV / Parquet を返す。
+    """
+    job.update(0.0, f"{n_years}年分を生成中...")
+    p_weekday_coef, p_holiday_coef = site_coefficients(pattern_df, holiday_ratio)
+    targets = monthly_targets(edited_df)
+    peaks = [targets.get(m, {}).get('peak_kw', np.nan) for m in range(1, 13)]
+    totals = [targets.get(m, {}).get('total_kwh', np.nan) for m in range(1, 13)]
+
+    calendar = build_timeline(start_year, n_years, resolution=resolution)
+    demand, info = generate_timeline(
+        start_year, n_years, p_weekday_coef, p_holiday_coef, peaks, totals,
+        peak_growth=peak_growth / 100, energy_growth=energy_growth / 100, resolution=resolution,
+        optimize_shape=True, adjust_targets=True, round_decimals=2, shape_method=shape_method,
+        progress=lambda done, total: job.update(
+            0.5 * done / total, f"{n_years}年分を生成中... {done} / {total} か月"),
+        return_info=True
+    )
+    demand = demand[0]
+
+    job.update(0.5, "年ごとに集計中...")
+    years = np.repeat(calendar['day_year'], calendar['steps_per_day'])
+    summary = pd.DataFrame({'年': years, 'Demand_kW': demand}).groupby('年')['Demand_kW'].agg(['max', 'sum'])
+    summary = pd.DataFrame({
+        '年': summary.index,
+        '日数': np.bincount(calendar['day_year'] - start_year)[:n_years],
+        '目標ピーク(kW)': np.nanmax(info['peak_kw'][0], axis=1),
+        '計算ピーク(kW)': summary['max'].to_numpy(),
+        '目標合計(kWh)': np.nansum(info['total_kwh'][0], axis=1),
+        '計算合計(kWh)': summary['sum'].to_numpy() * calendar['interval_hours'],
+    })
+
+    job.update(0.6, "CSV を作成中...")
+    frame = long_frame(calendar, demand)
+    csv = frame.drop(columns='datetime').assign(Demand_kW=demand).to_csv(index=False).encode('utf-8-sig')
+    job.update(0.85, "Parquet を作成中...")
+    try:
+        parquet = parquet_bytes(frame)
+    except ImportError:
+        parquet = None
+    return {
+        'summary': summary, 'csv': csv, 'parquet': parquet,
+        'file_stem': f"demand_{start_year}-{start_year + n_years - 1}",
+    }
 
 # ==========================================
 # セッションステートの初期化
 # ==========================================
-if 'calculated_data' not in st.session_state:
-    st.session_state.calculated_data = None
+# 計算実行時の入力（結果はこの入力をキーにキャッシュから取り出す）
+if 'calculated_inputs' not in st.session_state:
+    st.session_state.calculated_inputs = None
+
+if 'profile_df' not in st.session_state:
+    st.session_state.profile_df = None
+
+# 月ごとの前回の生成結果（目標の変わった月だけを再計算する）
+if 'month_cache' not in st.session_state:
+    st.session_state.month_cache = MonthResultCache()
+
+# 実行中のジョブ ID（ブラウザを再読み込みしても URL のクエリから引き継ぐ）
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = st.query_params.get('job')
+
+# ジョブ終了時に表示するメッセージ (ジョブの種類, 表示の種類, 本文)
+if 'job_notice' not in st.session_state:
+    st.session_state.job_notice = None
 
-def set_pattern_data(preset_name):
+# 一括計算の結果（ダウンロード用のファイル）
+if 'bulk_result' not in st.session_state:
+    st.session_state.bulk_result = None
+
+# 複数年シミュレーションの結果（年別集計とダウンロード用のファイル）
+if 'timeline_result' not in st.session_state:
+    st.session_state.timeline_result = None
+
+job_runner = get_job_runner()
+
+def set_pattern_data(preset_name, data=None):
+    """
+    プリセット（または data に渡した同じ形のパターン）を STEP 1 の入力に設定する
+
+    data には meter_patterns.derive_patterns などで作った PRESET_PATTERNS の1項目を渡せる。
+    """
     key_name = preset_name
-    data = PRESET_PATTERNS.get(key_name, list(PRESET_PATTERNS.values())[0])
+    if data is None:
+        data = PRESET_PATTERNS.get(key_name, list(PRESET_PATTERNS.values())[0])
     
     hours = list(range(24))
     weekday_vals = normalize_to_percentage(data["weekday"])
@@ -276,7 +584,7 @@ def set_pattern_data(preset_name):
         'Holiday': holiday_vals
     })
     
-    st.session_state.holiday_ratio = data.get("holiday_ratio", 100)
+    st.session_state.holiday_ratio = int(min(max(data.get("holiday_ratio", 100), 0), 120))
 
 if 'pattern_df' not in st.session_state:
     if 'holiday_ratio' not in st.session_state:
@@ -333,15 +641,34 @@ with col2:
     )
     st.session_state.holiday_ratio = holiday_ratio
 
+# 計測データからパターンを作る
+with st.expander("計測データからパターンを作成"):
+    st.caption("スマートメーターなどの計測値（列: site_id, datetime, kw）から、日ごとの形を"
+               "k-means で典型パターンに分けます。30分値・15分値・1時間値に対応しています。")
+    meter_file = st.file_uploader("計測データ (CSV)", type=['csv'], key="meter_uploader")
+    n_clusters = st.slider("パターン数", min_value=1, max_value=8, value=3)
+    if meter_file is not None:
+        try:
+            meter_presets, meter_summary = meter_patterns_from_upload(meter_file.getvalue(), n_clusters)
+        except ValueError as exc:
+            st.warning(f"計測データを読み込めません: {exc}")
+        else:
+            st.caption(f"{meter_summary['n_rows']:,}行・{meter_summary['n_sites']}拠点・"
+                       f"{meter_summary['n_days']:,}日（うち休日 {meter_summary['n_holidays']:,}日）")
+            meter_choice = st.radio(
+                "パターン", options=list(meter_presets),
+                format_func=lambda name: f"{name}（{meter_presets[name]['n_sites']}拠点・"
+                                         f"休日レベル {meter_presets[name]['holiday_ratio']}%）"
+            )
+            st.button(
+                "このパターンを使う",
+                on_click=set_pattern_data, args=(meter_choice, meter_presets[meter_choice])
+            )
+
 # パターンのプレビューグラフ
 st.markdown("### パターンプレビュー")
 
-df_preview = st.session_state.pattern_df.copy()
-ratio_val = st.session_state.holiday_ratio / 100.0
-df_preview['Holiday'] = df_preview['Holiday'] * ratio_val
-
-pattern_long = df_preview.melt('Hour', var_name='Type', value_name='Value')
-pattern_long['Type'] = pattern_long['Type'].replace({'Weekday': '平日', 'Holiday': '休日'})
+pattern_long = build_pattern_preview(st.session_state.pattern_df, st.session_state.holiday_ratio)
 
 chart = alt.Chart(pattern_long).mark_bar(
     cornerRadiusTopLeft=3,
@@ -390,9 +717,6 @@ with st.expander("詳細設定：時間別パターンの調整"):
     )
     st.session_state.pattern_df = edited_pattern_df
 
-pattern_weekday_ratio = st.session_state.pattern_df['Weekday'].tolist()
-pattern_holiday_ratio = st.session_state.pattern_df['Holiday'].tolist()
-
 st.markdown("---")
 
 # ==========================================
@@ -438,180 +762,125 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+with st.expander("計算設定"):
+    shape_method = st.radio(
+        "パターン形状（ガンマ値）の探索方法",
+        options=['bisect', 'newton'],
+        format_func=lambda m: {'bisect': "二分探索（従来）", 'newton': "ニュートン法（高速・許容誤差保証）"}[m],
+        horizontal=True,
+        help="ニュートン法はピークと合計を同時に満たす形状を許容誤差まで求めます"
+    )
+    resolution = st.selectbox(
+        "時間分解能",
+        options=list(RESOLUTIONS),
+        format_func=lambda r: f"{r}分",
+        help="30分はデマンド時限の単位です。時間帯パターンは各コマに展開されます"
+    )
+    year = int(st.number_input(
+        "対象年", min_value=MIN_YEAR, max_value=MAX_YEAR, value=YEAR, step=1,
+        help="祝日・曜日の判定に使います（2/29 は除いて365日で作成します）"
+    ))
+
+# 生成する前に、目標どおりに作れない月を知らせる（負荷率の範囲だけで判定するので軽い）
+precheck_df = precheck_targets(st.session_state.pattern_df, st.session_state.holiday_ratio,
+                               edited_df, year, resolution)
+problem_labels = {
+    FEASIBILITY_STATUS[TOO_HIGH]: "契約電力を超えて使用電力量を優先します",
+    FEASIBILITY_STATUS[TOO_LOW]: "パターンを最も鋭くしても合わせきれず、ピークのコマだけが突出します",
+    FEASIBILITY_STATUS[INVALID]: "入力値を確認してください",
+}
+problems = precheck_df[precheck_df['判定'].isin(list(problem_labels))]
+if len(problems):
+    st.warning("事前チェック: 目標どおりに作れない月があります。\n\n" + "\n".join(
+        f"- {row['月']}月 {row['判定']}（負荷率 {row['負荷率(%)']:.1f}%、作れる範囲 "
+        f"{row['下限(%)']:.1f}〜100%）: {problem_labels[row['判定']]}"
+        for _, row in problems.iterrows()
+    ))
+
 st.markdown("<br>", unsafe_allow_html=True)
 
+active_job = job_runner.get(st.session_state.job_id) if st.session_state.job_id else None
+if st.session_state.job_id and active_job is None:
+    # 期限切れなどで見つからないジョブ
+    st.session_state.job_id = None
+    st.query_params.pop('job', None)
+
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
-    run_button = st.button("計算実行", use_container_width=True)
+    run_button = st.button("計算実行", use_container_width=True,
+                           disabled=active_job is not None and not active_job.done)
 
 if run_button:
-    year = 2024
-    start_date = datetime.datetime(year, 1, 1, 0, 0)
-    end_date = datetime.datetime(year, 12, 31, 23, 0)
-    
-    all_hours = pd.date_range(start=start_date, end=end_date, freq='h')
-    
-    is_leap_day = (all_hours.month == 2) & (all_hours.day == 29)
-    all_hours = all_hours[~is_leap_day]
-    
-    df_temp = pd.DataFrame({'timestamp': all_hours})
-    df_temp['month'] = df_temp['timestamp'].dt.month
-    
-    final_data = []
-    
-    targets = {}
-    for index, row in edited_df.iterrows():
-        targets[row['月']] = {
-            'peak_kw': row['契約電力(kW)'], 
-            'total_kwh': row['使用電力量(kWh)']
-        }
+    inputs = (
+        st.session_state.pattern_df.copy(),
+        st.session_state.holiday_ratio,
+        edited_df.copy(),
+        year,
+        shape_method,
+        resolution
+    )
+    active_job = job_runner.submit(generation_job, inputs, st.session_state.month_cache,
+                                   label=GENERATION_JOB)
+    st.session_state.job_id = active_job.id
+    st.query_params['job'] = active_job.id
 
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    def normalize_pattern_to_coefficient(ratio_list):
-        max_val = max(ratio_list)
-        if max_val == 0: return [0.0] * len(ratio_list)
-        return [r / max_val for r in ratio_list]
+def finish_job(job):
+    """終了したジョブの結果をセッションに取り込み、ジョブ ID を外す"""
+    if job.status == DONE and job.label == BULK_JOB:
+        st.session_state.bulk_result = job.result
+        notice = ('success', f"一括計算が完了しました（{job.result['n_sites']:,}拠点）。")
+    elif job.status == DONE and job.label == TIMELINE_JOB:
+        st.session_state.timeline_result = job.result
+        notice = ('success', f"{len(job.result['summary'])}年分の計算が完了しました。")
+    elif job.status == DONE:
+        st.session_state.calculated_inputs = job.result['inputs']
+        st.session_state.profile_df = job.result['profile_df']
+        notice = ('success', completion_message(job.result['recomputed']))
+    elif job.status == CANCELLED:
+        notice = ('warning', "計算をキャンセルしました。")
+    else:
+        notice = ('error', f"計算中にエラーが発生しました。\n\n{job.error}")
+    st.session_state.job_notice = (job.label,) + notice
+    st.session_state.job_id = None
+    st.query_params.pop('job', None)
 
-    p_weekday_coef = normalize_pattern_to_coefficient(pattern_weekday_ratio)
-    p_holiday_coef = normalize_pattern_to_coefficient(pattern_holiday_ratio)
-    
-    h_ratio = st.session_state.holiday_ratio / 100.0
-    p_holiday_coef = [x * h_ratio for x in p_holiday_coef]
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress():
+    """実行中のジョブの進捗を定期的に表示し、終了したら画面全体を再実行する"""
+    job = job_runner.get(st.session_state.job_id) if st.session_state.job_id else None
+    if job is None:
+        return
+    if job.done:
+        finish_job(job)
+        st.rerun()
+    st.progress(job.progress, text=f"🔄 {job.message or '計算中...'}（{job.elapsed():.1f} 秒）")
+    if job.cancel_requested:
+        st.caption("キャンセルしています...")
+    elif st.button("キャンセル", key="cancel_job"):
+        job.cancel()
 
-    for month, group in df_temp.groupby('month'):
-        progress_bar.progress(month / 12)
-        status_text.text(f"🔄 {month}月を計算中...")
-        
-        target = targets.get(month)
-        target_peak = target['peak_kw']
-        target_total = target['total_kwh']
-        
-        monthly_patterns = []
-        month_timestamps = group['timestamp'].tolist()
-        
-        for ts in month_timestamps:
-            hour = ts.hour
-            if is_holiday(ts):
-                monthly_patterns.append(p_holiday_coef[hour])
-            else:
-                monthly_patterns.append(p_weekday_coef[hour])
-        
-        optimized_patterns, b, v = optimize_pattern_shape(target_peak, target_total, monthly_patterns)
-        
-        force_adjust = False
-        if v < 0:
-            v = 0
-            b = target_total / len(optimized_patterns)
-            force_adjust = True
-        elif b < 0:
-            b = 0
-            v = target_total / sum(optimized_patterns)
-            force_adjust = True
-        
-        month_data = []
-        max_val = -1.0
-        max_idx = -1
-        
-        for i, ts in enumerate(month_timestamps):
-            p = optimized_patterns[i]
-            demand = b + (v * p)
-            if demand < 0: demand = 0
-            
-            month_data.append({
-                'Date_obj': ts.date(), 
-                'Time': ts.strftime('%H:00'),
-                'Weekday_Type': "休日" if is_holiday(ts) else "平日",
-                'Demand_kW': demand,
-                'datetime': ts 
-            })
-            
-            if demand > max_val:
-                max_val = demand
-                max_idx = i
-
-        # ピーク値を目標に合わせる
-        diff = target_peak - max_val
-        if abs(diff) > 0.000001:
-            month_data[max_idx]['Demand_kW'] = target_peak
-        
-        # 合計値を目標に合わせる（ピーク以外の1時間だけ調整）
-        current_total = sum([d['Demand_kW'] for d in month_data])
-        total_diff = target_total - current_total
-        
-        if abs(total_diff) > 0.001:
-            # ピーク以外で、調整しても問題ない時間を1つ選ぶ
-            # （2番目に大きい値の時間を選ぶと目立ちにくい）
-            sorted_indices = sorted(
-                range(len(month_data)), 
-                key=lambda i: month_data[i]['Demand_kW'], 
-                reverse=True
-            )
-            
-            # ピーク以外の時間を探す
-            adjust_idx = None
-            for idx in sorted_indices:
-                if idx != max_idx:
-                    # この時間に差分を足しても、ピークを超えないか確認
-                    new_val = month_data[idx]['Demand_kW'] + total_diff
-                    if new_val >= 0 and new_val <= target_peak:
-                        adjust_idx = idx
-                        break
-            
-            # 見つからなければ、最も小さい値の時間を使う
-            if adjust_idx is None:
-                for idx in reversed(sorted_indices):
-                    if idx != max_idx:
-                        adjust_idx = idx
-                        break
-            
-            if adjust_idx is not None:
-                month_data[adjust_idx]['Demand_kW'] += total_diff
-
-        final_data.extend(month_data)
-
-    progress_bar.progress(1.0)
-    status_text.empty()
-    
-    df_result = pd.DataFrame(final_data)
-    df_result['Demand_kW'] = df_result['Demand_kW'].round(2)
-    
-    # 丸め後の合計差分を月ごとに再調整
-    df_result['month'] = df_result['datetime'].dt.month
-    
-    for month in range(1, 13):
-        target_total = targets[month]['total_kwh']
-        target_peak = targets[month]['peak_kw']
-        
-        month_mask = df_result['month'] == month
-        current_total = df_result.loc[month_mask, 'Demand_kW'].sum()
-        total_diff = target_total - current_total
-        
-        if abs(total_diff) >= 0.01:
-            # ピーク以外の時間を1つ選んで調整
-            month_data = df_result.loc[month_mask].copy()
-            max_idx = month_data['Demand_kW'].idxmax()
-            
-            # ピーク以外で調整可能な時間を探す
-            for idx in month_data.index:
-                if idx != max_idx:
-                    current_val = df_result.loc[idx, 'Demand_kW']
-                    new_val = round(current_val + total_diff, 2)
-                    # ピークを超えず、0以上なら調整
-                    if 0 <= new_val <= target_peak:
-                        df_result.loc[idx, 'Demand_kW'] = new_val
-                        break
-
-    st.session_state.calculated_data = df_result
-    st.success("計算が完了しました。")
+def track_job(label):
+    """種類 label のジョブが実行中なら進捗を、終了したらそのメッセージを表示する"""
+    job = job_runner.get(st.session_state.job_id) if st.session_state.job_id else None
+    if job is not None and job.label == label:
+        if job.done:
+            finish_job(job)
+        else:
+            show_job_progress()
+    notice = st.session_state.job_notice
+    if notice is not None and notice[0] == label:
+        _, kind, text = notice
+        getattr(st, kind)(text)
+        st.session_state.job_notice = None
+
+track_job(GENERATION_JOB)
 
 # ==========================================
 # 結果表示
 # ==========================================
-if st.session_state.calculated_data is not None:
-    df_result = st.session_state.calculated_data
-    year = 2024
+if st.session_state.calculated_inputs is not None:
+    inputs = st.session_state.calculated_inputs
+    df_monthly, validation_df = build_summary(*inputs)
 
     st.markdown("---")
     st.markdown("## 計算結果")
@@ -619,13 +888,6 @@ if st.session_state.calculated_data is not None:
     # 月別デマンド推移グラフ
     st.markdown("### 月別ピーク値")
     
-    # 月ごとの集計データを作成
-    df_monthly = df_result.groupby('month').agg({
-        'Demand_kW': ['max', 'mean', 'sum']
-    }).reset_index()
-    df_monthly.columns = ['月', 'ピーク (kW)', '平均 (kW)', '合計 (kWh)']
-    df_monthly['月表示'] = df_monthly['月'].astype(str) + '月'
-    
     chart_monthly = alt.Chart(df_monthly).mark_bar(
         cornerRadiusTopLeft=5,
         cornerRadiusTopRight=5,
@@ -648,37 +910,95 @@ if st.session_state.calculated_data is not None:
     # 検証テーブル
     st.markdown("### 検証テーブル")
     
-    monthly_stats = df_result.groupby('month')['Demand_kW'].agg(['max', 'sum']).reset_index()
-    monthly_stats.columns = ['月', '計算ピーク(kW)', '計算合計(kWh)']
-    
-    validation_df = pd.merge(edited_df, monthly_stats, left_on='月', right_on='月')
-    
-    # 月を日本語表記に
-    validation_df['月'] = validation_df['月'].astype(str) + '月'
-    
     st.dataframe(
         validation_df.style.format({
             '計算ピーク(kW)': '{:.2f}', 
-            '計算合計(kWh)': '{:.0f}'
+            '計算合計(kWh)': '{:.0f}',
+            'ガンマ値': '{:.3f}',
+            '残差(kWh)': '{:.3f}',
+            '負荷率(%)': '{:.1f}',
+            '下限(%)': '{:.1f}'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+
+    # 電気料金の試算
+    st.markdown("### 電気料金の試算")
+    tariff_name = st.selectbox(
+        "料金プラン", options=list(TARIFF_PRESETS),
+        help="契約電力は当月を含む直近12か月の最大需要電力（実量制）。単価は試算用の例です"
+    )
+    df_bills = build_bills(*inputs, tariff_name=tariff_name)
+    annual = df_bills['合計(円)'].sum()
+    st.metric("年間の請求額（試算）", f"{annual:,.0f} 円",
+              help=f"平均単価 {annual / df_bills['使用電力量(kWh)'].sum():.2f} 円/kWh")
+    st.dataframe(
+        df_bills.style.format({
+            '使用電力量(kWh)': '{:,.0f}',
+            '最大需要電力(kW)': '{:.1f}',
+            '契約電力(kW)': '{:.1f}',
+            '基本料金(円)': '{:,.0f}',
+            '電力量料金(円)': '{:,.0f}',
+            '賦課金等(円)': '{:,.0f}',
+            '合計(円)': '{:,.0f}'
         }),
         use_container_width=True,
         hide_index=True
     )
 
+    # 蓄電池によるピークカット
+    with st.expander("蓄電池によるピークカット"):
+        st.caption("ピークを超える分を放電し、下回る時間帯に充電して月ごとの最大需要電力をできるだけ下げます。"
+                   "請求額は上で選んだ料金プランで計算します（充電の電力量も含みます）。")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            battery_kwh = st.number_input("容量 (kWh)", min_value=0.0, value=100.0, step=10.0)
+        with col2:
+            battery_kw = st.number_input("出力 (kW)", min_value=0.0, value=25.0, step=5.0)
+        with col3:
+            battery_eff = st.number_input("往復効率 (%)", min_value=50.0, max_value=100.0,
+                                          value=90.0, step=1.0) / 100
+        df_battery, bill_before, bill_after = build_battery(
+            *inputs, energy_kwh=battery_kwh, power_kw=battery_kw, efficiency=battery_eff,
+            tariff_name=tariff_name
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("月最大の低減（平均）", f"{df_battery['低減(kW)'].mean():.1f} kW")
+        with col2:
+            st.metric("年間の請求額（蓄電池あり）", f"{bill_after:,.0f} 円",
+                      delta=f"{bill_after - bill_before:,.0f} 円", delta_color="inverse")
+        st.dataframe(
+            df_battery.style.format({
+                '元のピーク(kW)': '{:.1f}',
+                '蓄電池ありピーク(kW)': '{:.1f}',
+                '低減(kW)': '{:.1f}',
+                '放電量(kWh)': '{:,.0f}'
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+
+    # 工程別の処理時間（計算実行時に記録）
+    with st.expander("パフォーマンス"):
+        profile_df = st.session_state.profile_df
+        if profile_df is None or profile_df.empty:
+            st.caption("キャッシュ済みの結果を表示しているため、処理時間の記録はありません。")
+        else:
+            st.caption(f"合計 {profile_df['合計 (ms)'].sum():.1f} ms")
+            st.dataframe(
+                profile_df.style.format({'合計 (ms)': '{:.2f}', '割合 (%)': '{:.1f}'}),
+                use_container_width=True,
+                hide_index=True
+            )
+
     st.markdown("---")
     
     # ダウンロード
     st.markdown("## データダウンロード")
     
-    df_pivot = df_result.pivot(index='Date_obj', columns='Time', values='Demand_kW')
-    df_pivot.index = df_pivot.index.map(lambda d: f"{d.month}/{d.day}")
-    df_pivot.index.name = "Date"
-
-    time_columns = [f"{h:02d}:00" for h in range(24)]
-    existing_cols = [c for c in time_columns if c in df_pivot.columns]
-    df_pivot = df_pivot[existing_cols]
-    
-    csv = df_pivot.to_csv(encoding='utf-8-sig')
+    df_pivot, csv = build_export(*inputs)
     
     with st.expander("データプレビュー"):
         st.dataframe(df_pivot.head(10), use_container_width=True)
@@ -693,6 +1013,222 @@ if st.session_state.calculated_data is not None:
             use_container_width=True
         )
 
+    # Excel はボタンを押したときに作る（作成済みならキャッシュから返す）
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        if importlib.util.find_spec('openpyxl') is None:
+            st.caption("Excel 出力には openpyxl が必要です。")
+        else:
+            st.download_button(
+                label="Excelダウンロード（月別シート）",
+                data=lambda: build_xlsx_export(*inputs),
+                file_name=f"demand_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True
+            )
+
+    with st.expander("その他の形式（解析ツール向け）"):
+        parquet, npy = build_binary_exports(*inputs)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        st.caption("Parquet は縦持ち（日時・時刻・平日/休日・デマンド）、.npy は1行 × コマ数の float32 行列です。")
+        if parquet is None:
+            st.info("Parquet 出力には pyarrow が必要です。")
+        else:
+            st.download_button(
+                label="Parquetダウンロード",
+                data=parquet,
+                file_name=f"demand_{timestamp}.parquet",
+                mime="application/octet-stream",
+                use_container_width=True
+            )
+        st.download_button(
+            label="NPYダウンロード",
+            data=npy,
+            file_name=f"demand_{timestamp}.npy",
+            mime="application/octet-stream",
+            use_container_width=True
+        )
+
+# ==========================================
+# 複数年シミュレーション
+# ==========================================
+st.markdown("---")
+st.markdown("## 複数年シミュレーション")
+
+st.markdown("""
+<div class="description">
+    STEP 1・2 の入力を初年度として、契約電力・使用電力量に毎年の伸び率を掛けた
+    複数年の連続データを作成します。閏年は 2/29 を含めて計算します。
+</div>
+""", unsafe_allow_html=True)
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    # 祝日を計算できる最終年（MAX_YEAR）を超えない年数まで
+    max_years = max(2, min(MAX_TIMELINE_YEARS, MAX_YEAR - year + 1))
+    n_years = int(st.number_input("年数", min_value=2, max_value=max_years, value=min(10, max_years),
+                                  step=1))
+with col2:
+    peak_growth = st.number_input("契約電力の伸び率 (%/年)", min_value=-20.0, max_value=20.0,
+                                  value=0.0, step=0.5, format="%.1f")
+with col3:
+    energy_growth = st.number_input("使用電力量の伸び率 (%/年)", min_value=-20.0, max_value=20.0,
+                                    value=0.0, step=0.5, format="%.1f")
+
+col1, col2, col3 = st.columns([1, 2, 1])
+with col2:
+    timeline_button = st.button(
+        f"{year}〜{year + n_years - 1}年を計算", use_container_width=True,
+        disabled=(active_job is not None and not active_job.done) or year + n_years - 1 > MAX_YEAR
+    )
+    if year + n_years - 1 > MAX_YEAR:
+        st.caption(f"複数年の計算は {MAX_YEAR}年までです")
+if timeline_button:
+    st.session_state.timeline_result = None
+    active_job = job_runner.submit(
+        timeline_job, st.session_state.pattern_df.copy(), st.session_state.holiday_ratio,
+        edited_df.copy(), year, n_years, peak_growth, energy_growth, shape_method, resolution,
+        label=TIMELINE_JOB
+    )
+    st.session_state.job_id = active_job.id
+    st.query_params['job'] = active_job.id
+
+track_job(TIMELINE_JOB)
+
+if st.session_state.timeline_result is not None:
+    timeline_result = st.session_state.timeline_result
+    summary = timeline_result['summary']
+    chart_timeline = alt.Chart(summary).mark_bar(
+        cornerRadiusTopLeft=3,
+        cornerRadiusTopRight=3,
+        color='#4CAF50'
+    ).encode(
+        x=alt.X('年:O', title='年'),
+        y=alt.Y('計算合計(kWh):Q', title='年間使用電力量 (kWh)'),
+        tooltip=[
+            alt.Tooltip('年:O', title='年'),
+            alt.Tooltip('計算ピーク(kW):Q', title='ピーク', format='.1f'),
+            alt.Tooltip('計算合計(kWh):Q', title='合計', format=',.0f')
+        ]
+    ).properties(
+        height=250
+    )
+    st.altair_chart(chart_timeline, use_container_width=True)
+    st.dataframe(
+        summary.style.format({
+            '目標ピーク(kW)': '{:.2f}',
+            '計算ピーク(kW)': '{:.2f}',
+            '目標合計(kWh)': '{:,.0f}',
+            '計算合計(kWh)': '{:,.0f}'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="CSVダウンロード（縦持ち）",
+            data=timeline_result['csv'],
+            file_name=f"{timeline_result['file_stem']}.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
+    with col2:
+        if timeline_result['parquet'] is None:
+            st.caption("Parquet 出力には pyarrow が必要です。")
+        else:
+            st.download_button(
+                label="Parquetダウンロード",
+                data=timeline_result['parquet'],
+                file_name=f"{timeline_result['file_stem']}.parquet",
+                mime="application/octet-stream",
+                use_container_width=True
+            )
+
+# ==========================================
+# 複数拠点の一括計算
+# ==========================================
+st.markdown("---")
+st.markdown("## 複数拠点の一括計算")
+
+st.markdown("""
+<div class="description">
+    拠点ごとの月別ターゲット表（CSV / Excel、1拠点につき12行）をアップロードすると、
+    全拠点をまとめて計算し、1つのファイルでダウンロードできます。
+    時間分解能と探索方法は STEP 3 の計算設定を使います。
+</div>
+""", unsafe_allow_html=True)
+
+template = pd.DataFrame({
+    'site_id': 'S001',
+    'preset': list(PRESET_PATTERNS)[0],
+    'month': default_data['月'],
+    'peak_kw': default_data['契約電力(kW)'],
+    'total_kwh': default_data['使用電力量(kWh)'],
+})[SITE_COLUMNS]
+st.download_button(
+    label="入力テンプレート（CSV）",
+    data=template.to_csv(index=False).encode('utf-8-sig'),
+    file_name="sites_template.csv",
+    mime="text/csv"
+)
+
+uploaded = st.file_uploader("拠点ターゲット表", type=['csv', 'xlsx', 'xlsm'])
+if uploaded is not None:
+    try:
+        bulk_sites, bulk_issues = validate_upload(uploaded.getvalue(), uploaded.name, year, resolution)
+    except Exception as exc:
+        st.error(f"ファイルを読み込めませんでした: {exc}")
+        bulk_sites, bulk_issues = None, None
+
+    if bulk_sites is not None:
+        n_valid = len(bulk_sites['site_id'])
+        st.caption(f"計算できる拠点: {n_valid:,}拠点")
+        if len(bulk_issues):
+            errors = bulk_issues[bulk_issues['severity'] == 'error']
+            n_warned = bulk_issues.loc[bulk_issues['severity'] == 'warning', 'site_id'].nunique()
+            if len(errors):
+                st.warning(f"{errors['site_id'].nunique():,}拠点に入力の問題があります（計算から除きます）。")
+            if n_warned:
+                st.info(f"{n_warned:,}拠点に、負荷率がパターンで作れる下限を下回る月があります"
+                        "（計算はしますが、ピークのコマだけが突出します）。")
+            st.dataframe(bulk_issues, use_container_width=True, hide_index=True, height=200)
+
+        output_format = st.radio(
+            "出力形式",
+            options=['zip', 'parquet'],
+            format_func=lambda f: {'zip': "ZIP（縦持ち CSV + フィットレポート）", 'parquet': "Parquet（列指向）"}[f],
+            horizontal=True
+        )
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col2:
+            bulk_button = st.button(
+                "一括計算実行", use_container_width=True,
+                disabled=n_valid == 0 or (active_job is not None and not active_job.done)
+            )
+        if bulk_button:
+            st.session_state.bulk_result = None
+            active_job = job_runner.submit(
+                bulk_generation_job, bulk_sites, bulk_issues, year, shape_method, resolution,
+                output_format, label=BULK_JOB
+            )
+            st.session_state.job_id = active_job.id
+            st.query_params['job'] = active_job.id
+
+track_job(BULK_JOB)
+
+if st.session_state.bulk_result is not None:
+    bulk_result = st.session_state.bulk_result
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.download_button(
+            label=f"一括計算結果をダウンロード（{len(bulk_result['data']) / 1e6:.1f} MB）",
+            data=bulk_result['data'],
+            file_name=bulk_result['file_name'],
+            mime=bulk_result['mime'],
+            use_container_width=True
+        )
+
 # フッター
 st.markdown("---")
 st.markdown("""
@@ -0,0 +1,601 @@
+"""
+ポートフォリオ一括生成 CLI
+
+拠点ごとの月別ターゲット表を読み込み、プロセスプールで並列にデマンドを生成して
+1つの CSV にまとめて出力する。
+
+入力 CSV / Excel（縦持ち、1拠点につき12行）:
+    site_id, preset, month, peak_kw, total_kwh
+    preset には presets.PRESET_PATTERNS のキーを指定する。
+    列名は app.py と同じ 拠点ID, プリセット, 月, 契約電力(kW), 使用電力量(kWh) でもよい。
+    CSV はチャンクごとに読み込んで検査する。ピークが0以下・使用電力量がピーク × 月の時間数を
+    超えるなどの問題がある拠点は一覧にして止める（--skip-invalid なら除いて続ける）。
+    負荷率がパターンで作れる下限を下回る月は警告として表示する（--strict で問題扱い）。
+
+出力 CSV（拠点 × 日ごとに1行、app.py のダウンロード形式と同じ24列）:
+    site_id, Date, 00:00, 01:00, ..., 23:00
+    --resolution 30 では 00:00, 00:30, ..., 23:30 の48列になる。
+
+使い方:
+    python batch_generate.py sites.csv -o demand_portfolio.csv --workers 8
+    python batch_generate.py sites.csv --year 2024 --years 5 --format parquet
+    python batch_generate.py sites.xlsx --skip-invalid --issues issues.csv
+    python batch_generate.py sites.csv --tariff "高圧 業務用 季節別時間帯別（例）" --bills bills.csv
+    python batch_generate.py sites.csv --batteries 100:25,200:50,400:100 --battery-report battery.csv
+
+生成と書き出しはチャンク単位のパイプラインで、同時に保持するチャンク数は
+--max-pending で上限を決める。拠点数・年数が増えてもメモリ使用量は一定に保たれる。
+"""
+import argparse
+import collections
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from battery import battery_frame, shave_peaks
+from demand_engine import (
+    FEASIBILITY_STATUS, RESOLUTIONS, TOO_LOW, SolveCache, build_calendar, check_feasibility,
+    generate_sites, slot_labels,
+)
+from exporters import EXPORT_FORMATS, write_portfolio_npy, write_portfolio_parquet
+from holiday_calendar import DEFAULT_CLOSURES
+from parametric import pack_profiles, save_profiles
+from presets import PRESET_PATTERNS, preset_coefficients
+from profiling import Profiler, profile, span, write_report
+from tariff import bill_frame, calculate_bills, load_tariff
+
+SITE_COLUMNS = ['site_id', 'preset', 'month', 'peak_kw', 'total_kwh']
+
+# app.py の入力表と同じ日本語の列名も受け付ける
+SITE_COLUMN_ALIASES = {
+    '拠点ID': 'site_id',
+    'プリセット': 'preset',
+    '月': 'month',
+    '契約電力(kW)': 'peak_kw',
+    '使用電力量(kWh)': 'total_kwh',
+}
+
+EXCEL_SUFFIXES = ('.xlsx', '.xlsm', '.xls')
+
+# 入力表を一度に読み込んで検査する行数
+READ_CHUNKSIZE = 100_000
+
+# ワーカープロセスごとの解キャッシュ（チャンクをまたいで再利用する）
+_solve_cache = None
+
+# ==========================================
+# 入力読み込み
+# ==========================================
+
+def iter_site_table(source, chunksize=READ_CHUNKSIZE, excel=None):
+    """
+    拠点ターゲット表（CSV / Excel）を chunksize 行ずつの DataFrame で返す
+
+    source はパスまたはファイルオブジェクト。excel を省略すると名前の拡張子で判定する。
+    Excel は一度に読み込んでから分割する。列名は SITE_COLUMNS にそろえる。
+    """
+    if excel is None:
+        excel = str(getattr(source, 'name', source)).lower().endswith(EXCEL_SUFFIXES)
+    dtype = {'site_id': str, 'preset': str}
+    dtype.update({alias: dtype[name] for alias, name in SITE_COLUMN_ALIASES.items() if name in dtype})
+    if excel:
+        df = pd.read_excel(source, dtype=dtype)
+        chunks = [df.iloc[start:start + chunksize] for start in range(0, max(len(df), 1), chunksize)]
+    else:
+        chunks = pd.read_csv(source, chunksize=chunksize, dtype=dtype)
+    for chunk in chunks:
+        chunk = chunk.rename(columns=SITE_COLUMN_ALIASES)
+        missing = [c for c in SITE_COLUMNS if c not in chunk.columns]
+        if missing:
+            raise ValueError(f"入力に必要な列がありません: {', '.join(missing)}")
+        yield chunk[SITE_COLUMNS]
+
+
+def month_hours(years, drop_leap_day=False):
+    """各月の時間数 (12,)。複数年なら最も短い年の値"""
+    return np.min([
+        np.bincount(build_calendar(year, drop_leap_day=drop_leap_day)['day_month'], minlength=13)[1:] * 24
+        for year in np.atleast_1d(years)
+    ], axis=0).astype(float)
+
+
+def _issue_frame(site_ids, months, messages, severity='error'):
+    months = np.broadcast_to(np.asarray(months, dtype=float), (len(site_ids),))
+    months = pd.array(np.where(months % 1 == 0, months, np.nan), dtype='Float64').astype('Int64')
+    return pd.DataFrame({'site_id': np.asarray(site_ids, dtype=object), 'month': months,
+                         'issue': messages, 'severity': severity})
+
+
+def check_rows(chunk, hours=None):
+    """
+    入力表の1チャンクをまとめて検査し、(数値に変換した DataFrame, 問題の DataFrame) を返す
+
+    hours : 各月の時間数 (12,)。指定すると使用電力量がピーク × 時間数を超える行も問題にする
+    問題の DataFrame は site_id, month, issue, severity の4列（1行につき問題1件）。
+    severity は 'error'（生成できない・しない）または 'warning'（生成はするが目標からずれる）。
+    """
+    df = chunk.copy()
+    for column in ('month', 'peak_kw', 'total_kwh'):
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    month = df['month'].to_numpy()
+    peak = df['peak_kw'].to_numpy()
+    total = df['total_kwh'].to_numpy()
+    valid_month = np.isin(month, np.arange(1, 13))
+
+    checks = [
+        (df['site_id'].isna().to_numpy(), "site_id が空です"),
+        (~valid_month, "month が1〜12ではありません"),
+        (np.isnan(peak), "peak_kw が数値ではありません"),
+        (peak <= 0, "peak_kw が0以下です"),
+        (np.isnan(total), "total_kwh が数値ではありません"),
+        (total < 0, "total_kwh が負の値です"),
+    ]
+    if hours is not None:
+        limit = np.where(valid_month & (peak > 0),
+                         peak * hours[np.where(valid_month, month, 1).astype(int) - 1], np.inf)
+        checks.append((total > limit, "total_kwh がピーク × 月の時間数を超えています（負荷率100%超）"))
+
+    issues = [
+        _issue_frame(df['site_id'].to_numpy()[mask], month[mask], message)
+        for mask, message in checks if mask.any()
+    ]
+    issues = pd.concat(issues, ignore_index=True) if issues else _issue_frame([], [], [])
+    return df, issues
+
+
+def read_sites(source, hours=None, chunksize=READ_CHUNKSIZE, excel=None):
+    """
+    拠点ターゲット表を読み込んで検査し、(sites, issues) を返す
+
+    sites  : 問題のない拠点だけを拠点順に並べた配列の dict
+             {'site_id': (S,), 'preset': (S,), 'peak_kw': (S, 12), 'total_kwh': (S, 12)}
+    issues : 問題の一覧 (site_id, month, issue)。問題が1件でもある拠点は sites から除く
+    hours は check_rows と同じ。
+    """
+    frames, issues = [], []
+    for chunk in iter_site_table(source, chunksize, excel):
+        with span('validation'):
+            frame, problems = check_rows(chunk, hours)
+        frames.append(frame)
+        issues.append(problems)
+
+    with span('validation'):
+        df = pd.concat(frames, ignore_index=True).sort_values(['site_id', 'month'], kind='stable')
+
+        # 1拠点につき1〜12月が1行ずつ揃っているか
+        grouped = df.groupby('site_id', sort=False)
+        out_of_order = df.loc[df['month'].to_numpy() != grouped.cumcount().to_numpy() + 1, 'site_id']
+        sizes = grouped.size()
+        incomplete = sorted(set(out_of_order) | set(sizes.index[sizes != 12]))
+        issues.append(_issue_frame(incomplete, np.nan, "1〜12月が揃っていません"))
+
+        presets = grouped['preset'].agg(['first', 'nunique'])
+        mixed = presets.index[presets['nunique'] > 1]
+        issues.append(_issue_frame(mixed, np.nan, "拠点内でプリセットが一致しません"))
+        unknown = presets.loc[~presets['first'].isin(list(PRESET_PATTERNS))]
+        issues.append(_issue_frame(unknown.index, np.nan,
+                                   "未定義のプリセットです: " + unknown['first'].astype(str)))
+
+        issues = [i for i in issues if len(i)]
+        issues = pd.concat(issues, ignore_index=True) if issues else _issue_frame([], [], [])
+        df = df[~df['site_id'].isin(issues['site_id']) & df['site_id'].notna()]
+        presets = presets.loc[~presets.index.isin(issues['site_id'])]
+
+    return {
+        'site_id': presets.index.to_numpy(),
+        'preset': presets['first'].to_numpy(),
+        'peak_kw': df['peak_kw'].to_numpy(dtype=float).reshape(-1, 12),
+        'total_kwh': df['total_kwh'].to_numpy(dtype=float).reshape(-1, 12),
+    }, issues
+
+
+def feasibility_issues(sites, years, drop_leap_day=False, closures=DEFAULT_CLOSURES, resolution=60):
+    """
+    生成する前に全拠点・全月の負荷率をパターンで作れる下限と比べ、下回る月を警告にする
+
+    read_sites の結果に対して使う（負荷率 > 1 などは read_sites が問題にしている）。
+    プリセットごとに下限を求めるだけなので、拠点数が多くても解くより十分速い。
+    """
+    names, preset_idx = np.unique(sites['preset'], return_inverse=True)
+    coefs = [preset_coefficients(name) for name in names]
+    frames = []
+    for year in np.atleast_1d(years):
+        with span('validation'):
+            result = check_feasibility(
+                int(year), np.array([c[0] for c in coefs])[preset_idx],
+                np.array([c[1] for c in coefs])[preset_idx], sites['peak_kw'], sites['total_kwh'],
+                closures, drop_leap_day, resolution, optimize_shape=True
+            )
+        site_idx, month_idx = np.nonzero(result['status'] == TOO_LOW)
+        load_factor = result['load_factor'][site_idx, month_idx]
+        lf_min = result['lf_min'][site_idx, month_idx]
+        messages = [f"{FEASIBILITY_STATUS[TOO_LOW]}: 負荷率 {lf:.1%} < 下限 {low:.1%}（パターンの形状では合わせきれません）"
+                    for lf, low in zip(load_factor.tolist(), lf_min.tolist())]
+        frames.append(_issue_frame(sites['site_id'][site_idx], month_idx + 1, messages, 'warning'))
+    return pd.concat(frames, ignore_index=True).drop_duplicates(['site_id', 'month'])
+
+
+def drop_sites(sites, site_ids):
+    """site_ids の拠点を除いた拠点テーブルを返す"""
+    keep = ~np.isin(sites['site_id'], np.asarray(site_ids, dtype=object))
+    return {key: values[keep] for key, values in sites.items()}
+
+
+def format_issues(issues, limit=10):
+    """問題の一覧を表示用の複数行の文字列にする（先頭 limit 件）"""
+    lines = [
+        f"  {row.site_id}" + ("" if pd.isna(row.month) else f" {int(row.month)}月") + f": {row.issue}"
+        for row in issues.head(limit).itertuples()
+    ]
+    if len(issues) > limit:
+        lines.append(f"  ...ほか {len(issues) - limit} 件")
+    return "\n".join(lines)
+
+
+def load_sites(path, hours=None):
+    """
+    拠点ターゲット表を読み込み、拠点順に並んだ配列の dict を返す（問題があれば ValueError）
+
+    戻り値: {'site_id': (S,), 'preset': (S,), 'peak_kw': (S, 12), 'total_kwh': (S, 12)}
+    """
+    sites, issues = read_sites(path, hours)
+    if len(issues):
+        raise ValueError(f"入力に問題があります（{len(issues)}件）:\n{format_issues(issues)}")
+    return sites
+
+
+def split_sites(sites, chunksize):
+    """拠点テーブルを chunksize 拠点ずつのチャンクに分割する"""
+    n_sites = len(sites['site_id'])
+    for start in range(0, n_sites, chunksize):
+        yield {key: values[start:start + chunksize] for key, values in sites.items()}
+
+# ==========================================
+# 生成（ワーカープロセスで実行）
+# ==========================================
+
+def generate_chunk(chunk, year, drop_leap_day=False, shape_method='bisect',
+                   closures=DEFAULT_CLOSURES, resolution=60, dtype=np.float32, profile_stages=False,
+                   solve_cache_size=0):
+    """
+    チャンク内の全拠点・全月をまとめて生成し、
+    (site_id 配列, (拠点数, 時間数) 配列, フィット情報 dict) を返す
+
+    profile_stages=True ならワーカー内の工程別時間を info['profile'] に入れて返す
+    solve_cache_size > 0 ならワーカー内の SolveCache を使い、
+    このチャンクでのヒット・ミス数を info['solve_cache'] に入れて返す
+    """
+    if profile_stages:
+        with profile() as profiler:
+            site_ids, demand, info = generate_chunk(
+                chunk, year, drop_leap_day, shape_method, closures, resolution, dtype,
+                solve_cache_size=solve_cache_size
+            )
+        info['profile'] = profiler.report()
+        return site_ids, demand, info
+
+    global _solve_cache
+    cache = None
+    if solve_cache_size > 0:
+        if _solve_cache is None or _solve_cache.maxsize != solve_cache_size:
+            _solve_cache = SolveCache(maxsize=solve_cache_size)
+        cache = _solve_cache
+        hits, misses = cache.hits, cache.misses
+
+    names, preset_idx = np.unique(chunk['preset'], return_inverse=True)
+    coefs = [preset_coefficients(name) for name in names]
+    weekday_coefs = np.array([c[0] for c in coefs])[preset_idx]
+    holiday_coefs = np.array([c[1] for c in coefs])[preset_idx]
+
+    demand, info = generate_sites(
+        year, weekday_coefs, holiday_coefs, chunk['peak_kw'], chunk['total_kwh'],
+        closures=closures, drop_leap_day=drop_leap_day, resolution=resolution,
+        optimize_shape=True, adjust_targets=True, round_decimals=2,
+        shape_method=shape_method, dtype=dtype, solve_cache=cache, return_info=True
+    )
+    if cache is not None:
+        info['solve_cache'] = {'hits': cache.hits - hits, 'misses': cache.misses - misses}
+    return chunk['site_id'], demand, info
+
+
+def generate_portfolio(sites, year, workers=None, chunksize=256, drop_leap_day=False,
+                       shape_method='bisect', closures=DEFAULT_CLOSURES, resolution=60,
+                       dtype=np.float32, profile_stages=False, solve_cache_size=0,
+                       max_pending=None):
+    """
+    拠点チャンクをプロセスプールで並列生成し、入力順に結果を返すイテレータ
+
+    投入済みで未取得のチャンクは max_pending 個（既定: 2 × workers）までに抑える。
+    書き出しが生成より遅くても、結果がメモリに溜まり続けることはない。
+    """
+    worker = functools.partial(
+        generate_chunk, year=year, drop_leap_day=drop_leap_day, shape_method=shape_method,
+        closures=closures, resolution=resolution, dtype=dtype, profile_stages=profile_stages,
+        solve_cache_size=solve_cache_size
+    )
+    chunks = split_sites(sites, chunksize)
+    if workers == 1:
+        yield from map(worker, chunks)
+        return
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(worker, chunk))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def stream_portfolio(sites, years, drop_leap_day=False, closures=DEFAULT_CLOSURES,
+                     resolution=60, **kwargs):
+    """
+    複数年の生成結果を (calendar, site_id 配列, デマンド配列, フィット情報) のブロックで順に返す
+
+    年ごとに generate_portfolio を回す。各年とも sites の月別目標をそのまま使う（伸び率は掛けない）。
+    その他の引数は generate_portfolio と同じ。
+    """
+    for year in years:
+        calendar = build_calendar(year, closures, drop_leap_day, resolution)
+        for site_ids, demand, info in generate_portfolio(
+                sites, year, drop_leap_day=drop_leap_day, closures=closures,
+                resolution=resolution, **kwargs):
+            yield calendar, site_ids, demand, info
+
+
+def parse_batteries(spec):
+    """"100:25,200:50" を (容量 kWh の配列, 出力 kW の配列) にする"""
+    sizes = [item.split(':') for item in spec.split(',') if item.strip()]
+    if not sizes or any(len(size) != 2 for size in sizes):
+        raise ValueError(spec)
+    sizes = np.array(sizes, dtype=float)
+    if (sizes < 0).any():
+        raise ValueError(spec)
+    return sizes[:, 0], sizes[:, 1]
+
+# ==========================================
+# 出力
+# ==========================================
+
+def write_portfolio_csv(blocks, output_file):
+    """
+    stream_portfolio のブロックを順に追記し、1つの CSV にまとめる
+
+    output_file はパスまたはテキストのファイルオブジェクト。
+    ファイルに書いたブロックは保持しないので、メモリ使用量はブロック1つ分で済む。
+    戻り値は書き出したブロックの拠点数の合計（拠点 × 年）。
+    """
+    if hasattr(output_file, 'write'):
+        return _write_portfolio_csv(blocks, output_file)
+    with open(output_file, 'w', encoding='utf-8-sig', newline='') as f:
+        return _write_portfolio_csv(blocks, f)
+
+
+def _write_portfolio_csv(blocks, f):
+    n_sites = 0
+    for calendar, site_ids, demand, _ in blocks:
+        steps_per_day = calendar['steps_per_day']
+        dates = calendar['days'].strftime('%Y-%m-%d').to_numpy()
+        with span('pivot'):
+            block = pd.DataFrame(demand.reshape(-1, steps_per_day), columns=slot_labels(steps_per_day))
+            block.insert(0, 'Date', np.tile(dates, len(site_ids)))
+            block.insert(0, 'site_id', np.repeat(site_ids, len(dates)))
+        with span('csv_export'):
+            block.to_csv(f, header=(n_sites == 0), index=False)
+        n_sites += len(site_ids)
+    return n_sites
+
+
+def fit_report_frame(site_ids, info, year):
+    """フィット情報を拠点 × 月の縦持ち DataFrame にする"""
+    n_sites = len(site_ids)
+    return pd.DataFrame({
+        'site_id': np.repeat(site_ids, 12),
+        'year': year,
+        'month': np.tile(np.arange(1, 13), n_sites),
+        'gamma': info['gamma'].ravel(),
+        'b': info['b'].ravel(),
+        'v': info['v'].ravel(),
+        'iterations': info['iterations'].ravel(),
+        'residual_kwh': info['residual'].ravel(),
+        'converged': info['converged'].ravel(),
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="拠点ポートフォリオのデマンドデータを一括生成します")
+    parser.add_argument('input', help="拠点ターゲット表 (CSV / Excel)")
+    parser.add_argument('-o', '--output', help="出力ファイル (既定: demand_portfolio_<year>.<format>)")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv',
+                        help="出力形式 (parquet: 縦持ち・辞書エンコード, npy: 拠点 × コマの float32 行列)")
+    parser.add_argument('--year', type=int, default=2024, help="開始年")
+    parser.add_argument('--years', type=int, default=1,
+                        help="開始年から続けて生成する年数（csv / parquet のみ複数年に対応）。"
+                             "各年とも同じ月別目標を増減なしで繰り返す")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="並列プロセス数")
+    parser.add_argument('--chunksize', type=int, default=256, help="1回にワーカーへ渡す拠点数")
+    parser.add_argument('--max-pending', type=int,
+                        help="生成済みで書き出し待ちのチャンクの上限（既定: 2 × workers）")
+    parser.add_argument('--drop-leap-day', action='store_true', help="2/29 を除外する（app.py と同じ365日）")
+    parser.add_argument('--resolution', type=int, choices=RESOLUTIONS, default=60,
+                        help="1コマの長さ（分）。30 で1日48列")
+    parser.add_argument('--dtype', choices=['float32', 'float64'], default='float32',
+                        help="生成配列の型（float32 でメモリ半減、kW は有効7桁）")
+    parser.add_argument('--shape-solver', choices=['bisect', 'newton'], default='bisect',
+                        help="ガンマ値の探索方法 (newton: 許容誤差まで高速収束)")
+    parser.add_argument('--closures', default=','.join(DEFAULT_CLOSURES),
+                        help="土日・祝日以外の休業日 (カンマ区切りの MM-DD / YYYY-MM-DD、空文字で無し)")
+    parser.add_argument('--skip-invalid', action='store_true',
+                        help="入力に問題のある拠点を除いて生成を続ける（既定では問題を表示して終了）")
+    parser.add_argument('--strict', action='store_true',
+                        help="負荷率がパターンの下限を下回る月（警告）も問題として扱う")
+    parser.add_argument('--issues', help="入力の問題・警告の一覧を出力する CSV")
+    parser.add_argument('--fit-report', help="拠点 × 月の反復回数・残差を出力する CSV")
+    parser.add_argument('--archive',
+                        help="月別パラメータだけを保存するパラメトリック形式 (.npz) の出力先")
+    parser.add_argument('--solve-cache', type=int, default=65536,
+                        help="ワーカーごとに保持する形状最適化の解の数（0 で無効）")
+    parser.add_argument('--tariff',
+                        help="請求額を試算する料金プラン（tariff.TARIFF_PRESETS の名前または JSON ファイル）")
+    parser.add_argument('--bills', help="拠点 × 月の請求額を出力する CSV（既定: bills_<year>.csv）")
+    parser.add_argument('--batteries',
+                        help="ピークカットを試算する蓄電池の 容量kWh:出力kW（カンマ区切りで複数）")
+    parser.add_argument('--battery-efficiency', type=float, default=0.9, help="蓄電池の往復効率")
+    parser.add_argument('--battery-report',
+                        help="容量 × 拠点 × 月のピークカット結果を出力する CSV（既定: battery_<year>.csv）")
+    parser.add_argument('--profile', help="工程別の処理時間を出力する JSON（生成工程は全ワーカーの合計）")
+    args = parser.parse_args(argv)
+    if args.years > 1 and (args.format == 'npy' or args.archive):
+        parser.error("npy 出力と --archive は1年分のみ対応しています")
+    if args.bills and not args.tariff:
+        parser.error("--bills には --tariff で料金プランを指定してください")
+    batteries = None
+    if args.batteries:
+        try:
+            batteries = parse_batteries(args.batteries)
+        except ValueError:
+            parser.error(f"--batteries は 容量kWh:出力kW をカンマ区切りで指定してください: {args.batteries}")
+    elif args.battery_report:
+        parser.error("--battery-report には --batteries で蓄電池を指定してください")
+    tariff = None
+    if args.tariff:
+        try:
+            tariff = load_tariff(args.tariff)
+        except (OSError, ValueError) as exc:
+            parser.error(f"料金プランを読み込めません: {exc}")
+
+    closures = tuple(c.strip() for c in args.closures.split(',') if c.strip())
+    years = list(range(args.year, args.year + args.years))
+    sites, issues = read_sites(args.input, month_hours(years, args.drop_leap_day))
+    warnings = feasibility_issues(sites, years, args.drop_leap_day, closures, args.resolution)
+    if args.strict:
+        warnings['severity'] = 'error'
+    if args.issues:
+        pd.concat([issues, warnings], ignore_index=True).to_csv(args.issues, index=False, encoding='utf-8-sig')
+        print(f"入力の問題一覧を出力しました: {args.issues}")
+    if args.strict:
+        sites = drop_sites(sites, warnings['site_id'])
+        issues = pd.concat([issues, warnings], ignore_index=True)
+    elif len(warnings):
+        print(f"負荷率がパターンの下限を下回る月があります（{warnings['site_id'].nunique()}拠点, {len(warnings)}件）:\n"
+              f"{format_issues(warnings)}")
+    if len(issues):
+        n_invalid = issues['site_id'].nunique()
+        print(f"入力に問題のある拠点があります（{n_invalid}拠点, {len(issues)}件）:\n{format_issues(issues)}")
+        if not args.skip_invalid:
+            parser.exit(1, "問題を修正するか、--skip-invalid で該当拠点を除いて実行してください\n")
+        print(f"問題のある{n_invalid}拠点を除いて生成します")
+    if len(sites['site_id']) == 0:
+        parser.exit(1, "生成できる拠点がありません\n")
+    period = f"{years[0]}" if len(years) == 1 else f"{years[0]}-{years[-1]}"
+    output_file = args.output or f"demand_portfolio_{period}.{args.format}"
+    print(f"{len(sites['site_id'])}拠点の{period}年デマンドデータ生成を開始します... (workers={args.workers})")
+
+    blocks = stream_portfolio(
+        sites, years, workers=args.workers, chunksize=args.chunksize,
+        drop_leap_day=args.drop_leap_day, shape_method=args.shape_solver, closures=closures,
+        resolution=args.resolution, dtype=np.dtype(args.dtype), profile_stages=bool(args.profile),
+        solve_cache_size=args.solve_cache, max_pending=args.max_pending
+    )
+
+    reports = []
+    params = []
+    bills = []
+    ratchet_history = {}
+    battery_soc = {}
+    battery_reports = []
+    profiler = Profiler()
+    cache_stats = {'hits': 0, 'misses': 0}
+    def collect_report(blocks):
+        for calendar, site_ids, demand, info in blocks:
+            if 'profile' in info:
+                profiler.merge(info.pop('profile'))
+            for key, count in info.pop('solve_cache', {}).items():
+                cache_stats[key] += count
+            reports.append(fit_report_frame(site_ids, info, calendar['year']))
+            params.append({key: info[key] for key in ('gamma', 'b', 'v')})
+            if tariff is not None:
+                # 実量制の契約電力は拠点ごとに前年の最大需要電力を引き継ぐ（チャンク分割によらない）
+                no_history = np.full(12, np.nan)
+                history = np.array([ratchet_history.get(site, no_history) for site in site_ids])
+                block = calculate_bills(calendar, demand, tariff, history=history)
+                ratchet_history.update(zip(site_ids, block['max_demand_kw']))
+                bills.append(bill_frame(site_ids, block, calendar))
+            if batteries is not None:
+                # 蓄電池の残量も拠点ごとに前年12月末の値から続ける（初年度は満充電）
+                energy_kwh, power_kw = batteries
+                full = np.ones(len(energy_kwh))
+                initial_soc = np.array([battery_soc.get(site, full) for site in site_ids]).T
+                result = shave_peaks(calendar, demand, energy_kwh[:, None], power_kw[:, None],
+                                     efficiency=args.battery_efficiency, initial_soc=initial_soc)
+                battery_soc.update(zip(site_ids, result['final_soc'].T))
+                battery_reports.append(battery_frame(site_ids, result, *batteries, calendar))
+            yield calendar, site_ids, demand, info
+
+    def write_output():
+        if args.format == 'parquet':
+            return write_portfolio_parquet(collect_report(blocks), output_file)
+        if args.format == 'npy':
+            calendar = build_calendar(args.year, closures, args.drop_leap_day, args.resolution)
+            return write_portfolio_npy(collect_report(blocks), output_file,
+                                       len(sites['site_id']), len(calendar['index']))
+        return write_portfolio_csv(collect_report(blocks), output_file)
+
+    if args.profile:
+        with profile(profiler):
+            n_sites = write_output()
+    else:
+        n_sites = write_output()
+    if len(years) == 1:
+        print(f"\n完了しました。{n_sites}拠点分のファイルを出力しました: {output_file}")
+    else:
+        print(f"\n完了しました。{n_sites // len(years)}拠点 × {len(years)}年分のファイルを出力しました: {output_file}")
+
+    report = pd.concat(reports, ignore_index=True)
+    n_failed = int((~report['converged']).sum())
+    print(f"フィット: 平均反復 {report['iterations'].mean():.2f} 回, 最大残差 {report['residual_kwh'].max():.3f} kWh, 未収束 {n_failed} 件")
+    if args.solve_cache > 0:
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = cache_stats['hits'] / lookups if lookups else 0.0
+        print(f"解キャッシュ: ヒット {cache_stats['hits']} 件, ミス {cache_stats['misses']} 件 (ヒット率 {hit_rate:.1%})")
+    if args.fit_report:
+        report.to_csv(args.fit_report, index=False, encoding='utf-8-sig')
+        print(f"フィットレポートを出力しました: {args.fit_report}")
+    if args.archive:
+        coefs = {name: preset_coefficients(name) for name in np.unique(sites['preset'])}
+        archive = pack_profiles(
+            sites['site_id'],
+            np.array([coefs[name][0] for name in sites['preset']]),
+            np.array([coefs[name][1] for name in sites['preset']]),
+            sites['peak_kw'], sites['total_kwh'],
+            {key: np.concatenate([p[key] for p in params]) for key in ('gamma', 'b', 'v')},
+            args.year, closures, args.drop_leap_day, args.resolution,
+            adjust_targets=True, round_decimals=2, dtype=np.dtype(args.dtype)
+        )
+        save_profiles(args.archive, archive)
+        print(f"パラメトリック形式で保存しました: {args.archive} ({os.path.getsize(args.archive) / n_sites:.0f} バイト/拠点)")
+    if tariff is not None:
+        bills = pd.concat(bills, ignore_index=True)
+        bills_file = args.bills or f"bills_{period}.csv"
+        bills.round(2).to_csv(bills_file, index=False, encoding='utf-8-sig')
+        print(f"請求額（試算）: 合計 {bills['total'].sum():,.0f} 円, "
+              f"平均単価 {bills['total'].sum() / bills['kwh'].sum():.2f} 円/kWh -> {bills_file}")
+    if batteries is not None:
+        battery_report = pd.concat(battery_reports, ignore_index=True)
+        battery_file = args.battery_report or f"battery_{period}.csv"
+        battery_report.round(3).to_csv(battery_file, index=False, encoding='utf-8-sig')
+        summary = battery_report.groupby(['energy_kwh', 'power_kw'])['reduction_kw'].mean()
+        for (energy_kwh, power_kw), reduction in summary.items():
+            print(f"蓄電池 {energy_kwh:g} kWh / {power_kw:g} kW: 月最大の低減 平均 {reduction:.2f} kW")
+        print(f"ピークカットの結果を出力しました: {battery_file}")
+    if args.profile:
+        write_report(profiler, args.profile)
+        print(f"処理時間レポートを出力しました: {args.profile}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+蓄電池によるピークカットのシミュレーション
+
+生成したデマンドに蓄電池を置いたとき、月ごとの最大需要電力（契約電力の元になる値）を
+どこまで下げられるかを求める。
+
+    calendar = build_calendar(2024)
+    result = shave_peaks(calendar, demand, energy_kwh=200, power_kw=50, efficiency=0.9)
+    result['peak_kw']                       # (拠点数, 12) 蓄電池ありの月最大
+
+    # 容量の比較（容量の軸を前に置くと (容量数, 拠点数, 12) で返る）
+    result = shave_peaks(calendar, demand, energy_kwh=[[100], [200]], power_kw=[[25], [50]])
+
+運転はしきい値方式: デマンドがしきい値 T を超えたコマは超過分を放電し、下回ったコマは
+T を超えない範囲で充電する（できるだけ早く満充電に戻す）。この充電の仕方はどの時点でも
+残量が最大になるので T を守れるかどうかの判定は厳密で、守れる最小の T がその月の最適な
+ピークになる。T は月の順に決め、月末の残量を翌月に引き継ぐ。
+
+T の探索は、拠点 × 容量ごとに候補のしきい値を candidates 個並べた配列で1か月分をまとめて
+シミュレーションし、守れる最小の候補の前後に範囲を狭めていく（多分探索）。時刻のループは
+その月のコマ数だけで、拠点・容量・候補の方向はすべて配列演算になる。
+"""
+import numpy as np
+import pandas as pd
+
+from demand_engine import month_bounds
+from profiling import span
+
+# ==========================================
+# シミュレーション
+# ==========================================
+
+def _simulate(demand, threshold, soc, energy_kwh, power_kw, efficiency, interval_hours,
+              record=False):
+    """
+    1か月分のデマンド (コマ数, バッチ) をしきい値 threshold (バッチ, 候補数) で運転する
+
+    soc : 月初の残量 (バッチ, 候補数)。energy_kwh / power_kw は (バッチ, 1)
+    戻り値は (しきい値を守れたか, 月末の残量, record 時は蓄電池の出力 kW (コマ数, バッチ, 候補数))。
+    出力は放電が正・充電が負。充電した電力量は efficiency を掛けて残量に入る。
+    """
+    feasible = np.ones(threshold.shape, dtype=bool)
+    soc = soc.copy()
+    step_limit = power_kw * interval_hours
+    output = np.empty(demand.shape[:1] + threshold.shape) if record else None
+    want, step, work = (np.empty(threshold.shape) for _ in range(3))
+    ok = np.empty(threshold.shape, dtype=bool)
+    for t, x in enumerate(demand):
+        np.subtract(x[:, None], threshold, out=want)
+        want *= interval_hours
+        # 超過分を放電（出力と残量の範囲で）、下回るコマはしきい値まで充電（空き容量の範囲で）
+        np.clip(want, -step_limit, step_limit, out=step)
+        np.minimum(step, soc, out=step)
+        np.subtract(soc, energy_kwh, out=work)
+        work /= efficiency
+        np.maximum(step, work, out=step)
+        np.subtract(want, step, out=work)
+        np.less_equal(work, 1e-9, out=ok)
+        feasible &= ok
+        # 残量の変化は放電なら step、充電なら step × 効率（efficiency <= 1 なので大きい方）
+        np.multiply(step, efficiency, out=work)
+        soc -= np.maximum(step, work, out=work)
+        if record:
+            output[t] = step / interval_hours
+    return feasible, soc, output
+
+
+def shave_peaks(calendar, demand, energy_kwh, power_kw, efficiency=0.9, initial_soc=1.0,
+                tol=0.01, candidates=8, return_series=False):
+    """
+    蓄電池の運転で月ごとの最大需要電力を最小にしたときの結果を返す
+
+    calendar   : demand を作ったカレンダー（build_calendar / build_timeline）
+    demand     : (..., コマ数) のデマンド (kW)
+    energy_kwh / power_kw : 蓄電池の容量 (kWh)・出力 (kW)。demand の先頭の軸と
+                 ブロードキャストできる形（容量を比較するときは先頭に軸を足す）
+    efficiency : 充放電の往復効率
+    initial_soc: 計算開始時の残量（容量に対する割合）。energy_kwh と同じくバッチ形状に
+                 ブロードキャストできれば拠点ごとに与えてよい（前の期間の final_soc から続けるとき）
+    tol        : しきい値の探索精度 (kW)
+    candidates : 1回のシミュレーションで試すしきい値の数
+
+    戻り値はバッチ形状 (...) に月の軸を足した配列の dict:
+      original_peak_kw, peak_kw, reduction_kw, discharged_kwh
+    と、バッチ形状 (...) の final_soc（計算終了時の残量、容量に対する割合。容量 0 なら 1）。
+    return_series=True なら net_demand（蓄電池ありのデマンド）と soc_kwh（各コマ末の残量）
+    を (..., コマ数) で加える。データの無い（NaN の）月は NaN になる。
+    """
+    demand = np.asarray(demand, dtype=float)
+    batch_shape = np.broadcast_shapes(demand.shape[:-1], np.shape(energy_kwh), np.shape(power_kw))
+    n_slots = demand.shape[-1]
+    flat = np.broadcast_to(demand, batch_shape + (n_slots,)).reshape(-1, n_slots)
+    energy = np.broadcast_to(np.asarray(energy_kwh, dtype=float), batch_shape).reshape(-1, 1)
+    power = np.broadcast_to(np.asarray(power_kw, dtype=float), batch_shape).reshape(-1, 1)
+    interval_hours = calendar['interval_hours']
+
+    starts, ends = month_bounds(calendar['period'])
+    missing = np.isnan(flat)
+    values = np.where(missing, 0.0, flat)
+    original = np.maximum.reduceat(values, starts, axis=1)
+    peak = np.empty_like(original)
+    discharged = np.empty_like(original)
+    if return_series:
+        net = np.empty_like(values)
+        soc_series = np.empty_like(values)
+    soc = energy * np.broadcast_to(np.asarray(initial_soc, dtype=float), batch_shape).reshape(-1, 1)
+    grid = np.arange(candidates) / candidates
+
+    with span('battery'):
+        for m, (start, end) in enumerate(zip(starts, ends)):
+            month = np.ascontiguousarray(values[:, start:end].T)
+            # しきい値の範囲: 出力の上限だけ下げた値（下限）〜 蓄電池なしの月最大（必ず守れる）
+            lo = np.maximum(original[:, m:m + 1] - power, 0.0)
+            hi = original[:, m:m + 1].copy()
+            while (hi - lo).max() > tol:
+                threshold = lo + (hi - lo) * grid
+                feasible, _, _ = _simulate(month, threshold, np.broadcast_to(soc, threshold.shape),
+                                           energy, power, efficiency, interval_hours)
+                # 守れる最小の候補 k（無ければ hi のまま）の1つ手前〜k に狭める
+                first = np.where(feasible.any(axis=1), feasible.argmax(axis=1), candidates)[:, None]
+                upper = np.take_along_axis(np.append(threshold, hi, axis=1), first, axis=1)
+                lower = np.take_along_axis(threshold, np.maximum(first - 1, 0), axis=1)
+                lo, hi = np.where(first == 0, upper, lower), upper
+
+            _, soc_end, output = _simulate(month, hi, soc, energy, power, efficiency,
+                                           interval_hours, record=True)
+            output = output[:, :, 0].T
+            net_month = values[:, start:end] - output
+            peak[:, m] = net_month.max(axis=1)
+            discharged[:, m] = np.clip(output, 0, None).sum(axis=1) * interval_hours
+            if return_series:
+                net[:, start:end] = net_month
+                # 各コマ末の残量は出力の累積から戻す（充電は効率を掛けて入る）
+                stored = np.where(output > 0, output, output * efficiency) * interval_hours
+                soc_series[:, start:end] = soc - np.cumsum(stored, axis=1)
+            soc = soc_end
+
+    month_missing = np.logical_and.reduceat(missing, starts, axis=1)
+    result = {
+        'original_peak_kw': np.where(month_missing, np.nan, original),
+        'peak_kw': np.where(month_missing, np.nan, peak),
+        'discharged_kwh': np.where(month_missing, np.nan, discharged),
+    }
+    result['reduction_kw'] = result['original_peak_kw'] - result['peak_kw']
+    result['final_soc'] = np.divide(soc[:, 0], energy[:, 0], out=np.ones(len(soc)), where=energy[:, 0] > 0)
+    if return_series:
+        result['net_demand'] = np.where(missing, np.nan, net)
+        result['soc_kwh'] = soc_series
+    return {key: value.reshape(batch_shape + value.shape[1:]) for key, value in result.items()}
+
+
+def battery_frame(site_ids, result, energy_kwh, power_kw, calendar):
+    """
+    容量の軸を前に置いた shave_peaks の結果 (容量数, 拠点数, 期間数) を
+    容量 × 拠点 × 月の縦持ち DataFrame にする
+    """
+    starts, _ = month_bounds(calendar['period'])
+    n_sizes, n_sites, n_periods = result['peak_kw'].shape
+    return pd.DataFrame({
+        'energy_kwh': np.repeat(np.asarray(energy_kwh, dtype=float).ravel(), n_sites * n_periods),
+        'power_kw': np.repeat(np.asarray(power_kw, dtype=float).ravel(), n_sites * n_periods),
+        'site_id': np.tile(np.repeat(np.asarray(site_ids), n_periods), n_sizes),
+        'year': np.tile(calendar['index'][starts].year.to_numpy(), n_sizes * n_sites),
+        'month': np.tile(calendar['month'][starts], n_sizes * n_sites),
+        'original_peak_kw': result['original_peak_kw'].ravel(),
+        'peak_kw': result['peak_kw'].ravel(),
+        'reduction_kw': result['reduction_kw'].ravel(),
+        'discharged_kwh': result['discharged_kwh'].ravel(),
+    })
@@ -0,0 +1,227 @@
+"""
+生成パイプラインのベンチマーク
+
+工程ごと（月別パラメータ計算・形状最適化・カレンダー/休日判定・年間生成・
+丸め後の合計調整・日 × 時刻の表への変形・CSV 出力）の所要時間を、
+拠点数・年数・時間分解能を変えて計測し、JSON に保存する。
+保存済みのベースラインと比較して、遅くなった工程を検出できる。
+
+使い方:
+    python benchmark.py -o bench.json
+    python benchmark.py --sites 1 100 1000 --years 1 5 --resolutions 60 30
+    python benchmark.py --compare bench_baseline.json --threshold 1.2
+"""
+import argparse
+import datetime
+import io
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import demand_engine
+import holiday_calendar
+from demand_engine import (
+    build_calendar, calculate_monthly_params_batch, fit_to_targets, generate_sites,
+    month_layout, optimize_pattern_shape_batch, slot_labels,
+)
+from presets import PRESET_PATTERNS, preset_coefficients
+
+START_YEAR = 2024
+
+# ==========================================
+# 計測
+# ==========================================
+
+def time_call(func, repeat=5):
+    """func() を repeat 回実行し、(最短, 平均) 秒を返す"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings)
+
+
+def make_sites(n_sites, seed=0):
+    """プリセットと負荷率をばらつかせた拠点ターゲットを作る（乱数固定）"""
+    rng = np.random.default_rng(seed)
+    names = list(PRESET_PATTERNS)
+    coefs = [preset_coefficients(name) for name in names]
+    pick = rng.integers(len(names), size=n_sites)
+    peaks = rng.uniform(20, 500, size=(n_sites, 1)) * rng.uniform(0.8, 1.0, size=(n_sites, 12))
+    load_factor = rng.uniform(0.25, 0.75, size=(n_sites, 12))
+    totals = np.round(peaks * load_factor * 730)
+    return {
+        'weekday_coefs': np.array([coefs[i][0] for i in pick]),
+        'holiday_coefs': np.array([coefs[i][1] for i in pick]),
+        'peak_kw': np.round(peaks, 1),
+        'total_kwh': totals,
+    }
+
+
+def clear_calendar_caches():
+    demand_engine._build_calendar.cache_clear()
+    holiday_calendar.japanese_holidays.cache_clear()
+    holiday_calendar.public_holiday_mask.cache_clear()
+    holiday_calendar._day_mask.cache_clear()
+
+
+def bench_case(n_sites, n_years, resolution, repeat=5):
+    """1つの (拠点数, 年数, 分解能) について各工程を計測し、{工程: (最短, 平均)} を返す"""
+    sites = make_sites(n_sites)
+    years = range(START_YEAR, START_YEAR + n_years)
+    calendars = [build_calendar(year, resolution=resolution) for year in years]
+    steps_per_day = calendars[0]['steps_per_day']
+    values = np.concatenate([
+        np.repeat(sites['weekday_coefs'], steps_per_day // 24, axis=1),
+        np.repeat(sites['holiday_coefs'], steps_per_day // 24, axis=1),
+    ], axis=1)[:, None, :]
+    weights = [month_layout(calendar)[None] for calendar in calendars]
+    peaks, totals = sites['peak_kw'], sites['total_kwh']
+
+    def generate(**kwargs):
+        return [
+            generate_sites(year, sites['weekday_coefs'], sites['holiday_coefs'], peaks, totals,
+                           resolution=resolution, optimize_shape=True, **kwargs)
+            for year in years
+        ]
+
+    raw = generate()
+    demand = generate(adjust_targets=True, round_decimals=2)
+
+    def adjust():
+        for calendar, d in zip(calendars, raw):
+            fit_to_targets(d.copy(), peaks, totals, calendar['month'],
+                           calendar['interval_hours'], decimals=2)
+
+    def pivot():
+        return [
+            pd.DataFrame(d.reshape(-1, steps_per_day), columns=slot_labels(steps_per_day))
+            for d in demand
+        ]
+    frames = pivot()
+
+    def export():
+        buffer = io.StringIO()
+        for frame in frames:
+            frame.to_csv(buffer, index=False)
+
+    def calendar_stage():
+        clear_calendar_caches()
+        for year in years:
+            build_calendar(year, resolution=resolution)
+
+    stages = {
+        'calculate_monthly_params': lambda: [
+            calculate_monthly_params_batch(peaks, totals, values, w) for w in weights],
+        'optimize_pattern_shape': lambda: [
+            optimize_pattern_shape_batch(peaks, totals, values, w) for w in weights],
+        'optimize_pattern_shape_newton': lambda: [
+            optimize_pattern_shape_batch(peaks, totals, values, w, method='newton') for w in weights],
+        'calendar': calendar_stage,
+        'generate': generate,
+        'adjust_rounding': adjust,
+        'pivot': pivot,
+        'csv_export': export,
+    }
+    results = {name: time_call(func, repeat) for name, func in stages.items()}
+    results['total'] = time_call(lambda: generate(adjust_targets=True, round_decimals=2), repeat)
+    return results
+
+
+def run_benchmarks(site_counts, year_counts, resolutions, repeat=5, log=print):
+    """全ケースを計測して結果レコードのリストを返す"""
+    records = []
+    for resolution in resolutions:
+        for n_years in year_counts:
+            for n_sites in site_counts:
+                results = bench_case(n_sites, n_years, resolution, repeat)
+                for stage, (best, mean) in results.items():
+                    records.append({
+                        'stage': stage, 'sites': n_sites, 'years': n_years,
+                        'resolution': resolution, 'best_s': best, 'mean_s': mean,
+                    })
+                log(f"sites={n_sites:>5} years={n_years} resolution={resolution:>2}分: "
+                    f"total {results['total'][0] * 1000:.1f} ms")
+    return records
+
+# ==========================================
+# 保存・比較
+# ==========================================
+
+def environment_info():
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+    }
+
+
+def record_key(record):
+    return (record['stage'], record['sites'], record['years'], record['resolution'])
+
+
+def compare_results(current, baseline, threshold=1.2):
+    """
+    ベースラインと比較し、工程ごとの比率（現在 / ベースライン、最短時間）の DataFrame を返す
+
+    比率が threshold を超えたものは regression=True になる。
+    """
+    base = {record_key(r): r['best_s'] for r in baseline['results']}
+    rows = []
+    for record in current['results']:
+        key = record_key(record)
+        if key not in base:
+            continue
+        ratio = record['best_s'] / base[key] if base[key] > 0 else float('inf')
+        rows.append(dict(zip(('stage', 'sites', 'years', 'resolution'), key),
+                         baseline_s=base[key], current_s=record['best_s'], ratio=ratio,
+                         regression=ratio > threshold))
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="デマンド生成パイプラインの工程別ベンチマーク")
+    parser.add_argument('-o', '--output', default='bench_results.json', help="結果を保存する JSON")
+    parser.add_argument('--sites', type=int, nargs='+', default=[1, 100, 1000], help="拠点数")
+    parser.add_argument('--years', type=int, nargs='+', default=[1], help="年数")
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[60],
+                        choices=demand_engine.RESOLUTIONS, help="時間分解能（分）")
+    parser.add_argument('--repeat', type=int, default=5, help="各工程の繰り返し回数（最短を採用）")
+    parser.add_argument('--compare', help="比較するベースラインの JSON")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="この比率を超えて遅くなった工程を回帰とみなす")
+    args = parser.parse_args(argv)
+
+    current = {
+        'environment': environment_info(),
+        'results': run_benchmarks(args.sites, args.years, args.resolutions, args.repeat),
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report = compare_results(current, baseline, args.threshold)
+        if report.empty:
+            print("ベースラインに同じ条件の計測がありません")
+            return 0
+        print(report.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+        n_regressions = int(report['regression'].sum())
+        if n_regressions:
+            print(f"\n{n_regressions}件の工程が {args.threshold:.2f} 倍を超えて遅くなっています")
+            return 1
+        print("\n回帰はありません")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
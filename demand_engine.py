@@ -0,0 +1,1069 @@
+"""
+デマンド生成エンジン
+
+年・平日/休日の係数ベクトル・月別ターゲットから、1年分の時間別デマンドを
+NumPy 配列として一括生成する。時間ごとの Python ループは使わず、
+カレンダーマスクとファンシーインデックスでパターンを展開する。
+app.py と generate_demand.py の共通ロジック。
+"""
+import collections
+import functools
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from holiday_calendar import DEFAULT_CLOSURES, holiday_day_mask
+from profiling import span
+
+HOURS_PER_DAY = 24
+
+# 対応する時間分解能（分）
+RESOLUTIONS = (60, 30, 15)
+
+# 形状最適化で探索するガンマ値の範囲
+GAMMA_BOUNDS = (0.1, 10.0)
+
+# ==========================================
+# カレンダー
+# ==========================================
+
+@functools.lru_cache(maxsize=32)
+def _build_calendar(year, drop_leap_day, closures, resolution):
+    days = pd.date_range(start=f"{year}-01-01", end=f"{year}-12-31", freq='D')
+    # 日単位のマスク（土日・祝日・休業日）
+    day_holiday = holiday_day_mask(year, closures)
+    if drop_leap_day:
+        keep = ~((days.month == 2) & (days.day == 29))
+        days = days[keep]
+        day_holiday = day_holiday[keep]
+    day_month = np.asarray(days.month, dtype=np.int8)
+
+    # コマ単位へ展開（日 × 1日のコマ数）
+    steps_per_day = HOURS_PER_DAY * 60 // resolution
+    n_days = len(days)
+    slot = np.tile(np.arange(steps_per_day, dtype=np.int16), n_days)
+    day_of_slot = np.repeat(np.arange(n_days), steps_per_day)
+    index = pd.DatetimeIndex(
+        np.repeat(days.values, steps_per_day)
+        + (slot.astype(np.int64) * resolution).astype('timedelta64[m]')
+    )
+
+    calendar = {
+        'year': year,
+        'days': days,
+        'index': index,
+        'resolution': resolution,
+        'steps_per_day': steps_per_day,
+        'interval_hours': resolution / 60,
+        'day_holiday': day_holiday,
+        'day_month': day_month,
+        'slot': slot,
+        'hour': (slot * resolution // 60).astype(np.int8),
+        'month': day_month[day_of_slot],
+        'holiday': day_holiday[day_of_slot],
+    }
+    # 1年分では月がそのまま期間（build_timeline では年をまたいだ通し番号）
+    calendar['day_period'] = calendar['day_month']
+    calendar['period'] = calendar['month']
+    for value in calendar.values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    return calendar
+
+
+def build_calendar(year, closures=DEFAULT_CLOSURES, drop_leap_day=False, resolution=60):
+    """
+    1年分のコマ単位カレンダーを作成する（年・休業日・閏日・分解能ごとにキャッシュ）
+
+    休日は holiday_calendar の規則（土日・祝日・振替休日・休業日）で判定する。
+    resolution は 1コマの長さ（分）で、60 / 30 / 15 に対応する。
+    戻り値は以下のキーを持つ dict（配列は読み取り専用）:
+      year           : 年
+      days           : 日付の DatetimeIndex
+      index          : コマの DatetimeIndex
+      resolution     : 1コマの長さ（分）
+      steps_per_day  : 1日のコマ数 (24 / 48 / 96)
+      interval_hours : 1コマの時間数 (1.0 / 0.5 / 0.25)
+      day_holiday    : 日ごとの休日フラグ
+      day_month      : 日ごとの月
+      slot           : コマごとの日内番号 (0 〜 steps_per_day-1)
+      hour           : コマごとの時 (0-23)
+      month          : コマごとの月 (1-12)
+      holiday        : コマごとの休日フラグ
+      day_period / period : 日ごと・コマごとの期間番号（月ごとに目標を持つ単位。1年分では月と同じ）
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"未対応の分解能です: {resolution}分 (対応: {RESOLUTIONS})")
+    return _build_calendar(int(year), bool(drop_leap_day), tuple(closures), int(resolution))
+
+
+def build_timeline(start_year, n_years, closures=DEFAULT_CLOSURES, drop_leap_day=False, resolution=60):
+    """
+    start_year から n_years 年分を連結したカレンダーを作成する
+
+    キーは build_calendar と同じ（year は開始年）で、加えて
+      years    : 対象年のタプル
+      day_year : 日ごとの年
+    を持つ。day_period / period は (年の番号 × 12 + 月) の 1 〜 12 × n_years の通し番号。
+    閏年は drop_leap_day を指定しない限り 2/29 を含む。
+    """
+    years = tuple(range(int(start_year), int(start_year) + int(n_years)))
+    calendars = [build_calendar(year, closures, drop_leap_day, resolution) for year in years]
+    if len(calendars) == 1:
+        return dict(calendars[0], years=years,
+                    day_year=np.full(len(calendars[0]['days']), years[0], dtype=np.int16))
+
+    first = calendars[0]
+    timeline = {
+        'year': years[0],
+        'years': years,
+        'days': calendars[0]['days'].append([c['days'] for c in calendars[1:]]),
+        'index': calendars[0]['index'].append([c['index'] for c in calendars[1:]]),
+        'resolution': first['resolution'],
+        'steps_per_day': first['steps_per_day'],
+        'interval_hours': first['interval_hours'],
+        'day_year': np.concatenate([np.full(len(c['days']), c['year'], dtype=np.int16) for c in calendars]),
+    }
+    for key in ('day_holiday', 'day_month', 'slot', 'hour', 'month', 'holiday'):
+        timeline[key] = np.concatenate([c[key] for c in calendars])
+    offset = (timeline['day_year'] - years[0]).astype(np.int32) * 12
+    timeline['day_period'] = offset + timeline['day_month']
+    timeline['period'] = np.repeat(timeline['day_period'], first['steps_per_day'])
+    return timeline
+
+
+def slot_labels(steps_per_day):
+    """1日のコマのラベル（'00:00', '00:30', ...）"""
+    minutes = np.arange(steps_per_day) * (HOURS_PER_DAY * 60 // steps_per_day)
+    return [f"{m // 60:02d}:{m % 60:02d}" for m in minutes]
+
+
+def expand_pattern(coefs, steps_per_day):
+    """
+    係数パターンを1日のコマ数に合わせる
+
+    24値（時間別）のパターンは各時間をコマ数分繰り返し、
+    steps_per_day 値のパターンはそのまま使う。先頭以外の次元は拠点などのバッチ。
+    """
+    coefs = np.asarray(coefs, dtype=float)
+    n_values = coefs.shape[-1]
+    if n_values == steps_per_day:
+        return coefs
+    if n_values == HOURS_PER_DAY and steps_per_day % HOURS_PER_DAY == 0:
+        return np.repeat(coefs, steps_per_day // HOURS_PER_DAY, axis=-1)
+    raise ValueError(f"パターンの長さ {n_values} は1日 {steps_per_day} コマに対応していません")
+
+
+def build_hourly_patterns(calendar, weekday_coef, holiday_coef):
+    """平日/休日の係数ベクトルをコマごとのパターン配列に展開する"""
+    steps_per_day = calendar['steps_per_day']
+    table = np.array([
+        expand_pattern(weekday_coef, steps_per_day),
+        expand_pattern(holiday_coef, steps_per_day),
+    ])
+    return table[calendar['holiday'].astype(np.intp), calendar['slot']]
+
+# ==========================================
+# 月別パラメータ計算
+# ==========================================
+
+def calculate_monthly_params(target_peak, target_total, patterns_in_month):
+    """
+    その月のPeakとTotalを満たす Base_Load(B) と Variable_Width(V) を計算する
+    式: Demand(t) = B + V * Pattern(t)
+
+    条件1: Max(Demand) = B + V * Max(Pattern) = Target_Peak
+    条件2: Sum(Demand) = N * B + V * Sum(Pattern) = Target_Total
+
+    (1)より B = Target_Peak - V * Max(Pattern)
+    (2)に代入して V を解く
+    """
+    patterns_in_month = np.asarray(patterns_in_month, dtype=float)
+    n_hours = len(patterns_in_month)
+    sum_p = patterns_in_month.sum()
+    max_p = patterns_in_month.max()
+
+    # 分母: Sum(P) - N * Max(P)
+    denominator = sum_p - (n_hours * max_p)
+
+    if denominator == 0:
+        # パターンがフラット(全て同じ値)の場合はVが定まらないため、フラットな負荷として返す
+        return target_total / n_hours, 0.0
+
+    # 分子: Target_Total - N * Target_Peak
+    numerator = target_total - (n_hours * target_peak)
+
+    v = numerator / denominator
+    b = target_peak - (v * max_p)
+
+    return b, v
+
+
+def optimize_pattern_shape(target_peak, target_total, patterns_in_month, max_iter=20):
+    """パターンの「鋭さ（ガンマ値）」を自動調整する"""
+    current_patterns = np.array(patterns_in_month, dtype=float)
+
+    low = 0.1
+    high = 10.0
+    mid = 1.0
+
+    b, v = calculate_monthly_params(target_peak, target_total, current_patterns)
+
+    if b >= -0.001 and v >= -0.001:
+        return current_patterns, b, v
+
+    p_max = current_patterns.max()
+    if p_max == 0:
+        return current_patterns, b, v
+
+    for _ in range(max_iter):
+        mid = (low + high) / 2
+
+        temp_patterns = np.power(current_patterns / p_max, mid) * p_max
+
+        b, v = calculate_monthly_params(target_peak, target_total, temp_patterns)
+
+        if b < 0:
+            low = mid
+        elif v < 0:
+            high = mid
+        else:
+            return temp_patterns, b, v
+
+    final_patterns = np.power(current_patterns / p_max, mid) * p_max
+    b, v = calculate_monthly_params(target_peak, target_total, final_patterns)
+    return final_patterns, b, v
+
+# ==========================================
+# バッチ版（拠点 × 月をまとめて解く）
+# ==========================================
+#
+# 1か月のパターンは「平日係数 + 休日係数」（1時間分解能なら48値）が、それぞれ
+# 平日日数・休日日数だけ繰り返されたものになる。そこで月を
+# (values: 係数, weights: 出現時間数) で表し、コマ数に依存しない配列で解く。
+# weights を「回数 × 1コマの時間数」にしておくと、合計が kWh のまま同じ式で扱える。
+
+def month_layout(calendar):
+    """
+    カレンダーから月（期間）ごとの (12, 2 × 1日のコマ数) 重み行列を作成する
+
+    前半の列は平日の各コマ、後半の列は休日の各コマの出現時間数（回数 × 1コマの時間数）。
+    build_timeline のカレンダーでは (12 × 年数, 2 × 1日のコマ数) になる。
+    """
+    day_type = calendar['day_holiday'].astype(np.intp)
+    n_periods = int(calendar['day_period'][-1])
+    day_counts = np.zeros((n_periods, 2))
+    np.add.at(day_counts, (calendar['day_period'] - 1, day_type), 1)
+    return np.repeat(day_counts * calendar['interval_hours'], calendar['steps_per_day'], axis=1)
+
+
+def calculate_monthly_params_batch(target_peak, target_total, values, weights):
+    """
+    calculate_monthly_params のバッチ版
+
+    values  : (..., K) パターン値
+    weights : (..., K) 各値の出現回数（values とブロードキャスト可能）
+    target_peak / target_total : (...) 形状の配列
+    戻り値: (B, V) の配列
+    """
+    values, weights = np.broadcast_arrays(values, weights)
+    n_hours = weights.sum(axis=-1)
+    sum_p = (weights * values).sum(axis=-1)
+    max_p = np.where(weights > 0, values, -np.inf).max(axis=-1)
+
+    denominator = sum_p - (n_hours * max_p)
+    numerator = target_total - (n_hours * target_peak)
+
+    # パターンがフラットな場合はフラットな負荷として返す（重み付き和の丸め誤差は許容）
+    flat = np.abs(denominator) <= 1e-12 * np.abs(n_hours * max_p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.where(flat, 0.0, numerator / np.where(flat, 1.0, denominator))
+    b = np.where(flat, target_total / n_hours, target_peak - (v * max_p))
+    return b, v
+
+
+def shape_patterns(values, p_max, gamma):
+    """パターンをピーク値を保ったままガンマ値で変形する"""
+    p_max = np.asarray(p_max, dtype=float)[..., None]
+    gamma = np.asarray(gamma, dtype=float)[..., None]
+    safe_max = np.where(p_max > 0, p_max, 1.0)
+    # ガンマ=1 は元のパターンをそのまま使う（丸め誤差を入れない）
+    return np.where(gamma == 1.0, values, np.power(values / safe_max, gamma) * safe_max)
+
+
+def month_shapes(values, weights, gamma):
+    """月ごとに、出現するコマの最大値で正規化して gamma 乗した係数を返す"""
+    p_max = np.where(weights > 0, values, -np.inf).max(axis=-1)
+    return shape_patterns(values, p_max, gamma)
+
+
+def _pattern_sum(q, weights, gamma):
+    """正規化パターン q (0〜1) の重み付き和 Σw·q^γ とその γ 微分 Σw·q^γ·ln(q)"""
+    positive = q > 0
+    log_q = np.log(np.where(positive, q, 1.0))
+    q_gamma = np.where(positive, np.exp(gamma[:, None] * log_q), 0.0)
+    return (weights * q_gamma).sum(axis=-1), (weights * q_gamma * log_q).sum(axis=-1)
+
+
+def shape_fit_residual(target_peak, target_total, values, weights, gamma):
+    """
+    ガンマ値 gamma での残差 (kWh) を返す
+
+    B, V >= 0 の範囲で Peak を保ったときに Total に届かない量:
+      V < 0 側: Total - N * Peak（契約電力超過でしか達成できない量）
+      B < 0 側: Peak * Σq^γ - Total（B=0 でもピークを下げないと合わせられない量）
+    """
+    values, weights = np.broadcast_arrays(values, weights)
+    n_hours = weights.sum(axis=-1)
+    p_max = np.where(weights > 0, values, -np.inf).max(axis=-1)
+    q = values / np.where(p_max > 0, p_max, 1.0)[..., None]
+    gamma = np.broadcast_to(np.asarray(gamma, dtype=float), n_hours.shape)
+    sum_q, _ = _pattern_sum(q.reshape(-1, q.shape[-1]), weights.reshape(-1, q.shape[-1]), gamma.ravel())
+    sum_q = sum_q.reshape(n_hours.shape)
+    return (np.maximum(target_total - n_hours * target_peak, 0.0)
+            + np.maximum(target_peak * sum_q - target_total, 0.0))
+
+
+def optimize_pattern_shape_batch(target_peak, target_total, values, weights, max_iter=20,
+                                 method='bisect', tol=1e-6, gamma_bounds=GAMMA_BOUNDS,
+                                 return_info=False):
+    """
+    optimize_pattern_shape のバッチ版（拠点 × 月などの問題をまとめて解く）
+
+    values / weights は calculate_monthly_params_batch と同じ形式。
+    探索の状態を配列で持ち、収束した問題は以降の計算から外す。
+
+    method:
+      'bisect' : 従来と同じ二分探索（B, V >= 0 となる最初の中間値を採用）
+      'newton' : B(γ) = 0 となる γ を安全化ニュートン法で解く。
+                 Σw·q^γ は γ に対して単調減少かつ凸なので、γ=1 から始めると
+                 根に向かって単調に収束する。ブラケット外に出る場合は二分法に切り替え、
+                 残差が tol * Total 以下になった時点で収束とする。
+    return_info: True なら (gamma, B, V, info) を返す。info は以下の配列を持つ dict:
+      iterations : 評価回数
+      residual   : shape_fit_residual の残差 (kWh)
+      converged  : 許容誤差内で解けたか
+    戻り値: (gamma, B, V) の配列
+    """
+    target_peak, target_total = np.broadcast_arrays(
+        np.asarray(target_peak, dtype=float), np.asarray(target_total, dtype=float)
+    )
+    values, weights = np.broadcast_arrays(
+        np.asarray(values, dtype=float), np.asarray(weights, dtype=float)
+    )
+    batch_shape = np.broadcast_shapes(target_peak.shape, values.shape[:-1])
+    target_peak = np.broadcast_to(target_peak, batch_shape).ravel()
+    target_total = np.broadcast_to(target_total, batch_shape).ravel()
+    values = np.broadcast_to(values, batch_shape + values.shape[-1:]).reshape(-1, values.shape[-1])
+    weights = np.broadcast_to(weights, batch_shape + weights.shape[-1:]).reshape(-1, weights.shape[-1])
+
+    p_max = np.where(weights > 0, values, -np.inf).max(axis=-1)
+    gamma = np.ones(len(target_peak))
+    iterations = np.zeros(len(target_peak), dtype=np.int32)
+    gamma_low, gamma_high = gamma_bounds
+
+    # ガンマ=1 でそのまま満たせる問題・変形できない問題は対象外
+    b, v = calculate_monthly_params_batch(target_peak, target_total, values, weights)
+    active = ~((b >= -0.001) & (v >= -0.001)) & (p_max > 0) & ~np.isnan(b)
+
+    if method == 'bisect':
+        idx = np.flatnonzero(active)
+        low = np.full(len(idx), float(gamma_low))
+        high = np.full(len(idx), float(gamma_high))
+        mid = np.ones(len(idx))
+        for _ in range(max_iter):
+            if len(idx) == 0:
+                break
+            mid = (low + high) / 2
+            iterations[idx] += 1
+            temp = shape_patterns(values[idx], p_max[idx], mid)
+            b_i, v_i = calculate_monthly_params_batch(target_peak[idx], target_total[idx], temp, weights[idx])
+
+            solved = (b_i >= 0) & (v_i >= 0)
+            gamma[idx[solved]] = mid[solved]
+            low = np.where(b_i < 0, mid, low)
+            high = np.where((b_i >= 0) & (v_i < 0), mid, high)
+
+            keep = ~solved
+            idx, low, high, mid = idx[keep], low[keep], high[keep], mid[keep]
+
+        # 反復上限に達した問題は最後の中間値を採用する
+        gamma[idx] = mid
+
+    elif method == 'newton':
+        # V < 0（Total > N * Peak）はγでは解消できないので解かない
+        active &= v >= 0
+        idx = np.flatnonzero(active)
+        q = values[idx] / p_max[idx, None]
+        w = weights[idx]
+        # f(γ) = Σw·q^γ - Total / Peak  （B >= 0 ⇔ f <= 0）
+        offset = target_total[idx] / target_peak[idx]
+        scale = target_peak[idx] / target_total[idx]
+
+        low = np.ones(len(idx))
+        high = np.full(len(idx), float(gamma_high))
+        g = low.copy()
+
+        # 上限γでも B < 0 の問題は解なし（上限γを採用して打ち切る）
+        f_high, _ = _pattern_sum(q, w, high)
+        infeasible = f_high > offset
+        iterations[idx] += 1
+        g[infeasible] = high[infeasible]
+        pos = np.flatnonzero(~infeasible)
+        for _ in range(max_iter):
+            if len(pos) == 0:
+                break
+            iterations[idx[pos]] += 1
+            f, df = _pattern_sum(q[pos], w[pos], g[pos])
+            f -= offset[pos]
+
+            done = np.abs(f) * scale[pos] <= tol
+            low[pos] = np.where(f > 0, g[pos], low[pos])
+            high[pos] = np.where(f <= 0, g[pos], high[pos])
+
+            # log(Σw·q^γ) も γ について凸で直線に近いため、対数側でニュートン更新する
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = g[pos] - np.log1p(f / offset[pos]) * (f + offset[pos]) / df
+            outside = ~np.isfinite(step) | (step <= low[pos]) | (step >= high[pos])
+            g[pos] = np.where(done, g[pos], np.where(outside, (low[pos] + high[pos]) / 2, step))
+            pos = pos[~done]
+
+        gamma[idx] = g
+
+    else:
+        raise ValueError(f"未対応の method です: {method}")
+
+    shaped = shape_patterns(values, p_max, gamma)
+    b, v = calculate_monthly_params_batch(target_peak, target_total, shaped, weights)
+    result = (gamma.reshape(batch_shape), b.reshape(batch_shape), v.reshape(batch_shape))
+    if not return_info:
+        return result
+
+    residual = shape_fit_residual(target_peak, target_total, values, weights, gamma)
+    info = {
+        'iterations': iterations.reshape(batch_shape),
+        'residual': residual.reshape(batch_shape),
+        'converged': (residual <= tol * np.abs(target_total)).reshape(batch_shape),
+    }
+    return result + (info,)
+
+# ==========================================
+# 解のキャッシュ（同じ問題の形状最適化を再利用）
+# ==========================================
+
+def _solve_shapes(peaks, totals, values, weights, optimize_shape=True,
+                  shape_method='bisect', shape_tol=1e-6):
+    """月ごとの (gamma, B, V, info) を求める（generate_sites と SolveCache の共通処理）"""
+    if optimize_shape:
+        return optimize_pattern_shape_batch(
+            peaks, totals, values, weights,
+            method=shape_method, tol=shape_tol, return_info=True
+        )
+    values, weights = np.broadcast_arrays(values, weights)
+    gamma = np.ones(np.broadcast_shapes(np.shape(peaks), values.shape[:-1]))
+    b, v = calculate_monthly_params_batch(peaks, totals, values, weights)
+    residual = shape_fit_residual(peaks, totals, values, weights, gamma)
+    info = {
+        'iterations': np.zeros(gamma.shape, dtype=np.int32),
+        'residual': residual,
+        'converged': residual <= shape_tol * np.abs(totals),
+    }
+    return gamma, b, v, info
+
+
+def _row_digests(a):
+    """最後の軸を1行とみなし、行ごとのハッシュ値（bytes）の配列を返す"""
+    rows = np.ascontiguousarray(a, dtype=np.float64).reshape(-1, a.shape[-1])
+    digests = np.empty(len(rows), dtype=object)
+    for i, row in enumerate(rows):
+        digests[i] = hashlib.blake2b(row.tobytes(), digest_size=16).digest()
+    return digests.reshape(a.shape[:-1])
+
+
+class SolveCache:
+    """
+    形状最適化の解の LRU キャッシュ
+
+    キーは (係数ベクトルのハッシュ, 月の平日/休日構成のハッシュ, ピーク・合計, 解法の設定)。
+    同じプリセット・同じ月構成・同じターゲットの拠点は1回だけ解けばよい。
+    ターゲットは丸めずにそのまま比べ、一致した問題だけを再利用するので、
+    キャッシュの有無・問題の並び順・チャンク分割によらず結果はバイト単位で同じ。
+
+        cache = SolveCache(maxsize=65536)
+        generate_sites(..., solve_cache=cache)
+        cache.stats()   # {'hits': ..., 'misses': ..., 'size': ..., 'maxsize': ..., 'hit_rate': ...}
+    """
+    FIELDS = ('gamma', 'b', 'v', 'iterations', 'residual', 'converged')
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def solve(self, peaks, totals, values, weights, **options):
+        """
+        _solve_shapes と同じ (gamma, B, V, info) を返す。未登録の問題だけをまとめて解く。
+
+        peaks / totals : (...) 形状のターゲット
+        values / weights : (..., K)（ブロードキャスト可能）
+        options        : _solve_shapes の optimize_shape / shape_method / shape_tol
+        """
+        peaks = np.asarray(peaks, dtype=float)
+        totals = np.asarray(totals, dtype=float)
+        batch_shape = np.broadcast_shapes(peaks.shape, values.shape[:-1], weights.shape[:-1])
+        k = values.shape[-1]
+        values_flat = np.broadcast_to(values, batch_shape + (k,)).reshape(-1, k)
+        weights_flat = np.broadcast_to(weights, batch_shape + (k,)).reshape(-1, k)
+        peaks_flat = np.broadcast_to(peaks, batch_shape).ravel()
+        totals_flat = np.broadcast_to(totals, batch_shape).ravel()
+        option_key = tuple(sorted(options.items()))
+
+        # バッチ内で同じ問題を1つにまとめる（係数・月構成は行のハッシュを番号にする）
+        coef_digests, coef_id = np.unique(
+            np.broadcast_to(_row_digests(values), batch_shape).ravel(), return_inverse=True)
+        layout_digests, layout_id = np.unique(
+            np.broadcast_to(_row_digests(weights), batch_shape).ravel(), return_inverse=True)
+        valid = ~(np.isnan(peaks_flat) | np.isnan(totals_flat))
+        problems = np.column_stack([coef_id, layout_id, peaks_flat, totals_flat])[valid]
+        problems, first, inverse = np.unique(problems, axis=0, return_index=True, return_inverse=True)
+        first = np.flatnonzero(valid)[first]
+
+        # キャッシュにない問題だけをまとめて解く
+        table = np.empty((len(problems), len(self.FIELDS)))
+        keys = []
+        missing = []
+        for u, (c, l, peak, total) in enumerate(problems.tolist()):
+            key = (coef_digests[int(c)], layout_digests[int(l)], peak, total, option_key)
+            keys.append(key)
+            entry = self._entries.get(key)
+            if entry is None:
+                missing.append(u)
+            else:
+                self._entries.move_to_end(key)
+                table[u] = entry
+        self.misses += len(missing)
+        self.hits += int(valid.sum()) - len(missing)
+
+        idx = first[missing]
+        gamma, b, v, info = _solve_shapes(
+            peaks_flat[idx], totals_flat[idx], values_flat[idx], weights_flat[idx], **options
+        )
+        table[missing] = np.column_stack(
+            [gamma, b, v, info['iterations'], info['residual'], info['converged']])
+        for u, entry in zip(missing, table[missing].tolist()):
+            self._entries[keys[u]] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        # 目標が NaN の月はキャッシュせずにそのまま解く（結果は NaN）
+        result = np.full((len(peaks_flat), len(self.FIELDS)), np.nan)
+        result[valid] = table[inverse.ravel()]
+        invalid = np.flatnonzero(~valid)
+        if len(invalid):
+            gamma, b, v, info = _solve_shapes(
+                peaks_flat[invalid], totals_flat[invalid],
+                values_flat[invalid], weights_flat[invalid], **options
+            )
+            result[invalid] = np.column_stack(
+                [gamma, b, v, info['iterations'], info['residual'], info['converged']])
+
+        gamma, b, v, iterations, residual, converged = result.T.reshape((-1,) + batch_shape)
+        info = {'iterations': iterations.astype(np.int32), 'residual': residual,
+                'converged': converged.astype(bool)}
+        return gamma, b, v, info
+
+# ==========================================
+# 月単位の調整
+# ==========================================
+
+def month_bounds(months):
+    """時系列順の月配列から、各月の (開始位置, 終了位置) 配列を返す"""
+    bounds = np.flatnonzero(np.diff(months)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(months)]))
+    return starts, ends
+
+
+def fit_to_targets(demand, peaks, totals, months, interval_hours=1.0, decimals=None):
+    """
+    全拠点・全月のピークと合計を目標にそろえる（in-place）
+
+    demand : (拠点数, コマ数) のデマンド (kW)
+    peaks / totals : (拠点数, 12) の目標（NaN の月はそのまま）
+    months : コマごとの月 (1〜12、時系列順)。複数年では期間番号 (1〜12 × 年数) と
+             (拠点数, 12 × 年数) の目標を渡す
+    decimals : 指定時は 10^-decimals kW 単位の整数に丸め、月合計を厳密に合わせる
+
+    各月の最大コマを目標ピークにし、合計の差分は他のコマへ按分する
+    （増やすときはピークまでの余裕、減らすときは値に比例）。
+    丸めは切り捨て後、不足分を端数の大きいコマから1単位ずつ配る（最大剰余法）ので、
+    ピーク ≦ 目標のまま月合計が目標と一致する。
+    合計 > コマ数 × ピーク で目標ピークに収まらない月は、ピークを超えて合計を優先する。
+    """
+    starts, _ = month_bounds(months)
+    month_idx = months - 1
+    n_sites = demand.shape[0]
+    scale = 1.0 if decimals is None else 10.0 ** decimals
+
+    with span('adjust'):
+        x = demand.astype(np.float64) * scale
+        peak_u = peaks * scale
+        total_u = totals / interval_hours * scale
+        if decimals is not None:
+            peak_u, total_u = np.round(peak_u), np.round(total_u)
+        n_slots = np.diff(np.append(starts, len(months)))
+
+        # 各月の最大コマ（同値は先頭）を目標ピークにする
+        seg_max = np.maximum.reduceat(x, starts, axis=1)
+        is_max = x == seg_max[:, month_idx]
+        first = np.cumsum(is_max, axis=1)
+        first -= np.concatenate([np.zeros((n_sites, 1), dtype=first.dtype),
+                                 first[:, starts[1:] - 1]], axis=1)[:, month_idx]
+        fixed = is_max & (first == 1)
+
+        feasible = total_u <= peak_u * n_slots
+        top = seg_max if decimals is None else np.ceil(seg_max)
+        cap = np.where(feasible, peak_u, np.fmax(top, peak_u))
+        cap_b = cap[:, month_idx]
+        x = np.clip(x, 0, cap_b)
+        x[fixed] = np.where(feasible[:, month_idx], cap_b, x)[fixed]
+
+        # 合計の差分を按分（上下限 0〜cap を超えない範囲）
+        with np.errstate(divide='ignore', invalid='ignore'):
+            residual = total_u - np.add.reduceat(x, starts, axis=1)
+            headroom = np.where(fixed, 0.0, cap_b - x)
+            down = np.where(fixed, 0.0, x)
+            up_frac = np.clip(residual / np.add.reduceat(headroom, starts, axis=1), 0, 1)
+            down_frac = np.clip(-residual / np.add.reduceat(down, starts, axis=1), 0, 1)
+        x += np.nan_to_num(up_frac)[:, month_idx] * headroom
+        x -= np.nan_to_num(down_frac)[:, month_idx] * down
+
+    if decimals is not None:
+        with span('rounding'):
+            # 最大剰余法: 切り捨て後の不足（超過）単位を端数の大きい（小さい）コマから配る
+            units = np.floor(x + 1e-7)
+            remainder = x - units
+            deficit = np.nan_to_num(total_u - np.add.reduceat(units, starts, axis=1))
+            deficit = np.round(deficit)[:, month_idx]
+            add = deficit > 0
+            eligible = ~fixed & np.where(add, units + 1 <= cap_b, units >= 1)
+            key = np.where(eligible, np.where(add, -remainder, remainder), np.inf)
+
+            # (拠点, 月) ごとに key 順の順位を求める（並べ替え後も区間の先頭位置は同じ）
+            row_offset = np.arange(n_sites)[:, None] * x.shape[1]
+            segment = (np.arange(n_sites)[:, None] * peaks.shape[1] + month_idx).ravel()
+            seg_start = (row_offset + starts[month_idx]).ravel()
+            order = np.lexsort((key.ravel(), segment))
+            rank = np.empty(x.size, dtype=np.intp)
+            rank[order] = np.arange(x.size) - seg_start[order]
+            rank = rank.reshape(x.shape)
+            step = eligible & (rank < np.abs(deficit))
+            units += np.where(step, np.sign(deficit), 0)
+            x = units / scale
+
+    valid = ~np.isnan(peaks)[:, month_idx]
+    demand[valid] = x[valid]
+    return demand
+
+# ==========================================
+# 実現可能性の事前判定（解く前に負荷率の範囲を調べる）
+# ==========================================
+# ピーク P を保ったまま B, V >= 0 で作れる月の負荷率 Total / (N·P) の範囲は
+#   Σw·q^γ / N 〜 1    （q はピークを1に正規化したパターン、N は月の時間数）
+# Σw·q^γ は γ について単調減少なので、下限は形状を変えない場合は γ=1、
+# 形状最適化ありならガンマ値の上限で決まる。解かずに2回の和だけで判定できる。
+
+FEASIBILITY_STATUS = ('OK', '形状調整', '負荷率超過', '負荷率不足', '入力不正')
+FEASIBLE, SHAPED, TOO_HIGH, TOO_LOW, INVALID = range(len(FEASIBILITY_STATUS))
+
+
+def load_factor_bounds(values, weights, gamma_high=GAMMA_BOUNDS[1]):
+    """
+    月ごとの負荷率の下限を (形状そのまま, ガンマ値 gamma_high まで鋭くした場合) で返す
+
+    values / weights は calculate_monthly_params_batch と同じ形式。上限はどちらも 1。
+    """
+    values, weights = np.broadcast_arrays(np.asarray(values, dtype=float), np.asarray(weights, dtype=float))
+    batch_shape = values.shape[:-1]
+    n_hours = weights.sum(axis=-1)
+    p_max = np.where(weights > 0, values, -np.inf).max(axis=-1)
+    q = (values / np.where(p_max > 0, p_max, 1.0)[..., None]).reshape(-1, values.shape[-1])
+    w = weights.reshape(q.shape)
+    base, _ = _pattern_sum(q, w, np.ones(len(q)))
+    sharp, _ = _pattern_sum(q, w, np.full(len(q), float(gamma_high)))
+    return base.reshape(batch_shape) / n_hours, sharp.reshape(batch_shape) / n_hours
+
+
+def classify_load_factor(peaks, totals, n_hours, lf_base, lf_sharp, optimize_shape=True):
+    """
+    目標の負荷率を下限と比べ、(負荷率, 判定) を返す（判定は FEASIBILITY_STATUS の番号）
+
+      OK         : 形状そのままで作れる
+      形状調整   : ガンマ値を上げれば作れる（optimize_shape のときだけ）
+      負荷率超過 : 負荷率 > 1。フラットにして合計を優先し、契約電力を超える
+      負荷率不足 : 下限未満。B=0 にしてもピークに届かない
+      入力不正   : ピークが0以下・値が無いなど
+    """
+    peaks = np.asarray(peaks, dtype=float)
+    totals = np.asarray(totals, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        load_factor = totals / (n_hours * peaks)
+    lower = lf_sharp if optimize_shape else lf_base
+    # 下限ちょうどの目標を丸め誤差で不足と判定しないよう、わずかに余裕を持たせる
+    status = np.where(load_factor > 1 + 1e-9, TOO_HIGH,
+             np.where(load_factor < lower * (1 - 1e-9), TOO_LOW,
+             np.where(load_factor < lf_base, SHAPED, FEASIBLE)))
+    invalid = ~np.isfinite(load_factor) | ~(peaks > 0) | ~(totals >= 0)
+    return load_factor, np.where(invalid, INVALID, status).astype(np.int8)
+
+
+def check_feasibility(year, weekday_coefs, holiday_coefs, peaks, totals,
+                      closures=DEFAULT_CLOSURES, drop_leap_day=False, resolution=60,
+                      optimize_shape=True, gamma_high=GAMMA_BOUNDS[1]):
+    """
+    generate_sites と同じ入力について、解く前に拠点 × 月の負荷率の範囲と判定を求める
+
+    戻り値: (拠点数, 12) 配列の dict
+      load_factor : 目標の負荷率 Total / (N·Peak)
+      lf_min      : 作れる負荷率の下限（optimize_shape に応じて形状そのまま / ガンマ値上限）
+      lf_base     : 形状そのままの下限
+      status      : 判定（FEASIBILITY_STATUS の番号）
+    パターンは重複を除いてから計算するので、拠点数が多くても負荷は小さい。
+    """
+    calendar = build_calendar(year, closures, drop_leap_day, resolution)
+    steps_per_day = calendar['steps_per_day']
+    peaks = np.atleast_2d(np.asarray(peaks, dtype=float))
+    totals = np.atleast_2d(np.asarray(totals, dtype=float))
+    values = np.concatenate([
+        np.broadcast_to(expand_pattern(weekday_coefs, steps_per_day), peaks.shape[:1] + (steps_per_day,)),
+        np.broadcast_to(expand_pattern(holiday_coefs, steps_per_day), peaks.shape[:1] + (steps_per_day,)),
+    ], axis=1)
+    patterns, pattern_idx = np.unique(values, axis=0, return_inverse=True)
+    weights = month_layout(calendar)
+    lf_base, lf_sharp = load_factor_bounds(patterns[:, None, :], weights[None], gamma_high)
+    lf_base, lf_sharp = lf_base[pattern_idx.ravel()], lf_sharp[pattern_idx.ravel()]
+
+    load_factor, status = classify_load_factor(
+        peaks, totals, weights.sum(axis=-1), lf_base, lf_sharp, optimize_shape)
+    return {
+        'load_factor': load_factor,
+        'lf_min': lf_sharp if optimize_shape else lf_base,
+        'lf_base': lf_base,
+        'status': status,
+    }
+
+# ==========================================
+# 年間生成
+# ==========================================
+
+def generate_sites(year, weekday_coefs, holiday_coefs, peaks, totals,
+                   closures=DEFAULT_CLOSURES, drop_leap_day=False, resolution=60,
+                   optimize_shape=False, adjust_targets=False, round_decimals=None,
+                   shape_method='bisect', shape_tol=1e-6, dtype=np.float64,
+                   solve_cache=None, progress=None, return_info=False):
+    """
+    複数拠点の1年分のデマンド (kW) を (拠点数, コマ数) の配列として生成する
+
+    weekday_coefs / holiday_coefs : (拠点数, 24 または 1日のコマ数) の係数（全拠点共通なら1次元）
+    peaks / totals : (拠点数, 12) の月別契約電力・使用電力量（NaN の月は NaN を出力）
+    closures       : 土日・祝日以外の休業日（holiday_calendar.holiday_day_mask を参照）
+    resolution     : 1コマの長さ（分）。60 / 30 / 15
+    optimize_shape : パターンの鋭さ（ガンマ値）を自動調整する
+    adjust_targets : ピーク・合計を目標に合わせる微調整を行う
+    round_decimals : 指定時は丸め、adjust_targets なら丸め後の月合計も厳密に合わせる（fit_to_targets）
+    shape_method / shape_tol : optimize_pattern_shape_batch の method / tol
+    dtype          : 出力配列の型（np.float32 で多拠点・多年のメモリを半減）
+    solve_cache    : SolveCache を渡すと、同じ問題の (gamma, B, V) を再利用する
+    progress       : 月ごとの展開・調整が1か月終わるごとに progress(完了した月数, 月数) を呼ぶ
+                     コールバック。例外を送出すると生成はその場で止まる（ジョブのキャンセルなど）
+    return_info    : True なら (demand, info) を返す。info は (拠点数, 12) 配列の dict で、
+                     gamma, b, v, iterations, residual, converged と
+                     強制調整の内訳 flat（V<0 でフラット化）/ base_zero（B<0 で B=0）を持つ
+    """
+    with span('calendar'):
+        calendar = build_calendar(year, closures, drop_leap_day, resolution)
+    demand, info = _generate_periods(
+        calendar, weekday_coefs, holiday_coefs, peaks, totals, optimize_shape, adjust_targets,
+        round_decimals, shape_method, shape_tol, dtype, solve_cache, progress
+    )
+    if return_info:
+        return demand, info
+    return demand
+
+
+def _generate_periods(calendar, weekday_coefs, holiday_coefs, peaks, totals, optimize_shape=False,
+                      adjust_targets=False, round_decimals=None, shape_method='bisect',
+                      shape_tol=1e-6, dtype=np.float64, solve_cache=None, progress=None):
+    """
+    カレンダーの全期間（1年なら12か月、build_timeline なら 12 × 年数）をまとめて生成する
+
+    peaks / totals は (拠点数, 期間数)。generate_sites / generate_timeline の共通処理。
+    """
+    steps_per_day = calendar['steps_per_day']
+    peaks = np.atleast_2d(np.asarray(peaks, dtype=float))
+    totals = np.atleast_2d(np.asarray(totals, dtype=float))
+    with span('patterns'):
+        values = np.concatenate([
+            np.broadcast_to(expand_pattern(weekday_coefs, steps_per_day), peaks.shape[:1] + (steps_per_day,)),
+            np.broadcast_to(expand_pattern(holiday_coefs, steps_per_day), peaks.shape[:1] + (steps_per_day,)),
+        ], axis=1)[:, None, :]
+        weights = month_layout(calendar)[None, :, :]
+        n_hours = weights.sum(axis=-1)
+
+    with span('shape_optimization'):
+        # 全拠点・全期間のパラメータをまとめて計算
+        solve = _solve_shapes if solve_cache is None else solve_cache.solve
+        gamma, b, v, info = solve(
+            peaks, totals, values, weights, optimize_shape=optimize_shape,
+            shape_method=shape_method, shape_tol=shape_tol
+        )
+        shaped = month_shapes(values, weights, gamma)
+
+    # ケース1: V が負（負荷率が高すぎる）-> フラットにして合計を優先（契約電力超過）
+    flat = v < 0
+    # ケース2: B が負（負荷率が低すぎる）-> B=0 にして V を再計算（ピークには届かない）
+    # ニュートン法は B=0 の根に収束するので、残差が許容誤差内（converged）の負の B は
+    # 調整扱いにしない（二分探索・ニュートン法で同じ意味になる）
+    base_zero = ~flat & (b < 0) & ~info['converged']
+    b = np.where(flat, totals / n_hours, np.where(base_zero, 0.0, b))
+    v = np.where(flat, 0.0, np.where(base_zero, totals / (weights * shaped).sum(axis=-1), v))
+    info.update(gamma=gamma, b=b, v=v, flat=flat, base_zero=base_zero)
+
+    demand = render_demand(calendar, shaped, b, v, peaks, totals,
+                           adjust_targets, round_decimals, dtype, progress)
+    return demand, info
+
+
+def render_demand(calendar, shaped, b, v, peaks, totals, adjust_targets=False,
+                  round_decimals=None, dtype=np.float64, progress=None):
+    """
+    月ごとの形状係数・B・V から (拠点数, コマ数) のデマンドを展開する
+
+    shaped : (拠点数, 12, 2 × 1日のコマ数) の month_shapes の結果
+    b / v  : (拠点数, 12)（フラット化などの補正後）
+    progress : 指定時は月ごとに展開・調整し、1か月終わるごとに progress(完了した月数, 月数) を呼ぶ
+    複数年のカレンダーでは 12 の代わりに期間数（12 × 年数）になる。
+    generate_sites と parametric.decode_profiles の共通処理。
+    """
+    # (拠点, 月, 平日+休日の係数) のテーブルからコマごとの値を取り出す
+    period = calendar['period']
+    month_idx = period - 1
+    key = calendar['holiday'] * calendar['steps_per_day'] + calendar['slot']
+    b, v, shaped = b.astype(dtype), v.astype(dtype), shaped.astype(dtype)
+    demand = np.empty((len(b), len(period)), dtype=dtype)
+
+    # 月どうしは独立なので、月ごとに分けても全期間をまとめても結果は同じ
+    blocks = list(zip(*month_bounds(period))) if progress is not None else [(0, len(period))]
+    for done, (start, end) in enumerate(blocks, 1):
+        idx = month_idx[start:end]
+        block = demand[:, start:end]
+        with span('patterns'):
+            np.multiply(v[:, idx], shaped[:, idx, key[start:end]], out=block)
+            block += b[:, idx]
+            np.maximum(block, 0, out=block)
+
+        if adjust_targets:
+            # 合計の調整は float64 で行ってから出力の型に戻す
+            first = idx[0]
+            fit_to_targets(block, peaks[:, first:idx[-1] + 1], totals[:, first:idx[-1] + 1],
+                           period[start:end] - first, calendar['interval_hours'], round_decimals)
+        elif round_decimals is not None:
+            with span('rounding'):
+                np.round(block, round_decimals, out=block)
+        if progress is not None:
+            progress(done, len(blocks))
+    return demand
+
+
+def generate_year(year, weekday_coef, holiday_coef, monthly_targets, **kwargs):
+    """
+    1年分のデマンド配列（1時間分解能なら 8760/8784 要素の float 配列）を生成する
+
+    monthly_targets: {月: {'peak_kw': ..., 'total_kwh': ...}}
+    その他の引数は generate_sites と同じ。ターゲットが設定されていない月は NaN になる。
+    return_info=True の場合、info の各配列は (12,) になる。
+    """
+    peaks = np.full(12, np.nan)
+    totals = np.full(12, np.nan)
+    for month, target in monthly_targets.items():
+        if target:
+            peaks[int(month) - 1] = target['peak_kw']
+            totals[int(month) - 1] = target['total_kwh']
+    result = generate_sites(year, weekday_coef, holiday_coef, peaks, totals, **kwargs)
+    if kwargs.get('return_info'):
+        demand, info = result
+        return demand[0], {key: value[0] for key, value in info.items()}
+    return result[0]
+
+
+# ==========================================
+# 複数年の通し生成
+# ==========================================
+
+def growth_factors(n_years, rate=0.0):
+    """
+    年ごとの倍率 (n_years,) を返す（初年度 = 1）
+
+    rate : 年率（0.02 で毎年 2% 増）。スカラーなら複利、長さ n_years - 1 の配列なら
+           2年目以降の各年の前年比として順に掛ける。
+    """
+    rate = np.asarray(rate, dtype=float)
+    if rate.ndim == 0:
+        return (1.0 + rate) ** np.arange(n_years)
+    if len(rate) != n_years - 1:
+        raise ValueError(f"前年比は {n_years - 1} 年分を指定してください（{len(rate)} 年分）")
+    return np.concatenate(([1.0], np.cumprod(1.0 + rate)))
+
+
+def generate_timeline(start_year, n_years, weekday_coefs, holiday_coefs, peaks, totals,
+                      peak_growth=0.0, energy_growth=0.0, closures=DEFAULT_CLOSURES,
+                      drop_leap_day=False, resolution=60, return_info=False, **kwargs):
+    """
+    start_year から n_years 年分の連続したデマンドを (拠点数, コマ数) の配列として生成する
+
+    peaks / totals : 初年度の (拠点数, 12) の月別目標（全拠点共通なら (12,)）
+    peak_growth / energy_growth : 契約電力・使用電力量の年率（growth_factors の rate）
+    年ごとの倍率を掛けた (拠点数, 年数, 12) の目標を (拠点数, 12 × 年数) の期間として並べ、
+    全年・全月を1回の計算で解く（年ごとのループは無い）。閏年は drop_leap_day を
+    指定しない限り 2/29 を含み、その年の2月の時間数も29日分になる。
+    その他の引数（optimize_shape, adjust_targets, round_decimals, shape_method, shape_tol,
+    dtype, solve_cache, progress）は generate_sites と同じ（progress は 12 × 年数か月で数える）。
+    return_info=True の場合、info の各配列は (拠点数, 年数, 12) になる。
+    """
+    with span('calendar'):
+        calendar = build_timeline(start_year, n_years, closures, drop_leap_day, resolution)
+    peaks = np.atleast_2d(np.asarray(peaks, dtype=float))
+    totals = np.atleast_2d(np.asarray(totals, dtype=float))
+    peak_factor = growth_factors(n_years, peak_growth)[None, :, None]
+    energy_factor = growth_factors(n_years, energy_growth)[None, :, None]
+    n_sites = max(len(peaks), len(totals))
+    peaks = np.broadcast_to(peaks[:, None, :] * peak_factor, (n_sites, n_years, 12))
+    totals = np.broadcast_to(totals[:, None, :] * energy_factor, (n_sites, n_years, 12))
+
+    demand, info = _generate_periods(
+        calendar, weekday_coefs, holiday_coefs,
+        peaks.reshape(n_sites, -1), totals.reshape(n_sites, -1), **kwargs
+    )
+    if return_info:
+        info = {key: value.reshape(n_sites, n_years, 12) for key, value in info.items()}
+        info.update(peak_kw=peaks, total_kwh=totals)
+        return demand, info
+    return demand
+
+
+def _period_subset(calendar, periods):
+    """
+    カレンダーから periods（期間番号のリスト、昇順）の日・コマだけを取り出したカレンダーを返す
+
+    期間番号は 1 〜 len(periods) に振り直す。_generate_periods が使うキーだけを持つ。
+    """
+    periods = np.asarray(periods)
+    day_mask = np.isin(calendar['day_period'], periods)
+    slot_mask = np.repeat(day_mask, calendar['steps_per_day'])
+    day_period = np.searchsorted(periods, calendar['day_period'][day_mask]) + 1
+    return {
+        'steps_per_day': calendar['steps_per_day'],
+        'interval_hours': calendar['interval_hours'],
+        'day_holiday': calendar['day_holiday'][day_mask],
+        'day_period': day_period,
+        'period': np.repeat(day_period, calendar['steps_per_day']),
+        'holiday': calendar['holiday'][slot_mask],
+        'slot': calendar['slot'][slot_mask],
+    }
+
+
+class MonthResultCache:
+    """
+    1拠点・1年分の生成結果を月ごとに保持し、目標が変わった月だけ再計算する
+
+    月の結果を左右するのは、その月の目標と、全月に共通の入力（カレンダー・生成設定・
+    平日 / 休日の係数）。どの月にも平日と休日が含まれ、形状最適化は係数ベクトル全体を
+    使うので、係数を1つでも変えると全月が再計算になる。月ごとに差が出るのは目標だけで、
+    月別の目標を1か月分だけ変えた場合はその月だけを解き直す。
+    再計算する月はカレンダーからその月の日だけを取り出して解く。月どうしは独立に
+    解かれるので、結果は generate_year で全月を計算した場合と同じ。
+
+        cache = MonthResultCache()
+        demand, info = cache.generate(year, weekday_coef, holiday_coef, targets, **kwargs)
+        cache.last_recomputed   # 直前の呼び出しで再計算した月のリスト
+    """
+
+    def __init__(self):
+        self._common_key = None
+        self._months = {}
+        self.last_recomputed = []
+
+    def clear(self):
+        self._common_key = None
+        self._months.clear()
+        self.last_recomputed = []
+
+    def generate(self, year, weekday_coef, holiday_coef, monthly_targets,
+                 closures=DEFAULT_CLOSURES, drop_leap_day=False, resolution=60, **kwargs):
+        """
+        generate_year(..., return_info=True) と同じ (demand, info) を返す
+
+        kwargs は generate_sites の生成設定（optimize_shape, adjust_targets, round_decimals,
+        shape_method, shape_tol, dtype, solve_cache, progress）。progress は再計算する月の数で数える。
+        """
+        kwargs.pop('return_info', None)
+        calendar = build_calendar(year, closures, drop_leap_day, resolution)
+        steps_per_day = calendar['steps_per_day']
+        weekday_coef = expand_pattern(np.asarray(weekday_coef, dtype=float), steps_per_day)
+        holiday_coef = expand_pattern(np.asarray(holiday_coef, dtype=float), steps_per_day)
+        peaks = np.full(12, np.nan)
+        totals = np.full(12, np.nan)
+        for month, target in monthly_targets.items():
+            if target:
+                peaks[int(month) - 1] = target['peak_kw']
+                totals[int(month) - 1] = target['total_kwh']
+
+        options = tuple(sorted((k, v) for k, v in kwargs.items() if k not in ('solve_cache', 'progress')))
+        common_key = (
+            calendar['year'], tuple(closures), bool(drop_leap_day), resolution, options,
+            hashlib.blake2b(weekday_coef.tobytes(), digest_size=16).digest(),
+            hashlib.blake2b(holiday_coef.tobytes(), digest_size=16).digest(),
+        )
+        if common_key != self._common_key:
+            self._months.clear()
+            self._common_key = common_key
+        targets = {m: (peaks[m - 1].tobytes(), totals[m - 1].tobytes()) for m in range(1, 13)}
+        stale = [m for m in range(1, 13) if m not in self._months or self._months[m][0] != targets[m]]
+
+        if stale:
+            # 変わった月の日だけのカレンダーで解く
+            subset = _period_subset(calendar, stale)
+            idx = np.asarray(stale) - 1
+            demand, info = _generate_periods(
+                subset, weekday_coef, holiday_coef, peaks[None, idx], totals[None, idx], **kwargs
+            )
+            starts, ends = month_bounds(subset['period'])
+            for i, m in enumerate(stale):
+                self._months[m] = (targets[m], demand[0, starts[i]:ends[i]].copy(),
+                                   {k: v[0, i] for k, v in info.items()})
+        self.last_recomputed = stale
+
+        demand = np.concatenate([self._months[m][1] for m in range(1, 13)])
+        info = {k: np.array([self._months[m][2][k] for m in range(1, 13)])
+                for k in self._months[1][2]}
+        return demand, info
@@ -0,0 +1,244 @@
+"""
+列指向・バイナリ形式の出力
+
+CSV の文字列解析を避けたい下流処理向けに、次の形式で書き出す。
+  Parquet : 縦持ち（拠点・日時・デマンド）。文字列列は辞書エンコード（category）
+  .npy    : (拠点数, コマ数) の float32 行列。np.load(path, mmap_mode='r') で
+            解析なしにメモリマップできる。拠点 ID は <name>_sites.npy に保存する。
+あわせて、画面からダウンロードする日 × 時刻の横持ち表（CSV / 月別シートの Excel）も作る。
+
+Parquet には pyarrow、Excel には openpyxl が必要。
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from demand_engine import slot_labels
+from profiling import span
+
+EXPORT_FORMATS = ('csv', 'parquet', 'npy')
+
+# ==========================================
+# 縦持ちデータ
+# ==========================================
+
+def long_frame(calendar, demand, site_id=None):
+    """
+    1拠点分のデマンドを Parquet 向けの縦持ち DataFrame にする
+
+    Date / Time / Weekday_Type は category、Demand_kW は float32。
+    site_id を指定すると先頭に category 列として加える。
+    """
+    n_days = len(calendar['days'])
+    steps_per_day = calendar['steps_per_day']
+    frame = pd.DataFrame({
+        'datetime': calendar['index'],
+        'Date': pd.Categorical.from_codes(
+            np.repeat(np.arange(n_days), steps_per_day),
+            categories=calendar['days'].strftime('%Y-%m-%d')),
+        'Time': pd.Categorical.from_codes(
+            np.tile(np.arange(steps_per_day), n_days), categories=slot_labels(steps_per_day)),
+        'Weekday_Type': pd.Categorical.from_codes(
+            calendar['holiday'].astype(np.int8), categories=['平日', '休日']),
+        'Demand_kW': np.asarray(demand, dtype=np.float32),
+    })
+    if site_id is not None:
+        frame.insert(0, 'site_id', pd.Categorical([site_id] * len(frame)))
+    return frame
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise ImportError("Parquet 出力には pyarrow が必要です: pip install pyarrow") from exc
+    return pyarrow
+
+
+def parquet_bytes(frame):
+    """DataFrame を Parquet のバイト列にする（ダウンロード用）"""
+    pa = _require_pyarrow()
+    sink = pa.BufferOutputStream()
+    pa.parquet.write_table(pa.Table.from_pandas(frame, preserve_index=False), sink,
+                           compression='zstd')
+    return sink.getvalue().to_pybytes()
+
+
+def write_parquet(frame, path):
+    """DataFrame を Parquet ファイルに書き出す"""
+    pa = _require_pyarrow()
+    with span('parquet_export'):
+        pa.parquet.write_table(pa.Table.from_pandas(frame, preserve_index=False), path,
+                               compression='zstd')
+
+
+def write_portfolio_parquet(blocks, output_file):
+    """
+    (calendar, site_id 配列, デマンド配列, info) のブロックを縦持ち Parquet に追記していく
+
+    列: site_id (dictionary), datetime, Demand_kW (float32)。ブロックごとに行グループを書く。
+    """
+    pa = _require_pyarrow()
+    schema = pa.schema([
+        ('site_id', pa.dictionary(pa.int32(), pa.string())),
+        ('datetime', pa.timestamp('ns')),
+        ('Demand_kW', pa.float32()),
+    ])
+
+    n_sites = 0
+    with pa.parquet.ParquetWriter(output_file, schema, compression='zstd') as writer:
+        for calendar, site_ids, demand, _ in blocks:
+            with span('parquet_export'):
+                timestamps = pa.array(calendar['index'].to_numpy(), type=pa.timestamp('ns'))
+                site_ids = np.asarray(site_ids).astype(str)
+                codes = np.repeat(np.arange(len(site_ids), dtype=np.int32), len(timestamps))
+                table = pa.table({
+                    'site_id': pa.DictionaryArray.from_arrays(codes, pa.array(site_ids)),
+                    'datetime': pa.chunked_array([timestamps] * len(site_ids)),
+                    'Demand_kW': pa.array(np.asarray(demand, dtype=np.float32).ravel()),
+                }, schema=schema)
+                writer.write_table(table)
+            n_sites += len(site_ids)
+    return n_sites
+
+# ==========================================
+# メモリマップ可能な行列
+# ==========================================
+
+def sites_path(path):
+    """行列 path に対応する拠点 ID ファイルのパス"""
+    return str(path)[:-4] + '_sites.npy' if str(path).endswith('.npy') else f"{path}_sites.npy"
+
+
+def write_npy(path, demand, site_ids=None):
+    """(拠点数, コマ数) の行列を float32 の .npy に書き出す（1拠点なら (1, コマ数)）"""
+    with span('npy_export'):
+        np.save(path, np.atleast_2d(np.asarray(demand, dtype=np.float32)))
+        if site_ids is not None:
+            np.save(sites_path(path), np.asarray(site_ids).astype(str))
+
+
+def write_portfolio_npy(blocks, output_file, n_sites, n_slots):
+    """
+    1年分のブロック (calendar, site_id 配列, デマンド配列, info) を
+    (n_sites, n_slots) float32 の .npy に順に書き込む
+
+    ファイルをメモリマップで開いて書くので、全拠点分の配列を保持しない。
+    """
+    matrix = np.lib.format.open_memmap(output_file, mode='w+', dtype=np.float32,
+                                       shape=(n_sites, n_slots))
+    all_ids = []
+    row = 0
+    for _, site_ids, demand, _ in blocks:
+        with span('npy_export'):
+            matrix[row:row + len(site_ids)] = demand
+        all_ids.append(np.asarray(site_ids).astype(str))
+        row += len(site_ids)
+    matrix.flush()
+    del matrix
+    np.save(sites_path(output_file), np.concatenate(all_ids) if all_ids else np.array([], dtype=str))
+    return row
+
+
+def load_npy(path):
+    """.npy 行列を読み取り専用のメモリマップで開き、(行列, 拠点 ID) を返す"""
+    matrix = np.load(path, mmap_mode='r')
+    try:
+        site_ids = np.load(sites_path(path))
+    except FileNotFoundError:
+        site_ids = None
+    return matrix, site_ids
+
+# ==========================================
+# 横持ち（日 × 時刻）
+# ==========================================
+
+def wide_frame(calendar, demand, month=None):
+    """
+    1拠点分のデマンドを日 × 時刻（コマ）の表にする
+
+    DataFrame.pivot は使わず、(日数, 1日のコマ数) に reshape するだけで作る。
+    行ラベルは "月/日"、列は slot_labels。month を指定するとその月の行だけを返す。
+    """
+    days = calendar['days']
+    steps_per_day = calendar['steps_per_day']
+    values = np.asarray(demand).reshape(len(days), steps_per_day)
+    labels = days.month.astype(str) + '/' + days.day.astype(str)
+    if month is not None:
+        keep = calendar['day_month'] == month
+        values, labels = values[keep], labels[keep]
+    return pd.DataFrame(values, index=pd.Index(labels, name='Date'),
+                        columns=slot_labels(steps_per_day))
+
+
+def _decimal_strings(values, decimals=2):
+    """
+    小数 decimals 桁に丸め済みの非負の値を、to_csv と同じ表記（'12.35', '12.0', NaN は空）の
+    文字列配列にする。整数と小数部の表を組み合わせるだけなので to_csv より速い。
+    丸められていない値・負の値・大きすぎる値を含むときは None を返す。
+    """
+    finite = values[np.isfinite(values)]
+    scale = 10 ** decimals
+    if (finite < 0).any() or (finite >= 1e12).any() or not np.array_equal(np.rint(finite * scale) / scale, finite):
+        return None
+    fractions = np.array(['.0'] + [f".{i:0{decimals}d}".rstrip('0') for i in range(1, scale)])
+    units = np.rint(np.nan_to_num(values) * scale).astype(np.int64)
+    whole = units // scale
+    max_whole = int(whole.max(initial=0))
+    if max_whole < 20_000:
+        # 整数部も表引き（int → str の変換より速い）
+        whole = np.array([str(i) for i in range(max_whole + 1)])[whole]
+    else:
+        whole = whole.astype(str)
+    strings = np.char.add(whole, fractions[units % scale])
+    return np.where(np.isnan(values), '', strings)
+
+
+def iter_wide_csv(calendar, demand, encoding='utf-8'):
+    """
+    横持ち表を月ごとに CSV にし、バイト列を順に返す（ヘッダーは最初の月だけ）
+
+    出力は wide_frame(...).to_csv() と同じ。
+    """
+    frame = wide_frame(calendar, demand)
+    with span('csv_export'):
+        strings = _decimal_strings(frame.to_numpy())
+    if strings is None:
+        for month in range(1, 13):
+            with span('csv_export'):
+                chunk = wide_frame(calendar, demand, month).to_csv(header=(month == 1))
+            yield chunk.encode(encoding)
+        return
+
+    labels = frame.index.to_numpy()
+    header = ','.join(['Date'] + list(frame.columns)) + os.linesep
+    for month in range(1, 13):
+        with span('csv_export'):
+            rows = np.flatnonzero(calendar['day_month'] == month)
+            lines = [f"{label},{','.join(row)}"
+                     for label, row in zip(labels[rows].tolist(), strings[rows].tolist())]
+            chunk = (header if month == 1 else '') + os.linesep.join(lines) + os.linesep
+        yield chunk.encode(encoding)
+
+
+def wide_csv_bytes(calendar, demand, encoding='utf-8'):
+    """iter_wide_csv をまとめた CSV のバイト列"""
+    return b''.join(iter_wide_csv(calendar, demand, encoding))
+
+
+def wide_xlsx_bytes(calendar, demand):
+    """月ごとのシート（"1月"〜"12月"）に分けた Excel (.xlsx) のバイト列"""
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError as exc:
+        raise ImportError("Excel 出力には openpyxl が必要です: pip install openpyxl") from exc
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for month in range(1, 13):
+            with span('xlsx_export'):
+                wide_frame(calendar, demand, month).to_excel(writer, sheet_name=f"{month}月")
+    return buffer.getvalue()
@@ -1,7 +1,16 @@
+import argparse
+import os
+
 import pandas as pd
 import numpy as np
-import datetime
-import calendar
+
+from demand_engine import (
+    RESOLUTIONS, TOO_HIGH, TOO_LOW, build_calendar, build_timeline, check_feasibility,
+    generate_timeline, generate_year, growth_factors, slot_labels,
+)
+from exporters import EXPORT_FORMATS, long_frame, write_npy, write_parquet
+from profiling import profile, span, write_report
+from scenarios import NOISE_METHODS, generate_scenarios, scenario_summary
 
 # ==========================================
 # 1. 入力データ定義 (ユーザー設定エリア)
@@ -41,155 +50,189 @@ PATTERN_WEEKDAY = [
 # ※ここでは単純に全体を少し下げつつ、形は維持する設定にします
 PATTERN_HOLIDAY = [p * 0.8 for p in PATTERN_WEEKDAY]
 
-# 2024年の祝日リスト (日本の祝日 + 振替休日)
-HOLIDAYS_2024 = [
-    "2024-01-01", "2024-01-08", "2024-02-11", "2024-02-12", "2024-02-23",
-    "2024-03-20", "2024-04-29", "2024-05-03", "2024-05-04", "2024-05-05", "2024-05-06",
-    "2024-07-15", "2024-08-11", "2024-08-12", "2024-09-16", "2024-09-22", "2024-09-23",
-    "2024-10-14", "2024-11-03", "2024-11-04", "2024-11-23", 
-    # 必要に応じて年末年始などを追加
-    "2024-12-30", "2024-12-31", "2024-01-02", "2024-01-03" 
-]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="月別ターゲットからデマンドデータを生成します")
+    parser.add_argument('--year', type=int, default=2024, help="開始年")
+    parser.add_argument('--years', type=int, default=1,
+                        help="開始年から続けて生成する年数（2以上で複数年の連続データ）")
+    parser.add_argument('--peak-growth', type=float, default=0.0,
+                        help="契約電力の年率 (%%)。2年目以降の月別目標に複利で掛ける")
+    parser.add_argument('--energy-growth', type=float, default=0.0,
+                        help="使用電力量の年率 (%%)。2年目以降の月別目標に複利で掛ける")
+    parser.add_argument('--resolution', type=int, choices=RESOLUTIONS, default=60,
+                        help="1コマの長さ（分）。30 でデマンド時限（30分）単位")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv',
+                        help="出力形式 (parquet: 縦持ち・辞書エンコード, npy: float32 行列)")
+    parser.add_argument('--scenarios', type=int, default=0,
+                        help="揺らぎを加えた実現値の本数（1以上で demand_scenarios_*.npy も出力）")
+    parser.add_argument('--noise', choices=NOISE_METHODS, default='ar1',
+                        help="揺らぎの種類 (ar1: コマ単位の AR(1), day: 日単位)")
+    parser.add_argument('--sigma', type=float, default=0.1, help="揺らぎの大きさ（対数の標準偏差）")
+    parser.add_argument('--phi', type=float, default=0.9, help="AR(1) の自己相関 (0〜1)")
+    parser.add_argument('--seed', type=int, help="乱数の種（同じ値なら同じ実現値）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="実現値を作る並列プロセス数")
+    parser.add_argument('--profile', help="工程別の処理時間を出力する JSON")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        with profile() as profiler:
+            run(args)
+        write_report(profiler, args.profile)
+        print(f"処理時間レポートを出力しました: {args.profile}")
+    else:
+        run(args)
+
+
+def run(args):
+    if args.years > 1:
+        run_timeline(args)
+        return
+    year = args.year
 
-def is_holiday(date_obj):
-    """日付が休日（土日または祝日）か判定する"""
-    # 土曜日(5) または 日曜日(6)
-    if date_obj.weekday() >= 5:
-        return True
-    # 祝日リストに含まれるか
-    date_str = date_obj.strftime("%Y-%m-%d")
-    if date_str in HOLIDAYS_2024:
-        return True
-    return False
-
-def calculate_monthly_params(target_peak, target_total, patterns_in_month):
-    """
-    その月のPeakとTotalを満たす Base_Load(B) と Variable_Width(V) を計算する
-    式: Demand(t) = B + V * Pattern(t)
-    
-    条件1: Max(Demand) = B + V * Max(Pattern) = Target_Peak
-    条件2: Sum(Demand) = N * B + V * Sum(Pattern) = Target_Total
-    
-    (1)より B = Target_Peak - V * Max(Pattern)
-    (2)に代入して V を解く
-    """
-    n_hours = len(patterns_in_month)
-    sum_p = sum(patterns_in_month)
-    max_p = max(patterns_in_month)
-    
-    # 分母: Sum(P) - N * Max(P)
-    denominator = sum_p - (n_hours * max_p)
-    
-    if denominator == 0:
-        # パターンがフラット(全て同じ値)の場合の例外処理
-        # B + V * k = Peak => B = Peak - V*k
-        # N(Peak - V*k) + V*N*k = Total => N*Peak = Total となりVが定まらない
-        # ここでは単純にフラットな負荷として返す
-        return target_total / n_hours, 0.0
-
-    # 分子: Target_Total - N * Target_Peak
-    numerator = target_total - (n_hours * target_peak)
-    
-    v = numerator / denominator
-    b = target_peak - (v * max_p)
-    
-    return b, v
-
-def main():
-    year = 2024
-    records = []
-    
-    # 1年間のループ
-    start_date = datetime.datetime(year, 1, 1, 0, 0)
-    end_date = datetime.datetime(year, 12, 31, 23, 0)
-    
-    # 月ごとの処理を行うため、まずは全時間のリストを作成し、月ごとに分割処理する
-    all_hours = pd.date_range(start=start_date, end=end_date, freq='H')
-    
-    # 月ごとにグルーピング
-    df_temp = pd.DataFrame({'timestamp': all_hours})
-    df_temp['month'] = df_temp['timestamp'].dt.month
-    
     print(f"{year}年のデマンドデータ生成を開始します...")
-    
-    final_data = []
 
-    for month, group in df_temp.groupby('month'):
+    calendar = build_calendar(year, resolution=args.resolution)
+
+    # 解く前に、目標の負荷率がパターンで作れる範囲にあるかを全月まとめて判定する
+    peaks = np.array([MONTHLY_TARGETS.get(m, {}).get('peak_kw', np.nan) for m in range(1, 13)])
+    totals = np.array([MONTHLY_TARGETS.get(m, {}).get('total_kwh', np.nan) for m in range(1, 13)])
+    feasibility = check_feasibility(year, PATTERN_WEEKDAY, PATTERN_HOLIDAY, peaks, totals,
+                                    resolution=args.resolution, optimize_shape=False)
+    status = feasibility['status'][0]
+    load_factor, lf_min = feasibility['load_factor'][0], feasibility['lf_min'][0]
+
+    demand = generate_year(
+        year, PATTERN_WEEKDAY, PATTERN_HOLIDAY, MONTHLY_TARGETS, resolution=args.resolution
+    )
+    with span('rounding'):
+        demand = np.round(demand, 2)
+    valid = ~np.isnan(demand)
+
+    # 検証用ログ（合計 kWh = Σ kW × 1コマの時間数）
+    interval_hours = calendar['interval_hours']
+    month_peak = np.zeros(13)
+    month_total = np.bincount(calendar['month'][valid], weights=demand[valid], minlength=13) * interval_hours
+    np.maximum.at(month_peak, calendar['month'][valid], demand[valid])
+
+    for month in range(1, 13):
         target = MONTHLY_TARGETS.get(month)
         if not target:
             print(f"Warning: {month}月の設定が見つかりません。スキップします。")
             continue
-            
-        target_peak = target['peak_kw']
-        target_total = target['total_kwh']
-        
-        # この月の時間ごとのパターン配列を作成
-        monthly_patterns = []
-        month_timestamps = group['timestamp'].tolist()
-        
-        for ts in month_timestamps:
-            hour = ts.hour
-            if is_holiday(ts):
-                monthly_patterns.append(PATTERN_HOLIDAY[hour])
-            else:
-                monthly_patterns.append(PATTERN_WEEKDAY[hour])
-        
-        # パラメータ計算
-        b, v = calculate_monthly_params(target_peak, target_total, monthly_patterns)
-        
-        # 調整ロジック
-        # ケース1: 計算上の変動幅 V が負になる場合（Target_Totalが大きすぎて、Peak制約を守ると達成できない）
-        # -> ベースを上げて対応（Peak超過を許容）
-        if v < 0:
+        # V が負になる（Peak制約を守ると Total を達成できない）月はフラットに調整される
+        if status[month - 1] == TOO_HIGH:
             print(f"[{month}月] 負荷率が高すぎます。ベース電力を上げて調整します。(契約電力超過)")
-            v = 0 # パターン変動なし（フラット）にするのが最も効率が良い
-            b = target_total / len(monthly_patterns)
-        
-        # ケース2: 計算上のベース B が負になる場合（Target_Totalが小さすぎる）
-        # -> B=0 にして V を再計算（Target_Peakには届かない）
-        elif b < 0:
-            # print(f"[{month}月] 負荷率が低すぎます。ベース電力を0とし、ピークを下げて調整します。")
-            b = 0
-            # Sum(0 + V * P) = Total => V * Sum(P) = Total => V = Total / Sum(P)
-            v = target_total / sum(monthly_patterns)
-            
-        # 確定した b, v でデマンド値を計算
-        for i, ts in enumerate(month_timestamps):
-            p = monthly_patterns[i]
-            demand = b + (v * p)
-            
-            # 念のため負の値は0にする
-            if demand < 0: demand = 0
-            
-            weekday_type = "休日" if is_holiday(ts) else "平日"
-            
-            final_data.append({
-                'Date': ts.strftime('%Y-%m-%d'),
-                'Time': ts.strftime('%H:00'),
-                'Weekday_Type': weekday_type,
-                'Demand_kW': round(demand, 2)
-            })
-            
-        # 検証用ログ
-        calc_total = sum([d['Demand_kW'] for d in final_data[-len(month_timestamps):]])
-        calc_peak = max([d['Demand_kW'] for d in final_data[-len(month_timestamps):]])
-        print(f"{month}月作成完了: Target(Peak={target_peak}, Total={target_total}) -> Result(Peak={calc_peak:.2f}, Total={calc_total:.0f})")
-
-    # DataFrame作成と出力
-    df_result = pd.DataFrame(final_data)
-    output_file = f"demand_simulation_{year}.csv"
-    df_result.to_csv(output_file, index=False, encoding='utf-8-sig')
+        # B が負になる（パターンの下限より負荷率が低い）月はベース0で作り、ピークに届かない
+        elif status[month - 1] == TOO_LOW:
+            print(f"[{month}月] 負荷率が低すぎます（{load_factor[month - 1]:.1%} < 下限 {lf_min[month - 1]:.1%}）。"
+                  f"ベース電力を0にして調整します。(ピーク未達)")
+        print(f"{month}月作成完了: Target(Peak={target['peak_kw']}, Total={target['total_kwh']}) -> Result(Peak={month_peak[month]:.2f}, Total={month_total[month]:.0f})")
+
+    suffix = "" if args.resolution == 60 else f"_{args.resolution}min"
+    output_file = f"demand_simulation_{year}{suffix}.{args.format}"
+    write_output(calendar, demand, output_file, args.format)
+    if args.scenarios > 0:
+        write_scenarios(args, calendar, demand, f"demand_scenarios_{year}{suffix}.npy")
+
+
+def run_timeline(args):
+    """開始年から args.years 年分を、年率を掛けた目標で1回の計算として生成する"""
+    start, n_years = args.year, args.years
+    end = start + n_years - 1
+    print(f"{start}〜{end}年（{n_years}年分）のデマンドデータ生成を開始します...")
+
+    peaks = np.array([MONTHLY_TARGETS.get(m, {}).get('peak_kw', np.nan) for m in range(1, 13)])
+    totals = np.array([MONTHLY_TARGETS.get(m, {}).get('total_kwh', np.nan) for m in range(1, 13)])
+    peak_growth, energy_growth = args.peak_growth / 100, args.energy_growth / 100
+
+    # 年ごとの目標について、解く前に負荷率の範囲を判定する
+    peak_factor = growth_factors(n_years, peak_growth)
+    energy_factor = growth_factors(n_years, energy_growth)
+    for k, year in enumerate(range(start, end + 1)):
+        feasibility = check_feasibility(year, PATTERN_WEEKDAY, PATTERN_HOLIDAY,
+                                        peaks * peak_factor[k], totals * energy_factor[k],
+                                        resolution=args.resolution, optimize_shape=False)
+        status = feasibility['status'][0]
+        for month in np.flatnonzero(status == TOO_HIGH) + 1:
+            print(f"[{year}年{month}月] 負荷率が高すぎます。ベース電力を上げて調整します。(契約電力超過)")
+        for month in np.flatnonzero(status == TOO_LOW) + 1:
+            print(f"[{year}年{month}月] 負荷率が低すぎます（{feasibility['load_factor'][0, month - 1]:.1%} < "
+                  f"下限 {feasibility['lf_min'][0, month - 1]:.1%}）。ベース電力を0にして調整します。(ピーク未達)")
+
+    calendar = build_timeline(start, n_years, resolution=args.resolution)
+    demand = generate_timeline(
+        start, n_years, PATTERN_WEEKDAY, PATTERN_HOLIDAY, peaks, totals,
+        peak_growth=peak_growth, energy_growth=energy_growth, resolution=args.resolution
+    )[0]
+    with span('rounding'):
+        demand = np.round(demand, 2)
+    valid = ~np.isnan(demand)
+
+    # 年ごとの検証用ログ
+    year_idx = np.repeat(calendar['day_year'] - start, calendar['steps_per_day'])
+    year_total = np.bincount(year_idx[valid], weights=demand[valid], minlength=n_years) * calendar['interval_hours']
+    year_peak = np.zeros(n_years)
+    np.maximum.at(year_peak, year_idx[valid], demand[valid])
+    for k, year in enumerate(range(start, end + 1)):
+        print(f"{year}年作成完了: Target(倍率 Peak={peak_factor[k]:.3f}, Total={energy_factor[k]:.3f}) "
+              f"-> Result(Peak={year_peak[k]:.2f}, Total={year_total[k]:.0f})")
+
+    suffix = "" if args.resolution == 60 else f"_{args.resolution}min"
+    output_file = f"demand_simulation_{start}-{end}{suffix}.{args.format}"
+    write_output(calendar, demand, output_file, args.format)
+    if args.scenarios > 0:
+        write_scenarios(args, calendar, demand, f"demand_scenarios_{start}-{end}{suffix}.npy")
+
+
+def write_output(calendar, demand, output_file, file_format):
+    """デマンドを指定の形式で書き出す（CSV は Date, Time, Weekday_Type, Demand_kW の縦持ち）"""
+    valid = ~np.isnan(demand)
+    if file_format == 'parquet':
+        write_parquet(long_frame(calendar, demand), output_file)
+        print(f"\n完了しました。ファイルを出力しました: {output_file}")
+        return
+    if file_format == 'npy':
+        write_npy(output_file, demand)
+        print(f"\n完了しました。ファイルを出力しました: {output_file}")
+        return
+
+    # DataFrame作成と出力（文字列列は日単位で作成してから展開する）
+    n_days = len(calendar['days'])
+    steps_per_day = calendar['steps_per_day']
+    dates = np.repeat(calendar['days'].strftime('%Y-%m-%d').to_numpy(), steps_per_day)
+    times = np.tile(slot_labels(steps_per_day), n_days)
+    weekday_type = np.where(calendar['holiday'], "休日", "平日")
+
+    with span('pivot'):
+        df_result = pd.DataFrame({
+            'Date': dates[valid],
+            'Time': times[valid],
+            'Weekday_Type': weekday_type[valid],
+            'Demand_kW': demand[valid]
+        })
+    with span('csv_export'):
+        df_result.to_csv(output_file, index=False, encoding='utf-8-sig')
     print(f"\n完了しました。ファイルを出力しました: {output_file}")
 
-if __name__ == "__main__":
-    main()
-
-
-
-
-
-
 
+def write_scenarios(args, calendar, demand, output_file):
+    """
+    demand に揺らぎを加えた args.scenarios 本の実現値を (本数, コマ数) の .npy に書き出す
 
+    各実現値は月別のピーク・合計を、同時に出力する決定的なデマンド demand の値に合わせ直す。
+    """
+    print(f"\n{args.scenarios}本のシナリオを生成します...（{args.noise}, sigma={args.sigma}, workers={args.workers}）")
+    scenarios = generate_scenarios(
+        calendar, demand, args.scenarios, method=args.noise, sigma=args.sigma,
+        phi=args.phi, seed=args.seed, round_decimals=2, workers=args.workers
+    )[0]
+    low, median, high = scenario_summary(scenarios)
+    print(f"コマごとの 5〜95% 幅: 平均 {np.nanmean(high - low):.2f} kW"
+          f"（中央値に対して {np.nanmean(high - low) / np.nanmean(median):.1%}）")
+    write_npy(output_file, scenarios)
+    print(f"シナリオを出力しました: {output_file}")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+日本の祝日カレンダー
+
+任意の年の祝日を規則から計算する（固定日・ハッピーマンデー・春分/秋分の計算式・
+振替休日・国民の休日）。店舗独自の休業日（年末年始など）も加えて、
+年ごとの日単位/時間単位の休日マスクをキャッシュ付きで提供する。
+"""
+import datetime
+import functools
+
+import numpy as np
+
+# 店舗の休業日（毎年 "MM-DD"、または特定日 "YYYY-MM-DD"）
+# 既定は年末年始（12/30〜1/3、元日は祝日）
+DEFAULT_CLOSURES = ("01-02", "01-03", "12-30", "12-31")
+
+# 計算式で扱える年の範囲（春分・秋分の近似式の有効範囲）
+MIN_YEAR = 1949
+MAX_YEAR = 2150
+
+# 特別措置法などによる単年の祝日・移動
+SPECIAL_HOLIDAYS = {
+    datetime.date(1959, 4, 10): "皇太子明仁親王の結婚の儀",
+    datetime.date(1989, 2, 24): "昭和天皇の大喪の礼",
+    datetime.date(1990, 11, 12): "即位礼正殿の儀",
+    datetime.date(1993, 6, 9): "皇太子徳仁親王の結婚の儀",
+    datetime.date(2019, 5, 1): "天皇の即位の日",
+    datetime.date(2019, 10, 22): "即位礼正殿の儀",
+}
+
+# 東京オリンピック・パラリンピックに伴う移動（年: {祝日名: 日付}）
+OLYMPIC_MOVES = {
+    2020: {"海の日": (7, 23), "スポーツの日": (7, 24), "山の日": (8, 10)},
+    2021: {"海の日": (7, 22), "スポーツの日": (7, 23), "山の日": (8, 8)},
+}
+
+# ==========================================
+# 祝日の規則
+# ==========================================
+
+def _nth_monday(year, month, n):
+    """その月の第n月曜日"""
+    first = datetime.date(year, month, 1)
+    offset = (7 - first.weekday()) % 7
+    return first + datetime.timedelta(days=offset + 7 * (n - 1))
+
+
+def vernal_equinox_day(year):
+    """春分日（日）"""
+    if year <= 1979:
+        return int(20.8357 + 0.242194 * (year - 1980) - int((year - 1983) / 4))
+    if year <= 2099:
+        return int(20.8431 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+    return int(21.8510 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+
+
+def autumnal_equinox_day(year):
+    """秋分日（日）"""
+    if year <= 1979:
+        return int(23.2588 + 0.242194 * (year - 1980) - int((year - 1983) / 4))
+    if year <= 2099:
+        return int(23.2488 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+    return int(24.2488 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+
+
+def _statutory_holidays(year):
+    """国民の祝日に関する法律で定める祝日（振替休日・国民の休日を除く）"""
+    d = datetime.date
+    holidays = {
+        d(year, 1, 1): "元日",
+        d(year, 3, vernal_equinox_day(year)): "春分の日",
+        d(year, 5, 3): "憲法記念日",
+        d(year, 5, 5): "こどもの日",
+        d(year, 9, autumnal_equinox_day(year)): "秋分の日",
+        d(year, 11, 3): "文化の日",
+        d(year, 11, 23): "勤労感謝の日",
+    }
+
+    holidays[_nth_monday(year, 1, 2) if year >= 2000 else d(year, 1, 15)] = "成人の日"
+    if year >= 1967:
+        holidays[d(year, 2, 11)] = "建国記念の日"
+
+    if year >= 2007:
+        holidays[d(year, 4, 29)] = "昭和の日"
+        holidays[d(year, 5, 4)] = "みどりの日"
+    elif year >= 1989:
+        holidays[d(year, 4, 29)] = "みどりの日"
+    else:
+        holidays[d(year, 4, 29)] = "天皇誕生日"
+
+    if year >= 2020:
+        holidays[d(year, 2, 23)] = "天皇誕生日"
+    elif 1989 <= year <= 2018:
+        holidays[d(year, 12, 23)] = "天皇誕生日"
+
+    moves = OLYMPIC_MOVES.get(year, {})
+    if "海の日" in moves:
+        holidays[d(year, *moves["海の日"])] = "海の日"
+    elif year >= 2003:
+        holidays[_nth_monday(year, 7, 3)] = "海の日"
+    elif year >= 1996:
+        holidays[d(year, 7, 20)] = "海の日"
+
+    if "山の日" in moves:
+        holidays[d(year, *moves["山の日"])] = "山の日"
+    elif year >= 2016:
+        holidays[d(year, 8, 11)] = "山の日"
+
+    if year >= 2003:
+        holidays[_nth_monday(year, 9, 3)] = "敬老の日"
+    elif year >= 1966:
+        holidays[d(year, 9, 15)] = "敬老の日"
+
+    sports_name = "スポーツの日" if year >= 2020 else "体育の日"
+    if "スポーツの日" in moves:
+        holidays[d(year, *moves["スポーツの日"])] = sports_name
+    elif year >= 2000:
+        holidays[_nth_monday(year, 10, 2)] = sports_name
+    elif year >= 1966:
+        holidays[d(year, 10, 10)] = sports_name
+
+    for date, name in SPECIAL_HOLIDAYS.items():
+        if date.year == year:
+            holidays[date] = name
+    return holidays
+
+
+@functools.lru_cache(maxsize=None)
+def japanese_holidays(year):
+    """
+    その年の祝日を {datetime.date: 祝日名} で返す
+
+    振替休日: 祝日が日曜日のとき、その後の最初の祝日でない日（1973/4/12 以降）
+    国民の休日: 前後を祝日に挟まれた平日（1985/12/27 以降）
+    """
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        raise ValueError(f"{MIN_YEAR}〜{MAX_YEAR}年のみ対応しています: {year}")
+
+    holidays = _statutory_holidays(year)
+    one_day = datetime.timedelta(days=1)
+
+    # 国民の休日（祝日に挟まれた日）
+    if year >= 1986:
+        for date in sorted(holidays):
+            between = date + one_day
+            if (between + one_day in holidays and between not in holidays
+                    and between.weekday() != 6):
+                holidays[between] = "国民の休日"
+
+    # 振替休日
+    substitutes = {}
+    for date in sorted(holidays):
+        if date.weekday() != 6 or date < datetime.date(1973, 4, 12):
+            continue
+        substitute = date + one_day
+        if year >= 2007:
+            while substitute in holidays or substitute in substitutes:
+                substitute += one_day
+        elif substitute in holidays:
+            continue
+        if substitute.year == year:
+            substitutes[substitute] = "振替休日"
+    holidays.update(substitutes)
+
+    return dict(sorted(holidays.items()))
+
+
+def _closure_dates(year, closures):
+    dates = []
+    for closure in closures:
+        parts = str(closure).split("-")
+        if len(parts) == 2:
+            dates.append(datetime.date(year, int(parts[0]), int(parts[1])))
+        elif int(parts[0]) == year:
+            dates.append(datetime.date(int(parts[0]), int(parts[1]), int(parts[2])))
+    return dates
+
+# ==========================================
+# 休日マスク（年ごとにキャッシュ）
+# ==========================================
+
+def _day_of_year(year, dates):
+    start = datetime.date(year, 1, 1)
+    return np.array([(date - start).days for date in dates], dtype=np.intp)
+
+
+@functools.lru_cache(maxsize=None)
+def public_holiday_mask(year):
+    """その年の祝日を True とする日単位のマスク（読み取り専用）"""
+    n_days = 366 if _is_leap(year) else 365
+    mask = np.zeros(n_days, dtype=bool)
+    mask[_day_of_year(year, japanese_holidays(year))] = True
+    mask.flags.writeable = False
+    return mask
+
+
+@functools.lru_cache(maxsize=256)
+def _day_mask(year, closures, weekends):
+    mask = public_holiday_mask(year).copy()
+    if weekends:
+        first_weekday = datetime.date(year, 1, 1).weekday()
+        weekday = (np.arange(len(mask)) + first_weekday) % 7
+        mask |= weekday >= 5
+    mask[_day_of_year(year, _closure_dates(year, closures))] = True
+    mask.flags.writeable = False
+    return mask
+
+
+def holiday_day_mask(year, closures=DEFAULT_CLOSURES, weekends=True):
+    """
+    休日（土日・祝日・休業日）を True とする日単位のマスク（読み取り専用）
+
+    closures: 休業日（"MM-DD" は毎年、"YYYY-MM-DD" はその日のみ）
+    weekends: 土日を休日に含める
+    """
+    return _day_mask(int(year), tuple(closures), bool(weekends))
+
+
+@functools.lru_cache(maxsize=256)
+def _hour_mask(year, closures, weekends, steps_per_day):
+    mask = np.repeat(_day_mask(year, closures, weekends), steps_per_day)
+    mask.flags.writeable = False
+    return mask
+
+
+def holiday_hour_mask(year, closures=DEFAULT_CLOSURES, weekends=True, steps_per_day=24):
+    """holiday_day_mask を時間（コマ）単位に展開したマスク（読み取り専用）"""
+    return _hour_mask(int(year), tuple(closures), bool(weekends), int(steps_per_day))
+
+
+def is_holiday(date_obj, closures=DEFAULT_CLOSURES):
+    """日付が休日（土日・祝日・休業日）か判定する"""
+    day = date_obj.timetuple().tm_yday - 1
+    return bool(holiday_day_mask(date_obj.year, closures)[day])
+
+
+def _is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
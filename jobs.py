@@ -0,0 +1,145 @@
+"""
+バックグラウンドジョブ
+
+画面の処理（スクリプトの再実行）とは別のスレッドで生成を実行し、進捗の参照と
+キャンセルができるようにする。ジョブはプロセス内で共有する JobRunner に ID で
+登録されるので、画面が再実行されても ID から状態と結果を取り出せる。
+
+    runner = JobRunner()
+    job = runner.submit(func, *args)     # func(job, *args) を別スレッドで実行
+    job.progress, job.message            # 0.0〜1.0 の進捗と表示用メッセージ
+    runner.get(job.id).cancel()          # キャンセルを要求する
+
+func の中では job.update(progress, message) で進捗を報告する。キャンセルが要求されて
+いると update（または job.check_cancelled）が JobCancelled を送出し、処理はそこで止まる。
+"""
+import collections
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """キャンセルが要求されたジョブの中で送出される"""
+
+
+class Job:
+    """1つのジョブの状態（進捗・結果・エラー）"""
+
+    def __init__(self, label=''):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def update(self, progress=None, message=None):
+        """進捗を報告する（キャンセルが要求されていれば JobCancelled を送出）"""
+        self.check_cancelled()
+        if progress is not None:
+            self.progress = min(max(float(progress), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def cancel(self):
+        """キャンセルを要求する（実行待ちならその場で取り消す）"""
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self._finish(CANCELLED)
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.submitted
+
+    def _finish(self, status, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.status = status
+
+
+class JobRunner:
+    """
+    スレッドプールでジョブを実行し、ID で参照できるように保持する
+
+    max_workers : 同時に実行するジョブ数
+    keep        : 保持する終了済みジョブの数（古いものから捨てる）
+    """
+
+    def __init__(self, max_workers=2, keep=32):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='demand-job')
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.keep = keep
+
+    def submit(self, func, *args, label='', **kwargs):
+        """func(job, *args, **kwargs) を実行するジョブを登録し、Job を返す"""
+        job = Job(label)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """ID のジョブ（無ければ None）"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            for job in self.jobs():
+                job.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job, func, args, kwargs):
+        if job.cancel_requested:
+            job._finish(CANCELLED)
+            return
+        job.status = RUNNING
+        try:
+            result = func(job, *args, **kwargs)
+        except JobCancelled:
+            job._finish(CANCELLED)
+        except Exception:
+            job._finish(FAILED, error=traceback.format_exc())
+        else:
+            job.progress = 1.0
+            job._finish(DONE, result=result)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.keep, 0)]:
+            del self._jobs[job_id]
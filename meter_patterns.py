@@ -0,0 +1,296 @@
+"""
+計測データ（スマートメーターの30分値など）からの負荷パターン作成
+
+拠点ごとの時系列の計測値を読み込み、日ごとの24時間の形（日負荷曲線）にまとめてから
+k-means でいくつかの典型パターンに分ける。結果は PRESET_PATTERNS の1項目と同じ形
+（weekday / holiday の24値、holiday_ratio）なので、app.py の set_pattern_data や
+presets.py にそのまま渡せる。
+
+入力 CSV（縦持ち、1行に1コマ）:
+    site_id, datetime, kw
+    列名は 拠点ID, 日時, デマンド(kW) でもよい。site_id が無ければ1拠点として扱う。
+    値は kW でも1コマの kWh でもよい（形と比率しか使わないため）。15分・30分・1時間値に
+    対応し、時刻はコマの開始時刻とする。数百万行のファイルも chunksize 行ずつ読んで
+    (拠点, 日) × 時刻の合計に集計していくので、メモリは日数分しか使わない。
+
+使い方:
+    python meter_patterns.py meter.csv --clusters 4 -o presets.json
+    python meter_patterns.py meter.csv --per-site -o site_patterns.json
+
+平日・休日の判定は holiday_calendar（土日・祝日・休業日）による。
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from holiday_calendar import DEFAULT_CLOSURES, holiday_day_mask
+from presets import normalize_to_percentage
+from profiling import span
+
+METER_COLUMNS = ['site_id', 'datetime', 'kw']
+
+# app.py の表記に合わせた日本語の列名も受け付ける
+METER_COLUMN_ALIASES = {
+    '拠点ID': 'site_id',
+    '日時': 'datetime',
+    'デマンド(kW)': 'kw',
+    'Demand_kW': 'kw',
+}
+
+# 計測データを一度に読み込む行数
+READ_CHUNKSIZE = 1_000_000
+
+# site_id 列が無いときの拠点名
+DEFAULT_SITE = 'meter'
+
+# ==========================================
+# 読み込み・日負荷曲線
+# ==========================================
+
+def iter_meter_table(source, chunksize=READ_CHUNKSIZE):
+    """計測データ CSV を chunksize 行ずつ (site_id, datetime, kw) の DataFrame で返す"""
+    for chunk in pd.read_csv(source, chunksize=chunksize, dtype={'site_id': str, '拠点ID': str}):
+        chunk = chunk.rename(columns=METER_COLUMN_ALIASES)
+        if 'site_id' not in chunk.columns:
+            chunk['site_id'] = DEFAULT_SITE
+        missing = [c for c in METER_COLUMNS if c not in chunk.columns]
+        if missing:
+            raise ValueError(f"入力に必要な列がありません: {', '.join(missing)}")
+        yield chunk[METER_COLUMNS]
+
+
+def _hourly_sums(chunk):
+    """1チャンク分を (拠点, 日) ごとの時刻別の合計・件数（各24列）の DataFrame にする"""
+    timestamps = pd.to_datetime(chunk['datetime'])
+    values = pd.to_numeric(chunk['kw'], errors='coerce').to_numpy(dtype=float)
+    valid = ~np.isnan(values) & timestamps.notna().to_numpy()
+    timestamps = timestamps[valid]
+    codes, keys = pd.MultiIndex.from_arrays(
+        [chunk['site_id'].to_numpy()[valid], timestamps.dt.normalize().to_numpy()],
+        names=['site_id', 'date']
+    ).factorize()
+    cell = codes * 24 + timestamps.dt.hour.to_numpy()
+    n_cells = len(keys) * 24
+    sums = np.bincount(cell, weights=values[valid], minlength=n_cells).reshape(-1, 24)
+    counts = np.bincount(cell, minlength=n_cells).reshape(-1, 24)
+    return pd.DataFrame(np.hstack([sums, counts]), index=keys)
+
+
+def daily_profiles(source, chunksize=READ_CHUNKSIZE, closures=DEFAULT_CLOSURES):
+    """
+    計測データを (拠点, 日) ごとの24時間の平均値にまとめる
+
+    戻り値は dict:
+      site_id (日数,), date (日数,), holiday (日数,) 休日か,
+      profile (日数, 24) 時刻ごとの平均値, n_rows 読み込んだ行数, n_incomplete 除いた日数
+    24時間のどこかに値が無い日（計測の欠け・期間の端）は除く。
+    """
+    partial = []
+    n_rows = 0
+    with span('meter_read'):
+        for chunk in iter_meter_table(source, chunksize):
+            partial.append(_hourly_sums(chunk))
+            n_rows += len(chunk)
+    if not partial:
+        raise ValueError("計測データがありません")
+
+    with span('meter_profiles'):
+        # チャンクの境目で分かれた日をまとめる
+        table = pd.concat(partial).groupby(level=[0, 1], sort=True).sum()
+        sums, counts = table.to_numpy()[:, :24], table.to_numpy()[:, 24:]
+        complete = (counts > 0).all(axis=1)
+        dates = pd.DatetimeIndex(table.index.get_level_values(1)[complete])
+        holiday = np.zeros(len(dates), dtype=bool)
+        for year in np.unique(dates.year):
+            in_year = dates.year == year
+            holiday[in_year] = holiday_day_mask(year, closures)[dates.dayofyear[in_year] - 1]
+
+    return {
+        'site_id': table.index.get_level_values(0).to_numpy()[complete],
+        'date': dates,
+        'holiday': holiday,
+        'profile': sums[complete] / counts[complete],
+        'n_rows': n_rows,
+        'n_incomplete': int((~complete).sum()),
+    }
+
+# ==========================================
+# k-means
+# ==========================================
+
+def kmeans(x, n_clusters, n_iter=100, seed=0, tol=1e-8):
+    """
+    (点数, 次元) の x を n_clusters 個に分ける（k-means++ で初期化した Lloyd 法）
+
+    距離・所属・重心の更新はすべて配列演算（重心は所属の one-hot との行列積）。
+    戻り値は (重心 (クラスタ数, 次元), 所属 (点数,), 重心までの二乗距離の合計)。
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(x))
+    centers = np.empty((n_clusters, x.shape[1]))
+    centers[0] = x[rng.integers(len(x))]
+    nearest = ((x - centers[0]) ** 2).sum(axis=1)
+    for k in range(1, n_clusters):
+        total = nearest.sum()
+        idx = rng.choice(len(x), p=nearest / total) if total > 0 else rng.integers(len(x))
+        centers[k] = x[idx]
+        nearest = np.minimum(nearest, ((x - centers[k]) ** 2).sum(axis=1))
+
+    x_sq = (x ** 2).sum(axis=1)
+    for _ in range(n_iter):
+        dist = x_sq[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)
+        labels = dist.argmin(axis=1)
+        onehot = labels[:, None] == np.arange(n_clusters)
+        counts = onehot.sum(axis=0)
+        updated = (onehot.T.astype(float) @ x) / np.maximum(counts, 1)[:, None]
+        # 空になったクラスタは、いまの重心から最も遠い点に置き直す
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            farthest = np.argsort(dist[np.arange(len(x)), labels])[::-1][:len(empty)]
+            updated[empty] = x[farthest]
+        shift = np.abs(updated - centers).max()
+        centers = updated
+        if shift < tol:
+            break
+
+    dist = x_sq[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)
+    labels = dist.argmin(axis=1)
+    return centers, labels, float(np.maximum(dist[np.arange(len(x)), labels], 0).sum())
+
+# ==========================================
+# パターンの作成
+# ==========================================
+
+def _site_means(profiles):
+    """拠点ごとの平日・休日の平均日負荷曲線 (拠点数, 24) を返す（該当日が無ければ NaN）"""
+    site_idx, sites = pd.factorize(profiles['site_id'])
+    frame = pd.DataFrame(profiles['profile'])
+    means = frame.groupby([site_idx, profiles['holiday']]).mean()
+    by_type = [
+        means.xs(flag, level=1).reindex(range(len(sites))).to_numpy()
+        if flag in means.index.get_level_values(1) else np.full((len(sites), 24), np.nan)
+        for flag in (False, True)
+    ]
+    return site_idx, np.asarray(sites), by_type[0], by_type[1]
+
+
+def _pattern_entry(weekday, holiday, holiday_ratio, **counts):
+    """PRESET_PATTERNS の1項目の形（割合 % の24値と holiday_ratio）にする"""
+    entry = {
+        'weekday': [round(v, 2) for v in normalize_to_percentage(list(weekday))],
+        'holiday': [round(v, 2) for v in normalize_to_percentage(list(holiday))],
+        'holiday_ratio': int(round(holiday_ratio)),
+    }
+    entry.update(counts)
+    return entry
+
+
+def _peak_ratio(weekday, holiday):
+    """休日の平均日負荷曲線の最大 / 平日の最大 (%)。休日が無ければ 100"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.fmax.reduce(holiday, axis=-1) / np.fmax.reduce(weekday, axis=-1) * 100
+    return np.where(np.isfinite(ratio), ratio, 100.0)
+
+
+def site_patterns(profiles):
+    """拠点ごとのパターン {site_id: PRESET_PATTERNS の1項目} を作る（平日・休日の平均の形）"""
+    site_idx, sites, weekday, holiday = _site_means(profiles)
+    ratio = _peak_ratio(weekday, holiday)
+    n_days = np.bincount(site_idx, minlength=len(sites))
+    patterns = {}
+    for s, site in enumerate(sites):
+        # 平日（休日）の無い拠点は、もう一方の形で代用する
+        w = weekday[s] if not np.isnan(weekday[s]).any() else holiday[s]
+        h = holiday[s] if not np.isnan(holiday[s]).any() else w
+        patterns[str(site)] = _pattern_entry(w, h, ratio[s], n_days=int(n_days[s]))
+    return patterns
+
+
+def derive_patterns(profiles, n_clusters=4, seed=0, name="📊 計測パターン"):
+    """
+    平日の日負荷曲線を k-means で n_clusters 個の典型パターンに分け、
+    {名前: PRESET_PATTERNS の1項目} を大きいクラスタ順に返す
+
+    形だけを比べるため、各日の曲線は最大を1に正規化してから分ける。平日の形は重心、
+    休日の形と holiday_ratio は、そのクラスタに属する平日の日数で拠点を重み付けした
+    拠点ごとの休日の平均の形と比率から作る。各項目には n_sites（平日の多くがそのクラスタに
+    入る拠点の数）と n_days（平日の日数）も入る。
+    """
+    site_idx, sites, site_weekday, site_holiday = _site_means(profiles)
+    peak = profiles['profile'].max(axis=1)
+    use = ~profiles['holiday'] & (peak > 0)
+    if not use.any():
+        raise ValueError("平日の計測データがありません")
+
+    with span('kmeans'):
+        shapes = profiles['profile'][use] / peak[use][:, None]
+        centers, labels, _ = kmeans(shapes, n_clusters, seed=seed)
+
+    # 拠点 × クラスタの平日の日数
+    n_found = len(centers)
+    weights = np.bincount(site_idx[use] * n_found + labels,
+                          minlength=len(sites) * n_found).reshape(len(sites), n_found)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        holiday_shape = site_holiday / np.fmax.reduce(site_holiday, axis=1)[:, None]
+    ratio = _peak_ratio(site_weekday, site_holiday)
+    has_holiday = ~np.isnan(holiday_shape).any(axis=1)
+    main_cluster = weights.argmax(axis=1)
+
+    patterns = {}
+    for rank, k in enumerate(np.argsort(-weights.sum(axis=0), kind='stable')):
+        w = weights[:, k] * has_holiday
+        if w.sum() > 0:
+            holiday = (w[:, None] * np.nan_to_num(holiday_shape)).sum(axis=0) / w.sum()
+            holiday_ratio = (w * ratio).sum() / w.sum()
+        else:
+            holiday, holiday_ratio = centers[k], 100.0
+        patterns[f"{name}{rank + 1}"] = _pattern_entry(
+            centers[k], holiday, holiday_ratio,
+            n_sites=int((main_cluster == k).sum()), n_days=int(weights[:, k].sum())
+        )
+    return patterns
+
+# ==========================================
+# CLI
+# ==========================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="計測データから負荷パターン（プリセット）を作成します")
+    parser.add_argument('input', help="計測データ CSV (site_id, datetime, kw)")
+    parser.add_argument('-o', '--output', default='meter_patterns.json',
+                        help="出力する JSON（PRESET_PATTERNS と同じ形）")
+    parser.add_argument('--clusters', type=int, default=4, help="作成する典型パターンの数")
+    parser.add_argument('--per-site', action='store_true',
+                        help="クラスタに分けず、拠点ごとのパターンを出力する")
+    parser.add_argument('--seed', type=int, default=0, help="k-means の初期値の乱数の種")
+    parser.add_argument('--chunksize', type=int, default=READ_CHUNKSIZE, help="一度に読み込む行数")
+    parser.add_argument('--closures', default=','.join(DEFAULT_CLOSURES),
+                        help="土日・祝日以外の休業日 (カンマ区切りの MM-DD / YYYY-MM-DD、空文字で無し)")
+    args = parser.parse_args(argv)
+    if args.clusters < 1:
+        parser.error("--clusters は1以上を指定してください")
+
+    closures = tuple(c.strip() for c in args.closures.split(',') if c.strip())
+    try:
+        profiles = daily_profiles(args.input, args.chunksize, closures)
+    except ValueError as exc:
+        parser.exit(1, f"{exc}\n")
+    n_sites = len(np.unique(profiles['site_id']))
+    print(f"{profiles['n_rows']:,}行を読み込みました: {n_sites}拠点, {len(profiles['date']):,}日"
+          f"（うち休日 {int(profiles['holiday'].sum()):,}日、欠けのある {profiles['n_incomplete']}日は除外）")
+
+    if args.per_site:
+        patterns = site_patterns(profiles)
+    else:
+        patterns = derive_patterns(profiles, args.clusters, args.seed)
+        for name, entry in patterns.items():
+            print(f"{name}: {entry['n_sites']}拠点・平日{entry['n_days']}日, 休日レベル {entry['holiday_ratio']}%")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(patterns, f, ensure_ascii=False, indent=2)
+    print(f"\n{len(patterns)}件のパターンを出力しました: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+パラメトリック形式のデマンド保存
+
+生成結果は「係数ベクトル・休日カレンダー・月ごとの (gamma, B, V)・ターゲット」で
+完全に決まる（ピーク・合計の調整と丸めは決定的な後処理）。そこで毎コマの値
+（1時間分解能で 8760 値）ではなくこれらのパラメータだけを保存し、必要なときに
+generate_sites と同じ処理で展開し直す。1拠点・1年あたり数百バイトで済む。
+
+    demand, info = generate_sites(..., return_info=True)
+    archive = pack_profiles(site_ids, weekday_coefs, holiday_coefs, peaks, totals, info, year, ...)
+    save_profiles("portfolio.npz", archive)
+
+    archive = load_profiles("portfolio.npz")
+    demand = decode_profiles(archive)              # 全拠点 (拠点数, コマ数)
+    demand = decode_profiles(archive, [0, 5, 9])   # 指定拠点のみ
+    series = decode_site(archive, "S001")          # 1拠点 (コマ数,)
+"""
+import numpy as np
+
+from demand_engine import (
+    build_calendar, expand_pattern, month_layout, month_shapes, render_demand,
+)
+from holiday_calendar import DEFAULT_CLOSURES
+
+FORMAT_VERSION = 1
+
+# ==========================================
+# 作成・保存
+# ==========================================
+
+def pack_profiles(site_ids, weekday_coefs, holiday_coefs, peaks, totals, info, year,
+                  closures=DEFAULT_CLOSURES, drop_leap_day=False, resolution=60,
+                  adjust_targets=False, round_decimals=None, dtype=np.float64):
+    """
+    generate_sites の入力と info（return_info=True の戻り値）からアーカイブを作る
+
+    引数は generate_sites に渡したものと同じ値を指定する。
+    係数ベクトルは重複を除いたテーブルにし、拠点はその番号だけを持つ。
+    """
+    calendar = build_calendar(year, closures, drop_leap_day, resolution)
+    steps_per_day = calendar['steps_per_day']
+    site_ids = np.asarray(site_ids)
+    if site_ids.dtype == object:
+        site_ids = site_ids.astype(str)
+    peaks = np.atleast_2d(np.asarray(peaks, dtype=float))
+    totals = np.atleast_2d(np.asarray(totals, dtype=float))
+    n_sites = len(site_ids)
+
+    values = np.concatenate([
+        np.broadcast_to(expand_pattern(weekday_coefs, steps_per_day), (n_sites, steps_per_day)),
+        np.broadcast_to(expand_pattern(holiday_coefs, steps_per_day), (n_sites, steps_per_day)),
+    ], axis=1)
+    patterns, pattern_idx = np.unique(values, axis=0, return_inverse=True)
+
+    return {
+        'version': np.int32(FORMAT_VERSION),
+        'year': np.int32(year),
+        'closures': np.array(closures, dtype=str),
+        'drop_leap_day': np.bool_(drop_leap_day),
+        'resolution': np.int32(resolution),
+        'adjust_targets': np.bool_(adjust_targets),
+        'round_decimals': np.int32(-1 if round_decimals is None else round_decimals),
+        'dtype': np.array(np.dtype(dtype).name),
+        'site_id': site_ids,
+        'patterns': patterns,
+        'pattern_idx': pattern_idx.ravel().astype(np.int32),
+        'gamma': np.broadcast_to(info['gamma'], peaks.shape).astype(np.float64),
+        'b': np.broadcast_to(info['b'], peaks.shape).astype(np.float64),
+        'v': np.broadcast_to(info['v'], peaks.shape).astype(np.float64),
+        'peak_kw': peaks,
+        'total_kwh': totals,
+    }
+
+
+def concat_profiles(archives):
+    """同じ設定（年・分解能など）のアーカイブを拠点方向に連結する"""
+    archives = list(archives)
+    first = archives[0]
+    patterns = np.concatenate([a['patterns'] for a in archives])
+    offsets = np.cumsum([0] + [len(a['patterns']) for a in archives[:-1]])
+    pattern_idx = np.concatenate([a['pattern_idx'] + o for a, o in zip(archives, offsets)])
+    patterns, remap = np.unique(patterns, axis=0, return_inverse=True)
+
+    merged = dict(first)
+    for key in ('site_id', 'gamma', 'b', 'v', 'peak_kw', 'total_kwh'):
+        merged[key] = np.concatenate([a[key] for a in archives])
+    merged['patterns'] = patterns
+    merged['pattern_idx'] = remap.ravel()[pattern_idx].astype(np.int32)
+    return merged
+
+
+def save_profiles(path, archive):
+    """アーカイブを圧縮 .npz で保存する"""
+    np.savez_compressed(path, **archive)
+
+
+def load_profiles(path):
+    """save_profiles で保存したアーカイブを読み込む"""
+    with np.load(path, allow_pickle=False) as data:
+        archive = {key: data[key] for key in data.files}
+    if int(archive['version']) > FORMAT_VERSION:
+        raise ValueError(f"未対応の形式バージョンです: {int(archive['version'])}")
+    return archive
+
+# ==========================================
+# 展開
+# ==========================================
+
+def archive_calendar(archive):
+    return build_calendar(
+        int(archive['year']), tuple(archive['closures'].tolist()),
+        bool(archive['drop_leap_day']), int(archive['resolution'])
+    )
+
+
+def decode_profiles(archive, index=None):
+    """
+    アーカイブから (拠点数, コマ数) のデマンド配列を展開する
+
+    index : 展開する拠点の位置（整数・配列・スライス、省略時は全拠点）
+    generate_sites と同じ展開・調整・丸めを通すので、生成時と同じ値になる。
+    """
+    index = slice(None) if index is None else index
+    calendar = archive_calendar(archive)
+    round_decimals = int(archive['round_decimals'])
+
+    values = archive['patterns'][np.atleast_1d(archive['pattern_idx'][index])][:, None, :]
+    gamma = np.atleast_2d(archive['gamma'][index])
+    shaped = month_shapes(values, month_layout(calendar)[None], gamma)
+    return render_demand(
+        calendar, shaped, np.atleast_2d(archive['b'][index]), np.atleast_2d(archive['v'][index]),
+        np.atleast_2d(archive['peak_kw'][index]), np.atleast_2d(archive['total_kwh'][index]),
+        bool(archive['adjust_targets']), None if round_decimals < 0 else round_decimals,
+        np.dtype(str(archive['dtype']))
+    )
+
+
+def decode_site(archive, site_id):
+    """拠点 ID を指定して1拠点分 (コマ数,) を展開する"""
+    matches = np.flatnonzero(archive['site_id'] == site_id)
+    if len(matches) == 0:
+        raise KeyError(f"拠点が見つかりません: {site_id}")
+    return decode_profiles(archive, matches[:1])[0]
+
+
+def iter_decoded(archive, chunksize=256):
+    """chunksize 拠点ずつ (site_id 配列, デマンド配列) を返すイテレータ"""
+    n_sites = len(archive['site_id'])
+    for start in range(0, n_sites, chunksize):
+        index = slice(start, start + chunksize)
+        yield archive['site_id'][index], decode_profiles(archive, index)
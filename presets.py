@@ -0,0 +1,73 @@
+"""
+業態別のプリセット負荷パターン
+
+app.py の業態プリセット選択と batch_generate.py の一括生成で共有する。
+"""
+
+# プリセットパターンの定義
+PRESET_PATTERNS = {
+    "🏢 標準（オフィス/日中型）": {
+        "weekday": [2, 2, 2, 2, 2, 3, 5, 7, 8, 9, 9, 8, 7, 9, 10, 9, 8, 7, 6, 5, 4, 3, 2, 2],
+        "holiday": [3]*24,
+        "holiday_ratio": 30
+    },
+    "🏭 工場（土日休み）": {
+        "weekday": [2, 2, 2, 2, 2, 3, 5, 8, 9, 10, 9, 9, 5, 9, 10, 9, 8, 6, 3, 2, 2, 2, 2, 2],
+        "holiday": [2]*24,
+        "holiday_ratio": 15
+    },
+    "🏭 工場（土日稼働）": {
+        "weekday": [3, 3, 3, 3, 3, 4, 6, 8, 9, 10, 9, 9, 6, 9, 10, 9, 8, 7, 5, 4, 3, 3, 3, 3],
+        "holiday": [3, 3, 3, 3, 3, 4, 6, 8, 9, 10, 9, 9, 6, 9, 10, 9, 8, 7, 5, 4, 3, 3, 3, 3],
+        "holiday_ratio": 100
+    },
+    "🛒 スーパーマーケット": {
+        "weekday": [4, 4, 4, 4, 4, 5, 6, 7, 8, 8, 9, 9, 9, 9, 9, 9.5, 10, 9.5, 8, 7, 6, 5, 4, 4],
+        "holiday": [4, 4, 4, 4, 4, 5, 7, 8, 9, 9, 9.5, 10, 9.5, 9, 9, 9.5, 10, 9, 8, 7, 6, 5, 4, 4],
+        "holiday_ratio": 100
+    },
+    "📦 倉庫（日中のみ）": {
+        "weekday": [1, 1, 1, 1, 1, 1, 2, 4, 8, 8, 8, 8, 6, 8, 8, 8, 8, 4, 2, 1, 1, 1, 1, 1],
+        "holiday": [1]*24,
+        "holiday_ratio": 20
+    },
+    "🏪 コンビニ（24時間）": {
+        "weekday": [4, 4, 4, 4, 5, 6, 7, 8, 9, 9, 9, 10, 10, 9, 9, 8, 8, 7, 6, 5, 5, 5, 4, 4],
+        "holiday": [4, 4, 4, 4, 5, 6, 7, 8, 9, 9, 9, 10, 10, 9, 9, 8, 8, 7, 6, 5, 5, 5, 4, 4],
+        "holiday_ratio": 90
+    },
+    "🌡️ ほぼフラット（気温連動風）": {
+        "weekday": [6, 6, 6, 6, 6, 6, 7, 8, 9, 10, 10, 10, 10, 10, 9, 8, 7, 6, 6, 6, 6, 6, 6, 6],
+        "holiday": [6, 6, 6, 6, 6, 6, 7, 8, 9, 10, 10, 10, 10, 10, 9, 8, 7, 6, 6, 6, 6, 6, 6, 6],
+        "holiday_ratio": 100
+    }
+}
+
+
+def normalize_to_percentage(raw_list):
+    """リストの合計が100になるように正規化する"""
+    total = sum(raw_list)
+    if total == 0:
+        return [0]*len(raw_list)
+    return [x / total * 100 for x in raw_list]
+
+
+def normalize_pattern_to_coefficient(ratio_list):
+    """リストの最大値が1になるように正規化する"""
+    max_val = max(ratio_list)
+    if max_val == 0: return [0.0] * len(ratio_list)
+    return [r / max_val for r in ratio_list]
+
+
+def preset_coefficients(preset_name):
+    """
+    プリセット名から (平日係数, 休日係数) を返す
+
+    app.py と同じく、合計100%に正規化したパターンを最大値1に正規化し、
+    休日係数には holiday_ratio (%) を掛ける。
+    """
+    data = PRESET_PATTERNS[preset_name]
+    weekday_coef = normalize_pattern_to_coefficient(normalize_to_percentage(data["weekday"]))
+    holiday_coef = normalize_pattern_to_coefficient(normalize_to_percentage(data["holiday"]))
+    h_ratio = data.get("holiday_ratio", 100) / 100.0
+    return weekday_coef, [x * h_ratio for x in holiday_coef]
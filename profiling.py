@@ -0,0 +1,95 @@
+"""
+工程別の処理時間計測
+
+    with profiling.profile() as prof:
+        ...                       # この中の span が記録される
+    prof.report()                 # {工程名: {'count': 回数, 'total_s': 合計秒}}
+
+計測を有効にしていないとき span() は共有の空コンテキストを返すだけなので、
+エンジン側に span を置いたままでもコストはほぼ無い。
+"""
+import contextlib
+import contextvars
+import json
+import time
+
+import pandas as pd
+
+_active = contextvars.ContextVar('profiler', default=None)
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+    """工程名ごとに呼び出し回数と合計時間を積算する"""
+
+    def __init__(self):
+        self.records = {}
+
+    def add(self, name, seconds, count=1):
+        record = self.records.setdefault(name, {'count': 0, 'total_s': 0.0})
+        record['count'] += count
+        record['total_s'] += seconds
+
+    def merge(self, records):
+        """別プロセスなどで取った report() の結果を足し込む"""
+        for name, record in records.items():
+            self.add(name, record['total_s'], record['count'])
+
+    def report(self):
+        return {name: dict(record) for name, record in self.records.items()}
+
+    def frame(self):
+        """工程・回数・合計 (ms)・割合 の DataFrame（記録順）"""
+        df = pd.DataFrame(
+            [(name, r['count'], r['total_s'] * 1000) for name, r in self.records.items()],
+            columns=['工程', '回数', '合計 (ms)']
+        )
+        total = df['合計 (ms)'].sum()
+        df['割合 (%)'] = df['合計 (ms)'] / total * 100 if total > 0 else 0.0
+        return df
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    """工程 name の処理時間を計測するコンテキスト（計測が無効なら何もしない）"""
+    profiler = _active.get()
+    if profiler is None:
+        return _NULL_SPAN
+    return _Span(profiler, name)
+
+
+@contextlib.contextmanager
+def profile(profiler=None):
+    """この with ブロック内の span を profiler（省略時は新規）に記録する"""
+    profiler = profiler if profiler is not None else Profiler()
+    token = _active.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _active.reset(token)
+
+
+def write_report(profiler, path):
+    """report() を合計時間付きの JSON として保存する"""
+    stages = profiler.report()
+    report = {
+        'total_s': sum(record['total_s'] for record in stages.values()),
+        'stages': stages,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
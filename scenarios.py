@@ -0,0 +1,158 @@
+"""
+確率的シナリオ（モンテカルロ）
+
+決定的な生成結果（同じ月の平日は毎日同じ形になる）に乱数の揺らぎを掛け、拠点ごとに
+N 本の実現値を作る。揺らぎを掛けたあと fit_to_targets で月ごとのピーク・合計を元の
+生成結果の値に戻す（再射影する）ので、どの実現値も月別の最大需要電力・使用電力量は
+元の生成結果と同じになる（目標どおりに作れない月も、元の結果と同じピーク・合計になる）。
+
+    calendar = build_calendar(2024)
+    base = generate_sites(2024, ..., adjust_targets=True)               # (拠点数, コマ数)
+    scenarios = generate_scenarios(calendar, base, 1000, seed=42, workers=8)
+    # (拠点数, 1000, コマ数)
+
+揺らぎは平均1の対数正規の倍率 exp(e - sigma²/2) で、e は次のどちらか。
+  ar1 : コマ単位の AR(1)  e_t = phi·e_{t-1} + sqrt(1 - phi²)·sigma·z_t（定常分散 sigma²）
+  day : 日単位の独立な正規乱数（1日の中は同じ倍率）
+
+乱数は seed から SeedSequence.spawn で (拠点, シナリオのチャンク) ごとに分けるので、
+workers の数に関係なく同じ seed なら同じ結果になる。
+"""
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from demand_engine import fit_to_targets, month_bounds
+from profiling import span
+
+NOISE_METHODS = ('ar1', 'day')
+
+# ==========================================
+# 揺らぎ
+# ==========================================
+
+def ar1_noise(rng, shape, phi=0.9, sigma=0.1):
+    """
+    最後の軸に沿った定常 AR(1) 系列を shape の配列で返す
+
+    時刻のループは使わず、x_t += phi^d · x_{t-d} を d = 1, 2, 4, ... と倍にしながら
+    足し込む（log2(コマ数) 回の配列演算）。phi^d が十分小さくなったところで打ち切る。
+    """
+    x = rng.standard_normal(shape)
+    x[..., 1:] *= sigma * np.sqrt(1.0 - phi ** 2)
+    x[..., 0] *= sigma
+    coef, d = phi, 1
+    while d < shape[-1] and abs(coef) > 1e-12:
+        x[..., d:] += coef * x[..., :-d]
+        coef, d = coef * coef, d * 2
+    return x
+
+
+def day_noise(rng, shape, steps_per_day, sigma=0.1):
+    """日ごとに独立な正規乱数を1日のコマ数だけ繰り返した shape の配列"""
+    x = rng.standard_normal(shape[:-1] + (shape[-1] // steps_per_day,)) * sigma
+    return np.repeat(x, steps_per_day, axis=-1)
+
+
+def noise_factors(rng, shape, steps_per_day, method='ar1', sigma=0.1, phi=0.9):
+    """平均1の倍率 exp(e - sigma²/2) を返す（e は method の揺らぎ）"""
+    if method == 'ar1':
+        e = ar1_noise(rng, shape, phi, sigma)
+    elif method == 'day':
+        e = day_noise(rng, shape, steps_per_day, sigma)
+    else:
+        raise ValueError(f"未対応の揺らぎです: {method}（{', '.join(NOISE_METHODS)}）")
+    e -= sigma ** 2 / 2
+    return np.exp(e, out=e)
+
+# ==========================================
+# 実現値の生成
+# ==========================================
+
+def scenario_chunk(base, peaks, totals, n_scenarios, seed, period, steps_per_day,
+                   interval_hours=1.0, method='ar1', sigma=0.1, phi=0.9, round_decimals=None,
+                   dtype=np.float32):
+    """
+    1拠点分の n_scenarios 本の実現値 (n_scenarios, コマ数) を作る（ワーカープロセスで実行）
+
+    base : (コマ数,) の決定的なデマンド
+    peaks / totals : (期間数,) の月別の最大・合計（base_targets）
+    seed : np.random.SeedSequence（またはその整数）
+    """
+    rng = np.random.default_rng(seed)
+    with span('scenario_noise'):
+        demand = base[None, :] * noise_factors(rng, (n_scenarios, len(base)), steps_per_day,
+                                               method, sigma, phi)
+    demand = fit_to_targets(
+        demand, np.broadcast_to(peaks, (n_scenarios, len(peaks))),
+        np.broadcast_to(totals, (n_scenarios, len(totals))), period, interval_hours,
+        round_decimals
+    )
+    return demand.astype(dtype, copy=False)
+
+
+def base_targets(calendar, base):
+    """
+    決定的なデマンド base (拠点数, コマ数) の期間ごとの最大 (kW) と合計 (kWh) を
+    (拠点数, 期間数) で返す。データの無い（NaN の）期間は NaN
+    """
+    starts, _ = month_bounds(calendar['period'])
+    return (np.maximum.reduceat(base, starts, axis=1),
+            np.add.reduceat(base, starts, axis=1) * calendar['interval_hours'])
+
+
+def generate_scenarios(calendar, base, n_scenarios, method='ar1', sigma=0.1, phi=0.9, seed=None,
+                       round_decimals=None, chunksize=64, workers=1, dtype=np.float32):
+    """
+    拠点ごとに n_scenarios 本の実現値を作り、(拠点数, n_scenarios, コマ数) の配列で返す
+
+    calendar : base を作ったカレンダー（build_calendar / build_timeline）
+    base     : (拠点数, コマ数) の決定的なデマンド（1拠点なら (コマ数,) でもよい）。
+               実現値は期間ごとの最大・合計を base と同じ値（base_targets）に合わせる
+    method / sigma / phi : 揺らぎの種類・大きさ（対数の標準偏差）・AR(1) の自己相関
+    seed     : 乱数の種（None なら毎回異なる）
+    round_decimals : 指定時は丸め後の月合計も base に合わせる（fit_to_targets）
+    chunksize : 1回の処理で作る実現値の本数（乱数の分け方もこの単位）
+    workers  : 並列プロセス数（1 ならこのプロセスで実行、None なら CPU 数）
+    """
+    base = np.atleast_2d(np.asarray(base, dtype=float))
+    n_sites = len(base)
+    peaks, totals = base_targets(calendar, base)
+
+    counts = [min(chunksize, n_scenarios - start) for start in range(0, n_scenarios, chunksize)]
+    seeds = np.random.SeedSequence(seed).spawn(n_sites * len(counts))
+    tasks = [(site, start) for site in range(n_sites) for start in range(0, n_scenarios, chunksize)]
+    worker = functools.partial(
+        scenario_chunk, period=calendar['period'], steps_per_day=calendar['steps_per_day'],
+        interval_hours=calendar['interval_hours'], method=method, sigma=sigma, phi=phi,
+        round_decimals=round_decimals, dtype=dtype
+    )
+    args = (
+        [base[site] for site, _ in tasks],
+        [peaks[site] for site, _ in tasks],
+        [totals[site] for site, _ in tasks],
+        [counts[start // chunksize] for _, start in tasks],
+        seeds,
+    )
+
+    scenarios = np.empty((n_sites, n_scenarios, base.shape[1]), dtype=dtype)
+    if workers == 1:
+        for (site, start), demand in zip(tasks, map(worker, *args)):
+            scenarios[site, start:start + len(demand)] = demand
+        return scenarios
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for (site, start), demand in zip(tasks, executor.map(worker, *args)):
+            scenarios[site, start:start + len(demand)] = demand
+    return scenarios
+
+
+def scenario_summary(scenarios, quantiles=(0.05, 0.5, 0.95)):
+    """
+    1拠点分の実現値 (n_scenarios, コマ数) のコマごとの分位点を (分位点数, コマ数) で返す
+
+    月別のピーク・合計はどの実現値も同じなので、ばらつきは時刻ごとの値に現れる。
+    """
+    with span('scenario_summary'):
+        return np.nanquantile(scenarios, quantiles, axis=0)
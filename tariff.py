@@ -0,0 +1,234 @@
+"""
+電気料金（基本料金・季節別時間帯別の電力量料金）の試算
+
+生成したデマンド (拠点数, コマ数) から、拠点 × 月の請求額を配列演算だけで計算する。
+拠点ごと・月ごとのループは無いので、数千拠点でも数秒で済む。
+
+    calendar = build_calendar(2024)
+    bills = calculate_bills(calendar, demand, load_tariff("高圧 業務用 季節別時間帯別（例）"))
+    bills['total']                       # (拠点数, 12) 円
+
+料金の定義（TARIFF_PRESETS の1項目、または同じ形の JSON ファイル）:
+  basic_rate     : 基本料金単価（円/kW・月）
+  power_factor   : 力率 (%)。基本料金に (185 - 力率) / 100 を掛ける
+  ratchet_months : 契約電力 = 当月を含む直近 n か月の最大需要電力の最大値（実量制）
+  seasons        : 季節名 → 月のリスト（1〜12 を重複なく割り当てる）
+  bands          : weekday / holiday ごとの時間帯 [開始時, 終了時, 区分名] のリスト（0〜24時を覆う）
+  energy_rates   : 季節名 → 区分名 → 電力量料金単価（円/kWh）
+  adders         : 全量に掛ける単価（円/kWh）。再エネ賦課金・燃料費調整額など
+
+最大需要電力は30分平均デマンドの月最大値。15分分解能は2コマずつ平均し、1時間分解能は
+1時間の値をそのまま30分値とみなす。
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from demand_engine import month_bounds
+from profiling import span
+
+# 料金プランの例（単価は試算用の目安。実際の契約に合わせて書き換えてください）
+TARIFF_PRESETS = {
+    "高圧 業務用 季節別時間帯別（例）": {
+        "basic_rate": 1900.0,
+        "power_factor": 100,
+        "ratchet_months": 12,
+        "seasons": {"夏季": [7, 8, 9], "その他季": [1, 2, 3, 4, 5, 6, 10, 11, 12]},
+        "bands": {
+            "weekday": [[0, 8, "夜間"], [8, 22, "昼間"], [22, 24, "夜間"]],
+            "holiday": [[0, 24, "夜間"]],
+        },
+        "energy_rates": {
+            "夏季": {"昼間": 19.5, "夜間": 15.0},
+            "その他季": {"昼間": 18.5, "夜間": 15.0},
+        },
+        "adders": {"再エネ賦課金": 3.49, "燃料費調整額": 0.0},
+    },
+    "高圧 業務用 単一料金（例）": {
+        "basic_rate": 1750.0,
+        "power_factor": 100,
+        "ratchet_months": 12,
+        "seasons": {"夏季": [7, 8, 9], "その他季": [1, 2, 3, 4, 5, 6, 10, 11, 12]},
+        "bands": {
+            "weekday": [[0, 24, "全日"]],
+            "holiday": [[0, 24, "全日"]],
+        },
+        "energy_rates": {
+            "夏季": {"全日": 18.0},
+            "その他季": {"全日": 17.0},
+        },
+        "adders": {"再エネ賦課金": 3.49, "燃料費調整額": 0.0},
+    },
+}
+
+# ==========================================
+# 料金定義
+# ==========================================
+
+def load_tariff(name_or_path):
+    """TARIFF_PRESETS の名前、または同じ形の JSON ファイルから料金定義を読み込む"""
+    if name_or_path in TARIFF_PRESETS:
+        tariff = TARIFF_PRESETS[name_or_path]
+    else:
+        with open(name_or_path, encoding='utf-8') as f:
+            tariff = json.load(f)
+    validate_tariff(tariff)
+    return tariff
+
+
+def validate_tariff(tariff):
+    """季節・時間帯・単価の定義に抜けや重複があれば ValueError を送出する"""
+    months = sorted(m for ms in tariff['seasons'].values() for m in ms)
+    if months != list(range(1, 13)):
+        raise ValueError("seasons には 1〜12 月を重複なく割り当ててください")
+    for day_type in ('weekday', 'holiday'):
+        bands = sorted(tariff['bands'][day_type])
+        edges = [edge for start, end, _ in bands for edge in (start, end)]
+        if edges[0] != 0 or edges[-1] != 24 or any(a != b for a, b in zip(edges[1:-1:2], edges[2::2])):
+            raise ValueError(f"bands の {day_type} は 0〜24時を隙間なく覆うように指定してください")
+    names = band_names(tariff)
+    for season, rates in tariff['energy_rates'].items():
+        missing = [name for name in names if name not in rates]
+        if missing:
+            raise ValueError(f"energy_rates の {season} に区分 {', '.join(missing)} の単価がありません")
+    missing = [season for season in tariff['seasons'] if season not in tariff['energy_rates']]
+    if missing:
+        raise ValueError(f"energy_rates に季節 {', '.join(missing)} の単価がありません")
+
+
+def band_names(tariff):
+    """時間帯区分の名前（定義順、重複なし）"""
+    names = [name for day_type in ('weekday', 'holiday') for _, _, name in tariff['bands'][day_type]]
+    return list(dict.fromkeys(names))
+
+
+def band_table(tariff, steps_per_day):
+    """(2, 1日のコマ数) の区分番号表（行 0: 平日, 1: 休日。コマの開始時刻で判定）"""
+    names = band_names(tariff)
+    hours = np.arange(steps_per_day) * (24 / steps_per_day)
+    table = np.zeros((2, steps_per_day), dtype=np.int8)
+    for row, day_type in enumerate(('weekday', 'holiday')):
+        for start, end, name in tariff['bands'][day_type]:
+            table[row, (hours >= start) & (hours < end)] = names.index(name)
+    return table
+
+
+def rate_table(tariff):
+    """(12, 区分数) の月 × 区分の電力量料金単価（円/kWh）"""
+    names = band_names(tariff)
+    table = np.zeros((12, len(names)))
+    for season, months in tariff['seasons'].items():
+        rates = tariff['energy_rates'][season]
+        table[np.asarray(months) - 1] = [rates[name] for name in names]
+    return table
+
+# ==========================================
+# 請求額の計算
+# ==========================================
+
+def demand_30min(calendar, demand):
+    """(拠点数, 30分コマ数) の30分平均デマンドと、30分コマごとの期間番号を返す"""
+    if calendar['steps_per_day'] > 48:
+        step = calendar['steps_per_day'] // 48
+        demand = demand.reshape(demand.shape[0], -1, step).mean(axis=-1)
+        return demand, calendar['period'][::step]
+    return demand, calendar['period']
+
+
+def ratchet(max_demand, months, history=None):
+    """
+    各月の契約電力 = 当月を含む直近 months か月の最大需要電力の最大値
+
+    max_demand : (拠点数, 期間数)
+    history    : 前年までの最大需要電力 (拠点数, 過去の月数)。古い順で、直近 months - 1 か月分を
+                 使う（足りない分は記録なしとして扱う）。省略時は計算期間内の月だけで決める
+    """
+    n_history = months - 1
+    if history is None:
+        history = np.full((max_demand.shape[0], n_history), np.nan)
+    history = np.atleast_2d(np.asarray(history, dtype=float))
+    history = history[:, max(history.shape[1] - n_history, 0):]
+    missing = np.full((history.shape[0], n_history - history.shape[1]), np.nan)
+    padded = np.concatenate([missing, history, max_demand], axis=1)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, months, axis=1)
+    return np.fmax.reduce(windows, axis=-1)
+
+
+def calculate_bills(calendar, demand, tariff, contract_kw=None, history=None):
+    """
+    拠点 × 月（期間）の請求額を計算する
+
+    calendar    : demand を作ったカレンダー（build_calendar / build_timeline）
+    demand      : (拠点数, コマ数) のデマンド (kW)。1拠点なら (コマ数,) でもよい
+    contract_kw : 拠点ごとの契約電力 (kW) を固定する場合に指定（協議制）。省略時は実量制
+    history     : 実量制の前年までの最大需要電力（ratchet を参照）
+
+    戻り値は (拠点数, 期間数) の配列の dict:
+      kwh, max_demand_kw, contract_kw, basic_charge, energy_charge, adder_charge, total
+    と、区分別の使用電力量 band_kwh (拠点数, 期間数, 区分数)、区分名 bands。
+    データの無い（NaN を含む）月は NaN になる。
+    """
+    demand = np.atleast_2d(np.asarray(demand, dtype=float))
+    interval_hours = calendar['interval_hours']
+    names = band_names(tariff)
+    starts, _ = month_bounds(calendar['period'])
+    period_month = calendar['month'][starts]
+
+    with span('tariff'):
+        # 区分別の使用電力量（区分ごとに月単位で集計）
+        band = band_table(tariff, calendar['steps_per_day'])[calendar['holiday'].astype(np.intp),
+                                                             calendar['slot']]
+        band_kwh = np.stack([
+            np.add.reduceat(np.where(band == k, demand, 0.0), starts, axis=1)
+            for k in range(len(names))
+        ], axis=-1) * interval_hours
+        kwh = band_kwh.sum(axis=-1)
+
+        # 最大需要電力と契約電力
+        values, periods = demand_30min(calendar, demand)
+        max_demand = np.maximum.reduceat(values, month_bounds(periods)[0], axis=1)
+        if contract_kw is None:
+            contract = ratchet(max_demand, tariff.get('ratchet_months', 12), history)
+        else:
+            contract = np.broadcast_to(np.asarray(contract_kw, dtype=float).reshape(-1, 1),
+                                       max_demand.shape)
+        contract = np.where(np.isnan(kwh), np.nan, contract)
+
+        factor = (185 - tariff.get('power_factor', 100)) / 100
+        basic = tariff['basic_rate'] * contract * factor
+        energy = (band_kwh * rate_table(tariff)[period_month - 1]).sum(axis=-1)
+        adders = kwh * sum(tariff.get('adders', {}).values())
+
+    return {
+        'kwh': kwh,
+        'max_demand_kw': max_demand,
+        'contract_kw': contract,
+        'basic_charge': basic,
+        'energy_charge': energy,
+        'adder_charge': adders,
+        'total': basic + energy + adders,
+        'band_kwh': band_kwh,
+        'bands': names,
+    }
+
+
+def bill_frame(site_ids, bills, calendar):
+    """calculate_bills の結果を拠点 × 月の縦持ち DataFrame にする（区分別 kWh は kwh_<区分> 列）"""
+    starts, _ = month_bounds(calendar['period'])
+    n_sites, n_periods = bills['total'].shape
+    frame = pd.DataFrame({
+        'site_id': np.repeat(np.asarray(site_ids), n_periods),
+        'year': np.tile(calendar['index'][starts].year.to_numpy(), n_sites),
+        'month': np.tile(calendar['month'][starts], n_sites),
+        'kwh': bills['kwh'].ravel(),
+        'max_demand_kw': bills['max_demand_kw'].ravel(),
+        'contract_kw': bills['contract_kw'].ravel(),
+        'basic_charge': bills['basic_charge'].ravel(),
+        'energy_charge': bills['energy_charge'].ravel(),
+        'adder_charge': bills['adder_charge'].ravel(),
+        'total': bills['total'].ravel(),
+    })
+    for k, name in enumerate(bills['bands']):
+        frame[f"kwh_{name}"] = bills['band_kwh'][..., k].ravel()
+    return frame
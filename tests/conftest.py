@@ -0,0 +1,28 @@
+"""
+テスト共通の設定
+
+モジュールはリポジトリ直下に並んでいるので、どこから pytest を実行しても import できるように
+リポジトリのルートを sys.path に加える。
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from presets import PRESET_PATTERNS, preset_coefficients  # noqa: E402
+
+
+@pytest.fixture
+def sites():
+    """プリセットから選んだ 60 拠点の (平日係数, 休日係数, 月別ピーク, 月別合計)。負荷率は 10〜100%"""
+    rng = np.random.default_rng(0)
+    names = list(PRESET_PATTERNS)
+    coefs = [preset_coefficients(names[i]) for i in rng.integers(len(names), size=60)]
+    weekday = np.array([c[0] for c in coefs])
+    holiday = np.array([c[1] for c in coefs])
+    peaks = np.round(rng.uniform(20, 400, (60, 12)), 1)
+    totals = np.round(peaks * rng.uniform(0.1, 1.0, (60, 12)) * 24 * 28)
+    return weekday, holiday, peaks, totals
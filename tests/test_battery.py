@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from battery import shave_peaks
+from demand_engine import build_calendar, build_timeline, generate_sites, generate_timeline
+
+YEAR = 2024
+
+
+@pytest.fixture
+def demand(sites):
+    weekday, holiday, peaks, totals = sites
+    return generate_sites(YEAR, weekday[:8], holiday[:8], peaks[:8], totals[:8], optimize_shape=True,
+                          adjust_targets=True, round_decimals=2)
+
+
+def test_soc_is_carried_across_months(demand):
+    """月末の残量を翌月に引き継ぐ。2月だけを1月末の残量から計算した結果と同じになる"""
+    calendar = build_calendar(YEAR)
+    energy, power = np.full(8, 200.0), np.full(8, 50.0)
+    result = shave_peaks(calendar, demand, energy, power, efficiency=0.9, return_series=True)
+
+    in_feb = calendar['month'] == 2
+    start = np.flatnonzero(in_feb)[0]
+    january_end = result['soc_kwh'][:, start - 1]
+    # 残量は月の境目でも途切れず、1コマの変化は出力の上限を超えない
+    soc = np.concatenate([energy[:, None], result['soc_kwh']], axis=1)
+    assert (np.abs(np.diff(soc, axis=1)) <= power[:, None] + 1e-9).all()
+    assert ((soc >= -1e-9) & (soc <= energy[:, None] + 1e-9)).all()
+    assert (january_end < energy).any()
+
+    feb_calendar = {'period': calendar['period'][in_feb], 'interval_hours': calendar['interval_hours']}
+    february = shave_peaks(feb_calendar, demand[:, in_feb], energy, power, efficiency=0.9,
+                           initial_soc=january_end / energy, return_series=True)
+    np.testing.assert_allclose(february['peak_kw'][:, 0], result['peak_kw'][:, 1])
+    np.testing.assert_allclose(february['soc_kwh'], result['soc_kwh'][:, in_feb], atol=1e-6)
+    np.testing.assert_allclose(february['net_demand'], result['net_demand'][:, in_feb], atol=1e-6)
+
+
+def test_next_year_resumes_from_final_soc(sites):
+    """年ごとに分けても、前年の final_soc から続ければ2年通しの計算と同じになる"""
+    weekday, holiday, peaks, totals = sites
+    demand = generate_timeline(YEAR, 2, weekday[:4], holiday[:4], peaks[:4], totals[:4],
+                               optimize_shape=True, adjust_targets=True, round_decimals=2)
+    n_first = len(build_calendar(YEAR)['period'])
+    # 12月31日の最後の3時間をその月のピークにして、放電したまま年を越させる
+    demand[:, n_first - 3:n_first] = demand[:, :n_first].max(axis=1, keepdims=True) * 1.5
+    energy, power = [[100.0], [300.0]], [[50.0], [100.0]]
+    both = shave_peaks(build_timeline(YEAR, 2), demand, energy, power, return_series=True)
+
+    first = shave_peaks(build_calendar(YEAR), demand[:, :n_first], energy, power)
+    second = shave_peaks(build_calendar(YEAR + 1), demand[:, n_first:], energy, power,
+                         initial_soc=first['final_soc'], return_series=True)
+    assert first['final_soc'].shape == (2, 4)
+    assert (first['final_soc'] < 1).all()
+    np.testing.assert_allclose(first['final_soc'] * np.array(energy), both['soc_kwh'][:, :, n_first - 1])
+    np.testing.assert_allclose(second['peak_kw'], both['peak_kw'][:, :, 12:])
+    np.testing.assert_allclose(second['soc_kwh'], both['soc_kwh'][:, :, n_first:], atol=1e-6)
+    np.testing.assert_allclose(second['final_soc'], both['final_soc'])
+
+
+def test_peaks_never_rise_and_net_demand_matches(demand):
+    calendar = build_calendar(YEAR, resolution=30)
+    demand = np.repeat(demand, 2, axis=1)
+    result = shave_peaks(calendar, demand, energy_kwh=[[100], [300]], power_kw=[[25], [80]],
+                         return_series=True)
+
+    assert result['peak_kw'].shape == (2, 8, 12)
+    assert (result['peak_kw'] <= result['original_peak_kw'] + 1e-9).all()
+    # 容量が大きいほどピークは下がる（少なくとも上がらない）
+    assert (result['peak_kw'][1] <= result['peak_kw'][0] + 0.01).all()
+    assert (result['reduction_kw'][1] > 0).all()
+    net_peak = np.maximum.reduceat(result['net_demand'], [0] + list(
+        np.flatnonzero(np.diff(calendar['period'])) + 1), axis=2)
+    np.testing.assert_allclose(net_peak, result['peak_kw'])
+
+
+def test_zero_capacity_keeps_demand(demand):
+    calendar = build_calendar(YEAR)
+    result = shave_peaks(calendar, demand, energy_kwh=0.0, power_kw=0.0, return_series=True)
+
+    np.testing.assert_array_equal(result['peak_kw'], result['original_peak_kw'])
+    np.testing.assert_array_equal(result['net_demand'], demand)
+    np.testing.assert_array_equal(result['discharged_kwh'], 0.0)
+    np.testing.assert_array_equal(result['final_soc'], 1.0)
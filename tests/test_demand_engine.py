@@ -0,0 +1,198 @@
+import numpy as np
+import pytest
+
+from demand_engine import (
+    FEASIBLE, SHAPED, TOO_HIGH, TOO_LOW, MonthResultCache, SolveCache, build_calendar, check_feasibility,
+    build_timeline, generate_sites, generate_timeline, generate_year, growth_factors, month_bounds,
+)
+from jobs import CANCELLED, JobRunner
+
+YEAR = 2024
+
+
+def month_stats(calendar, demand):
+    """(拠点数, 期間数) の月最大 (kW) と月合計 (kWh)"""
+    starts, _ = month_bounds(calendar['period'])
+    return (np.maximum.reduceat(demand, starts, axis=1),
+            np.add.reduceat(demand, starts, axis=1) * calendar['interval_hours'])
+
+
+@pytest.mark.parametrize('method', ['bisect', 'newton'])
+@pytest.mark.parametrize('resolution', [60, 30])
+def test_rounded_months_match_targets_exactly(sites, method, resolution):
+    """丸め後も、作れる月はピーク・合計が目標と一致し、作れない月も合計は一致する"""
+    weekday, holiday, peaks, totals = sites
+    calendar = build_calendar(YEAR, resolution=resolution)
+    demand = generate_sites(YEAR, weekday, holiday, peaks, totals, resolution=resolution,
+                            optimize_shape=True, adjust_targets=True, round_decimals=2,
+                            shape_method=method)
+    status = check_feasibility(YEAR, weekday, holiday, peaks, totals, resolution=resolution)['status']
+    peak, total = month_stats(calendar, demand)
+
+    np.testing.assert_array_equal(np.round(demand, 2), demand)
+    np.testing.assert_allclose(total, totals, rtol=0, atol=1e-6)
+    ok = np.isin(status, [FEASIBLE, SHAPED])
+    assert ok.mean() > 0.5
+    np.testing.assert_allclose(peak[ok], peaks[ok], rtol=0, atol=1e-9)
+    assert (peak[status == TOO_LOW] <= peaks[status == TOO_LOW] + 1e-9).all()
+    assert (peak[status == TOO_HIGH] >= peaks[status == TOO_HIGH]).all()
+
+
+@pytest.mark.parametrize('method', ['bisect', 'newton'])
+def test_solver_meets_targets_without_adjustment(sites, method):
+    """形状最適化だけで（微調整なしに）作れる月のピーク・合計を満たす"""
+    weekday, holiday, peaks, totals = sites
+    calendar = build_calendar(YEAR)
+    demand, info = generate_sites(YEAR, weekday, holiday, peaks, totals, optimize_shape=True,
+                                  shape_method=method, return_info=True)
+    status = check_feasibility(YEAR, weekday, holiday, peaks, totals)['status']
+    peak, total = month_stats(calendar, demand)
+
+    ok = np.isin(status, [FEASIBLE, SHAPED])
+    assert info['converged'][ok].all()
+    np.testing.assert_allclose(peak[ok], peaks[ok], rtol=1e-6)
+    np.testing.assert_allclose(total[ok], totals[ok], rtol=1e-6)
+
+
+@pytest.mark.parametrize('resolution', [30, 15])
+def test_sub_hourly_resolution_meets_targets(sites, resolution):
+    """30/15分値でも月最大 (kW) と月合計 (kWh) は1時間値と同じ目標に合う"""
+    weekday, holiday, peaks, totals = sites
+    calendar = build_calendar(YEAR, resolution=resolution)
+    demand, info = generate_sites(YEAR, weekday, holiday, peaks, totals, resolution=resolution,
+                                  optimize_shape=True, dtype=np.float32, return_info=True)
+    assert demand.shape == (len(peaks), 366 * 24 * 60 // resolution)
+    assert demand.dtype == np.float32
+    peak, total = month_stats(calendar, demand.astype(float))
+
+    ok = ~info['flat'] & ~info['base_zero']
+    np.testing.assert_allclose(peak[ok], peaks[ok], rtol=1e-5)
+    np.testing.assert_allclose(total[ok], totals[ok], rtol=1e-5)
+
+
+@pytest.mark.parametrize('method', ['bisect', 'newton'])
+def test_forced_adjustment_flags_match_feasibility(sites, method):
+    """B=0 / フラット化の強制調整は、事前判定の負荷率不足 / 超過の月とだけ一致する"""
+    weekday, holiday, peaks, totals = sites
+    _, info = generate_sites(YEAR, weekday, holiday, peaks, totals, optimize_shape=True,
+                             shape_method=method, return_info=True)
+    status = check_feasibility(YEAR, weekday, holiday, peaks, totals)['status']
+
+    assert (status == TOO_LOW).any()
+    np.testing.assert_array_equal(info['base_zero'], status == TOO_LOW)
+    np.testing.assert_array_equal(info['flat'], status == TOO_HIGH)
+
+
+def test_missing_months_are_nan(sites):
+    weekday, holiday, peaks, totals = sites
+    peaks = peaks.copy()
+    peaks[0, 4] = np.nan
+    calendar = build_calendar(YEAR)
+    demand = generate_sites(YEAR, weekday, holiday, peaks, totals, optimize_shape=True,
+                            adjust_targets=True, round_decimals=2)
+
+    in_may = calendar['month'] == 5
+    assert np.isnan(demand[0, in_may]).all()
+    assert not np.isnan(demand[0, ~in_may]).any()
+    assert not np.isnan(demand[1:]).any()
+
+
+def test_timeline_applies_growth_per_year(sites):
+    """複数年は年ごとの倍率を掛けた目標に合わせ、進捗は 12 × 年数か月で数える"""
+    weekday, holiday, peaks, totals = sites
+    calls = []
+    demand, info = generate_timeline(YEAR, 3, weekday[:5], holiday[:5], peaks[:5], totals[:5],
+                                     peak_growth=0.02, energy_growth=[0.05, -0.01],
+                                     optimize_shape=True, adjust_targets=True, round_decimals=2,
+                                     progress=lambda done, total: calls.append((done, total)),
+                                     return_info=True)
+    _, total = month_stats(build_timeline(YEAR, 3), demand)
+
+    np.testing.assert_allclose(growth_factors(3, [0.05, -0.01]), [1.0, 1.05, 1.05 * 0.99])
+    expected = totals[:5, None, :] * growth_factors(3, [0.05, -0.01])[None, :, None]
+    np.testing.assert_allclose(info['total_kwh'], expected)
+    np.testing.assert_allclose(total, np.round(expected, 2).reshape(5, -1), rtol=0, atol=1e-6)
+    np.testing.assert_allclose(info['peak_kw'], peaks[:5, None, :] * 1.02 ** np.arange(3)[None, :, None])
+    assert calls == [(month, 36) for month in range(1, 37)]
+
+@pytest.mark.parametrize('method', ['bisect', 'newton'])
+def test_solve_cache_gives_identical_output(sites, method):
+    """キャッシュの有無・ヒットの有無によらず、出力・フィット情報はバイト単位で同じ"""
+    weekday, holiday, peaks, totals = sites
+    # 小数第3位より細かい目標も丸めずに解く
+    peaks, totals = peaks + 0.00037, totals + 0.1234
+    settings = dict(optimize_shape=True, adjust_targets=True, round_decimals=2, shape_method=method,
+                    return_info=True)
+    expected, expected_info = generate_sites(YEAR, weekday, holiday, peaks, totals, **settings)
+
+    cache = SolveCache()
+    generate_sites(YEAR, weekday[:20], holiday[:20], peaks[:20], totals[:20], solve_cache=cache, **settings)
+    demand, info = generate_sites(YEAR, weekday, holiday, peaks, totals, solve_cache=cache, **settings)
+
+    assert cache.stats()['hits'] == 20 * 12
+    np.testing.assert_array_equal(demand, expected)
+    for key, value in expected_info.items():
+        np.testing.assert_array_equal(info[key], value)
+
+
+def test_month_cache_recomputes_only_edited_months(sites):
+    """目標を変えた月だけを再計算し、結果は全月をまとめて生成した場合と同じ"""
+    weekday, holiday, peaks, totals = sites
+    settings = dict(drop_leap_day=True, resolution=30, optimize_shape=True, adjust_targets=True,
+                    round_decimals=2)
+    targets = {m: {'peak_kw': peaks[0, m - 1], 'total_kwh': totals[0, m - 1]} for m in range(1, 13)}
+    targets[4] = {}
+    cache = MonthResultCache()
+
+    def check(targets, weekday_coef=weekday[0]):
+        demand, info = cache.generate(YEAR, weekday_coef, holiday[0], targets, **settings)
+        expected, expected_info = generate_year(YEAR, weekday_coef, holiday[0], targets,
+                                                return_info=True, **settings)
+        np.testing.assert_array_equal(demand, expected)
+        for key, value in expected_info.items():
+            np.testing.assert_array_equal(info[key], value)
+        return cache.last_recomputed
+
+    assert check(targets) == list(range(1, 13))
+    assert check(targets) == []
+    targets[3] = {'peak_kw': 120.0, 'total_kwh': 40000.0}
+    targets[4] = {'peak_kw': 80.0, 'total_kwh': 30000.0}
+    assert check(targets) == [3, 4]
+    # 係数を変えるとどの月の形も変わるので全月を再計算する
+    edited = weekday[0].copy()
+    edited[10] *= 0.9
+    assert check(targets, edited) == list(range(1, 13))
+
+
+def test_progress_reports_each_month_without_changing_output(sites):
+    weekday, holiday, peaks, totals = sites
+    settings = dict(optimize_shape=True, adjust_targets=True, round_decimals=2)
+    calls = []
+    expected = generate_sites(YEAR, weekday, holiday, peaks, totals, **settings)
+    demand = generate_sites(YEAR, weekday, holiday, peaks, totals,
+                            progress=lambda done, total: calls.append((done, total)), **settings)
+
+    np.testing.assert_array_equal(demand, expected)
+    assert calls == [(month, 12) for month in range(1, 13)]
+
+
+def test_progress_callback_can_stop_a_job(sites):
+    """進捗の報告でキャンセルを確認し、生成の途中で止める"""
+    weekday, holiday, peaks, totals = sites
+    runner = JobRunner(max_workers=1)
+    months = []
+
+    def work(job):
+        def progress(done, total):
+            months.append(done)
+            if done == 3:
+                job.cancel()
+            job.update(done / total)
+        return generate_sites(YEAR, weekday, holiday, peaks, totals, optimize_shape=True,
+                              adjust_targets=True, progress=progress)
+
+    job = runner.submit(work)
+    job.future.result()
+    runner.shutdown()
+    assert job.status == CANCELLED
+    assert months == [1, 2, 3]
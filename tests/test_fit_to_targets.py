@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from demand_engine import build_calendar, build_timeline, fit_to_targets, month_bounds
+
+
+def noisy_demand(calendar, n_sites, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(5, 80, (n_sites, len(calendar['period'])))
+
+
+def month_stats(calendar, demand):
+    starts, _ = month_bounds(calendar['period'])
+    return (np.maximum.reduceat(demand, starts, axis=1),
+            np.add.reduceat(demand, starts, axis=1) * calendar['interval_hours'])
+
+
+@pytest.mark.parametrize('resolution', [60, 30, 15])
+def test_rounded_totals_are_exact(resolution):
+    """丸め後の月合計は目標と一致し、ピークは目標ちょうど（超えない）"""
+    calendar = build_calendar(2024, resolution=resolution)
+    demand = noisy_demand(calendar, 20)
+    rng = np.random.default_rng(1)
+    peaks = np.round(rng.uniform(60, 120, (20, 12)), 2)
+    totals = np.round(peaks * rng.uniform(0.3, 0.9, (20, 12)) * 24 * 30, 3)
+
+    fit_to_targets(demand, peaks, totals, calendar['period'], calendar['interval_hours'], decimals=2)
+    peak, total = month_stats(calendar, demand)
+
+    units = np.round(demand * 100)
+    np.testing.assert_array_equal(units / 100, demand)
+    # 合計は 0.01 kW × コマ数の単位で目標（の丸め）に一致する
+    np.testing.assert_array_equal(np.add.reduceat(units, month_bounds(calendar['period'])[0], axis=1),
+                                  np.round(totals / calendar['interval_hours'] * 100))
+    np.testing.assert_allclose(total, totals, atol=0.01 * calendar['interval_hours'])
+    np.testing.assert_array_equal(peak, peaks)
+    assert (demand >= 0).all()
+
+
+def test_without_rounding_matches_targets():
+    calendar = build_calendar(2025)
+    demand = noisy_demand(calendar, 5)
+    peaks = np.full((5, 12), 100.0)
+    totals = np.full((5, 12), 40000.0)
+
+    fit_to_targets(demand, peaks, totals, calendar['period'])
+    peak, total = month_stats(calendar, demand)
+    np.testing.assert_allclose(peak, peaks)
+    np.testing.assert_allclose(total, totals)
+
+
+def test_total_above_peak_capacity_keeps_total():
+    """合計 > コマ数 × ピークの月は合計を優先し、ピークは目標を超える"""
+    calendar = build_calendar(2024)
+    demand = noisy_demand(calendar, 1)
+    peaks = np.full((1, 12), 50.0)
+    totals = np.full((1, 12), 50.0 * 24 * 31 * 1.2)
+
+    fit_to_targets(demand, peaks, totals, calendar['period'], decimals=2)
+    peak, total = month_stats(calendar, demand)
+    np.testing.assert_allclose(total, totals, atol=1e-6)
+    assert (peak > peaks).all()
+
+
+def test_nan_months_are_untouched():
+    calendar = build_calendar(2024)
+    demand = noisy_demand(calendar, 2)
+    original = demand.copy()
+    peaks = np.full((2, 12), 100.0)
+    totals = np.full((2, 12), 30000.0)
+    peaks[1, 6] = np.nan
+
+    fit_to_targets(demand, peaks, totals, calendar['period'], decimals=2)
+    in_july = calendar['month'] == 7
+    np.testing.assert_array_equal(demand[1, in_july], original[1, in_july])
+    assert not np.array_equal(demand[0, in_july], original[0, in_july])
+
+
+def test_multi_year_periods():
+    """複数年のカレンダーでは (拠点数, 12 × 年数) の目標を期間ごとに合わせる"""
+    calendar = build_timeline(2023, 2)
+    demand = noisy_demand(calendar, 3)
+    peaks = np.tile(np.linspace(80, 100, 24), (3, 1))
+    totals = peaks * 24 * 20
+
+    fit_to_targets(demand, peaks, totals, calendar['period'], decimals=2)
+    peak, total = month_stats(calendar, demand)
+    np.testing.assert_allclose(peak, np.round(peaks, 2))
+    np.testing.assert_allclose(total, np.round(totals, 2), atol=1e-6)
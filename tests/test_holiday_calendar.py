@@ -0,0 +1,77 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from demand_engine import build_calendar
+from holiday_calendar import DEFAULT_CLOSURES, holiday_day_mask, is_holiday, japanese_holidays
+
+
+def dates(year, *month_days):
+    return [datetime.date(year, month, day) for month, day in month_days]
+
+
+def test_2024_holidays_with_substitutes():
+    holidays = japanese_holidays(2024)
+    assert list(holidays) == dates(
+        2024, (1, 1), (1, 8), (2, 11), (2, 12), (2, 23), (3, 20), (4, 29), (5, 3), (5, 4), (5, 5),
+        (5, 6), (7, 15), (8, 11), (8, 12), (9, 16), (9, 22), (9, 23), (10, 14), (11, 3), (11, 4),
+        (11, 23),
+    )
+    # 日曜の祝日の翌日は振替休日（5/3〜5/5 が続く年は 5/6）
+    assert all(holidays[d] == "振替休日" for d in dates(2024, (2, 12), (5, 6), (8, 12), (9, 23), (11, 4)))
+
+
+def test_citizens_holiday_between_holidays():
+    # 敬老の日と秋分の日に挟まれた平日は国民の休日
+    assert japanese_holidays(2026)[datetime.date(2026, 9, 22)] == "国民の休日"
+    assert datetime.date(2025, 9, 22) not in japanese_holidays(2025)
+
+
+def test_special_years():
+    holidays_2019 = japanese_holidays(2019)
+    assert holidays_2019[datetime.date(2019, 5, 1)] == "天皇の即位の日"
+    assert holidays_2019[datetime.date(2019, 4, 30)] == "国民の休日"
+    assert holidays_2019[datetime.date(2019, 5, 2)] == "国民の休日"
+    # 東京オリンピックに伴う移動
+    holidays_2020 = japanese_holidays(2020)
+    assert holidays_2020[datetime.date(2020, 7, 24)] == "スポーツの日"
+    assert holidays_2020[datetime.date(2020, 8, 10)] == "山の日"
+    assert datetime.date(2020, 10, 12) not in holidays_2020
+
+
+def test_equinox_days():
+    assert datetime.date(2025, 3, 20) in japanese_holidays(2025)
+    assert datetime.date(2025, 9, 23) in japanese_holidays(2025)
+    assert datetime.date(2028, 9, 22) in japanese_holidays(2028)
+
+
+def test_out_of_range_year():
+    with pytest.raises(ValueError):
+        japanese_holidays(1948)
+
+
+def test_day_mask_includes_weekends_and_closures():
+    mask = holiday_day_mask(2024)
+    days = np.arange('2024-01-01', '2025-01-01', dtype='datetime64[D]')
+    assert len(mask) == 366
+    weekend = (days.view('int64') + 3) % 7 >= 5   # 1970-01-01 は木曜（月曜 = 0 で 3）
+    assert mask[weekend].all()
+    # 年末年始の休業日（既定）
+    for closure in DEFAULT_CLOSURES:
+        month, day = map(int, closure.split('-'))
+        assert is_holiday(datetime.date(2024, month, day))
+    assert not is_holiday(datetime.date(2024, 1, 2), closures=())
+    assert not is_holiday(datetime.date(2024, 1, 9))
+    # 特定日の休業日
+    assert is_holiday(datetime.date(2024, 8, 14), closures=("2024-08-14",))
+    assert not is_holiday(datetime.date(2025, 8, 14), closures=("2024-08-14",))
+    # 土日 104 日 + 平日の祝日 14 日（21 日のうち 7 日は土日）+ 平日の休業日 4 日
+    assert mask.sum() == 104 + 14 + 4
+
+
+def test_calendar_slots_follow_day_mask():
+    calendar = build_calendar(2024, resolution=30)
+    assert len(calendar['holiday']) == 366 * 48
+    np.testing.assert_array_equal(calendar['holiday'].reshape(366, 48)[:, 0], holiday_day_mask(2024))
+    assert len(build_calendar(2024, drop_leap_day=True)['index']) == 8760
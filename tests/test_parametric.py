@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from demand_engine import generate_sites
+from parametric import (
+    concat_profiles, decode_profiles, decode_site, iter_decoded, load_profiles, pack_profiles, save_profiles,
+)
+
+YEAR = 2024
+
+
+@pytest.mark.parametrize('resolution, dtype', [(60, np.float64), (30, np.float32)])
+def test_archive_round_trip_reproduces_generation(sites, tmp_path, resolution, dtype):
+    """保存・読み込みしたアーカイブを展開すると、生成時と同じ値になる"""
+    weekday, holiday, peaks, totals = sites
+    settings = dict(resolution=resolution, adjust_targets=True, round_decimals=2, dtype=dtype)
+    demand, info = generate_sites(YEAR, weekday, holiday, peaks, totals, optimize_shape=True,
+                                  return_info=True, **settings)
+    site_ids = [f"S{i:03d}" for i in range(len(peaks))]
+
+    path = tmp_path / "profiles.npz"
+    save_profiles(path, pack_profiles(site_ids, weekday, holiday, peaks, totals, info, YEAR, **settings))
+    archive = load_profiles(path)
+
+    decoded = decode_profiles(archive)
+    assert decoded.dtype == dtype
+    np.testing.assert_array_equal(decoded, demand)
+    np.testing.assert_array_equal(decode_site(archive, "S007"), demand[7])
+    np.testing.assert_array_equal(np.concatenate([d for _, d in iter_decoded(archive, chunksize=16)]), demand)
+    # 係数は重複を除いて保存する
+    assert len(archive['patterns']) < len(site_ids)
+
+
+def test_concat_profiles(sites):
+    weekday, holiday, peaks, totals = sites
+    demand, info = generate_sites(YEAR, weekday, holiday, peaks, totals, optimize_shape=True,
+                                  return_info=True)
+    parts = [
+        pack_profiles(np.arange(start, start + 30), weekday[start:start + 30], holiday[start:start + 30],
+                      peaks[start:start + 30], totals[start:start + 30],
+                      {key: value[start:start + 30] for key, value in info.items()}, YEAR)
+        for start in (0, 30)
+    ]
+    np.testing.assert_array_equal(decode_profiles(concat_profiles(parts)), demand)
+
+
+def test_unknown_site_and_newer_version(sites, tmp_path):
+    weekday, holiday, peaks, totals = sites
+    _, info = generate_sites(YEAR, weekday[:2], holiday[:2], peaks[:2], totals[:2], return_info=True)
+    archive = pack_profiles(["a", "b"], weekday[:2], holiday[:2], peaks[:2], totals[:2], info, YEAR)
+    with pytest.raises(KeyError):
+        decode_site(archive, "c")
+
+    archive['version'] = np.int32(99)
+    save_profiles(tmp_path / "future.npz", archive)
+    with pytest.raises(ValueError):
+        load_profiles(tmp_path / "future.npz")
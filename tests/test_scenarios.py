@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from demand_engine import (
+    TOO_LOW, build_calendar, build_timeline, check_feasibility, generate_sites, generate_timeline,
+)
+from scenarios import base_targets, generate_scenarios
+
+YEAR = 2024
+
+
+@pytest.fixture
+def base(sites):
+    weekday, holiday, peaks, totals = sites
+    # generate_demand.py の出力と同じく微調整なし（負荷率不足の月はピークが目標に届かない）
+    return generate_sites(YEAR, weekday[:10], holiday[:10], peaks[:10], totals[:10], optimize_shape=True,
+                          round_decimals=2)
+
+
+@pytest.mark.parametrize('method', ['ar1', 'day'])
+def test_scenarios_keep_base_monthly_peaks_and_totals(sites, base, method):
+    """どの実現値も月最大・月合計は元のデマンドと同じ（目標どおりに作れない月も含む）"""
+    weekday, holiday, peaks, totals = sites
+    calendar = build_calendar(YEAR)
+    scenarios = generate_scenarios(calendar, base, 20, method=method, seed=0, round_decimals=2,
+                                   chunksize=8, dtype=np.float64)
+    assert scenarios.shape == (10, 20) + base.shape[1:]
+
+    base_peak, base_total = base_targets(calendar, base)
+    peak, total = (x.reshape(10, 20, 12) for x in base_targets(calendar, scenarios.reshape(-1, base.shape[1])))
+    np.testing.assert_allclose(peak, np.broadcast_to(base_peak[:, None, :], peak.shape), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(total, np.broadcast_to(base_total[:, None, :], total.shape), rtol=0, atol=1e-6)
+    np.testing.assert_array_equal(np.round(scenarios, 2), scenarios)
+    assert not np.array_equal(scenarios[:, 0], base)
+
+    # 負荷率不足の月は目標のピークではなく、届かなかった元のデマンドのピークになる
+    low = check_feasibility(YEAR, weekday[:10], holiday[:10], peaks[:10], totals[:10])['status'] == TOO_LOW
+    assert low.any()
+    assert (base_peak[low] < peaks[:10][low]).all()
+
+
+def test_seed_gives_same_result_with_workers(base):
+    calendar = build_calendar(YEAR)
+    serial = generate_scenarios(calendar, base[:3], 10, seed=42, chunksize=4)
+    parallel = generate_scenarios(calendar, base[:3], 10, seed=42, chunksize=4, workers=2)
+    np.testing.assert_array_equal(parallel, serial)
+
+
+def test_missing_periods_stay_nan(sites):
+    """複数年でも期間ごとに合わせ、データの無い月は NaN のまま"""
+    weekday, holiday, peaks, totals = sites
+    peaks = peaks[:2].copy()
+    peaks[0, 5] = np.nan
+    calendar = build_timeline(YEAR, 2)
+    base = generate_timeline(YEAR, 2, weekday[:2], holiday[:2], peaks, totals[:2], energy_growth=0.03,
+                             optimize_shape=True, adjust_targets=True, round_decimals=2)
+    scenarios = generate_scenarios(calendar, base, 5, seed=0, round_decimals=2, dtype=np.float64)
+
+    missing = np.isnan(base)
+    assert missing[0].any() and not missing[1].any()
+    np.testing.assert_array_equal(np.isnan(scenarios), np.broadcast_to(missing[:, None, :], scenarios.shape))
+    base_peak, base_total = base_targets(calendar, base)
+    peak, total = (x.reshape(2, 5, 24) for x in base_targets(calendar, scenarios.reshape(-1, base.shape[1])))
+    np.testing.assert_allclose(total, np.broadcast_to(base_total[:, None, :], total.shape), rtol=0, atol=1e-6)
+    np.testing.assert_allclose(peak, np.broadcast_to(base_peak[:, None, :], peak.shape), rtol=0, atol=1e-9)
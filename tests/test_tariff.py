@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from demand_engine import build_calendar
+from tariff import TARIFF_PRESETS, calculate_bills, load_tariff, ratchet, validate_tariff
+
+TOU = "高圧 業務用 季節別時間帯別（例）"
+
+
+def test_ratchet_without_history_uses_months_so_far():
+    max_demand = np.array([[10.0, 30, 20, 5, 5, 5, 5, 5, 5, 5, 5, 5]])
+    np.testing.assert_array_equal(ratchet(max_demand, 12), [[10, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30]])
+    np.testing.assert_array_equal(ratchet(max_demand, 3), [[10, 30, 30, 30, 20, 5, 5, 5, 5, 5, 5, 5]])
+    np.testing.assert_array_equal(ratchet(max_demand, 1), max_demand)
+
+
+def test_ratchet_history_drops_out_after_months():
+    """前年の最大需要電力は、当月を含む直近 12 か月から外れるまで契約電力に残る"""
+    max_demand = np.full((1, 12), 10.0)
+    history = np.full((1, 11), 20.0)
+    history[0, 0] = 50.0   # 11 か月前（翌年1月の窓にだけ入る）
+    np.testing.assert_array_equal(ratchet(max_demand, 12, history)[0],
+                                  [50] + [20] * 10 + [10])
+
+
+@pytest.mark.parametrize('n_history', [0, 2, 11, 24])
+def test_ratchet_history_of_any_length(n_history):
+    """足りない過去は記録なしとして扱い、長い過去は直近の months - 1 か月だけを使う"""
+    max_demand = np.full((2, 12), 10.0)
+    history = np.full((2, n_history), 40.0)
+    contract = ratchet(max_demand, 12, history)
+    assert contract.shape == (2, 12)
+    # 直近の1か月（前年12月）は翌年11月まで窓に残る
+    n_carried = 11 if n_history else 0
+    np.testing.assert_array_equal(contract[:, :n_carried], 40.0)
+    np.testing.assert_array_equal(contract[:, n_carried:], 10.0)
+
+
+def test_bills_against_hand_calculation():
+    calendar = build_calendar(2024)
+    tariff = load_tariff(TOU)
+    demand = np.full((1, len(calendar['period'])), 50.0)
+    demand[0, calendar['month'] == 8] = 80.0
+    bills = calculate_bills(calendar, demand, tariff)
+
+    # 昼間 = 平日 8〜22時、他は夜間。夏季 7〜9月
+    day = ~calendar['holiday'] & (calendar['hour'] >= 8) & (calendar['hour'] < 22)
+    month = calendar['month']
+    for m in (1, 8, 12):
+        in_month = month == m
+        day_kwh = demand[0, in_month & day].sum()
+        night_kwh = demand[0, in_month & ~day].sum()
+        season = "夏季" if m in (7, 8, 9) else "その他季"
+        rates = tariff['energy_rates'][season]
+        contract = 50.0 if m < 8 else 80.0
+        # 力率 100% の基本料金は (185 - 100) / 100 = 0.85 倍
+        expected = (tariff['basic_rate'] * contract * 0.85
+                    + day_kwh * rates['昼間'] + night_kwh * rates['夜間']
+                    + (day_kwh + night_kwh) * sum(tariff['adders'].values()))
+        assert bills['contract_kw'][0, m - 1] == contract
+        assert bills['total'][0, m - 1] == pytest.approx(expected)
+        band_kwh = dict(zip(bills['bands'], bills['band_kwh'][0, m - 1]))
+        assert band_kwh == {'昼間': day_kwh, '夜間': night_kwh}
+
+
+def test_bills_with_short_history_and_power_factor():
+    calendar = build_calendar(2024, resolution=15)
+    tariff = dict(TARIFF_PRESETS[TOU], power_factor=90)
+    demand = np.full((3, len(calendar['period'])), 40.0)
+    bills = calculate_bills(calendar, demand, tariff, history=np.full((3, 2), 100.0))
+
+    np.testing.assert_array_equal(bills['contract_kw'][:, :11], 100.0)
+    np.testing.assert_array_equal(bills['contract_kw'][:, 11], 40.0)
+    # 力率 90% の基本料金は (185 - 90) / 100 = 0.95 倍
+    np.testing.assert_allclose(bills['basic_charge'][:, 11], tariff['basic_rate'] * 40.0 * 0.95)
+
+
+def test_validate_tariff_rejects_gaps():
+    tariff = dict(TARIFF_PRESETS[TOU])
+    tariff['bands'] = {'weekday': [[0, 8, "夜間"], [9, 24, "昼間"]], 'holiday': [[0, 24, "夜間"]]}
+    with pytest.raises(ValueError):
+        validate_tariff(tariff)